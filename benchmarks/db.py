@@ -0,0 +1,323 @@
+"""
+Micro-benchmarks of the database layer: engine setup, UserSession and ReceiptSession.
+
+Every benchmark is run sequentially (latency of a single call), with enough concurrent callers to saturate
+the connection pool, and in bulk. Statements per second, per-call latency and the time spent waiting
+for a connection from the pool are reported and written to JSON, so pool settings can be compared.
+The bulk methods are also run sequentially with several batch sizes to show the cost of one row.
+
+The database is taken from the DB_* environment variables or a disposable Postgres is started
+with --temp-postgres. Only rows in a reserved range of user ids are written and they are removed afterwards.
+
+Usage::
+
+    python -m benchmarks.db --temp-postgres --calls 2000 --pool-size 20 --max-overflow 200 --batch-sizes 1,100,10000
+"""
+
+import argparse
+import asyncio
+import functools
+import itertools
+import json
+import os
+import subprocess
+import time
+from datetime import datetime, timezone
+from decimal import Decimal
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence
+
+from environs import Env
+from sqlalchemy import delete, text
+
+from benchmarks.loadtest import summarize
+from benchmarks.postgres import TemporaryPostgres
+from bot.data.config import DatabaseConfig
+from bot.services.metrics import db_checkout_duration
+from database.commands.requests import RequestsDistributor
+from database.models.receipts import Receipt
+from database.models.users import User
+from database.setup import create_engine, create_session_pool, run_migrations
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = ROOT / "benchmarks" / "results"
+
+# Benchmark rows are written in a range of ids that real Telegram users don't have
+FIRST_USER_ID = 9_000_000_000_000
+
+
+def make_receipt(user_id: int, number: int) -> Dict:
+    return dict(
+        payment_id=f"PAYID-DB{number:016d}",
+        item_index=0,
+        user_id=user_id,
+        payer_email="benchmark@example.com",
+        payer_first_name="Load",
+        payer_last_name="Test",
+        product_name="Vase",
+        product_description="Benchmark item",
+        price=Decimal("10.56"),
+        currency="CAD",
+        quantity=1,
+    )
+
+
+class CheckoutWait:
+    """
+    Difference of the pool checkout histogram between the start and the end of a benchmark.
+    """
+
+    def __init__(self):
+        self._child = db_checkout_duration.labels()
+        self._counts = list(self._child.counts)
+        self._sum = self._child.sum
+
+    def report(self) -> Dict[str, float]:
+        counts = [after - before for after, before in zip(self._child.counts, self._counts)]
+        total = sum(counts)
+        if not total:
+            return {"count": 0}
+
+        def upper_bound(share: float) -> float:
+            cumulative = 0
+            for bound, count in zip(db_checkout_duration.buckets + (float("inf"),), counts):
+                cumulative += count
+                if cumulative >= share * total:
+                    return bound * 1000
+            return float("inf")
+
+        return {
+            "count": total,
+            "mean": round((self._child.sum - self._sum) / total * 1000, 3),
+            "p50_le": upper_bound(0.50),
+            "p95_le": upper_bound(0.95),
+            "p99_le": upper_bound(0.99),
+        }
+
+
+class DatabaseBenchmark:
+    """
+    Runs the benchmarks against one engine configuration.
+
+    Attributes
+    ----------
+    config [DatabaseConfig] -> database configuration.
+    options [Dict] -> pool settings passed to create_engine.
+    calls [int] -> number of calls of every single-row benchmark.
+    batch_size [int] -> number of rows in every bulk call.
+    batch_sizes [Sequence[int]] -> batch sizes of the per-row cost benchmark of the bulk methods.
+    """
+
+    def __init__(
+            self,
+            config: DatabaseConfig,
+            options: Dict,
+            calls: int = 1000,
+            batch_size: int = 500,
+            batch_sizes: Sequence[int] = (1, 100, 10_000)
+    ):
+        self.config = config
+        self.options = options
+        self.calls = calls
+        self.batch_size = batch_size
+        self.batch_sizes = batch_sizes
+
+        self.engine = create_engine(config, **options)
+        self.session_pool = create_session_pool(self.engine)
+        self._ids = itertools.count(FIRST_USER_ID)
+
+    @property
+    def saturation(self) -> int:
+        # More callers than the pool can serve at once, so some of them wait for a connection
+        return self.options["pool_size"] + self.options["max_overflow"] + 50
+
+    async def measure(
+            self,
+            calls: int,
+            concurrency: int,
+            call: Callable[[], Awaitable[int]]
+    ) -> Dict:
+        """
+        Runs the call the given number of times with the given number of concurrent callers.
+
+        :param calls: number of calls.
+        :param concurrency: number of concurrent callers.
+        :param call: coroutine function that makes one call and returns the number of written rows.
+        :return: statistics of the benchmark.
+        """
+
+        latencies: List[float] = []
+        rows = 0
+        remaining = iter(range(calls))
+
+        async def caller() -> None:
+            nonlocal rows
+            for _ in remaining:
+                started = time.perf_counter()
+                rows += await call()
+                latencies.append(time.perf_counter() - started)
+
+        wait = CheckoutWait()
+        started = time.perf_counter()
+        await asyncio.gather(*[caller() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - started
+
+        return {
+            "calls": calls,
+            "concurrency": concurrency,
+            "seconds": round(elapsed, 3),
+            "statements_per_s": round(calls / elapsed, 1),
+            "rows_per_s": round(rows / elapsed, 1),
+            "us_per_row": round(elapsed / rows * 1_000_000, 2) if rows else None,
+            "latency_ms": summarize(latencies),
+            "checkout_wait_ms": wait.report(),
+        }
+
+    async def create_user(self) -> int:
+        user_id = next(self._ids)
+        async with self.session_pool() as session:
+            await RequestsDistributor(session).users.create_user(
+                user_id=user_id, full_name=f"Load {user_id}", username=f"user{user_id}"
+            )
+        return 1
+
+    async def create_receipt(self) -> int:
+        number = next(self._ids)
+        receipt = make_receipt(FIRST_USER_ID, number)
+        receipt.pop("payment_id")
+        receipt.pop("item_index")
+        async with self.session_pool() as session:
+            await RequestsDistributor(session).receipts.create_receipt(**receipt)
+        return 1
+
+    async def upsert_users(self, batch_size: Optional[int] = None) -> int:
+        users = []
+        for _ in range(batch_size or self.batch_size):
+            user_id = next(self._ids)
+            users.append(dict(user_id=user_id, full_name=f"Load {user_id}", username=f"user{user_id}"))
+        async with self.session_pool() as session:
+            await RequestsDistributor(session).users.upsert_many(users)
+        return len(users)
+
+    async def create_receipts(self, batch_size: Optional[int] = None) -> int:
+        receipts = [make_receipt(FIRST_USER_ID, next(self._ids)) for _ in range(batch_size or self.batch_size)]
+        async with self.session_pool() as session:
+            await RequestsDistributor(session).receipts.create_many(receipts)
+        return len(receipts)
+
+    async def engine_setup(self, repeats: int = 5) -> Dict:
+        """
+        Measures the creation of a new engine until the first query is answered (a cold start of a worker).
+        """
+
+        durations = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            engine = create_engine(self.config, **self.options)
+            async with engine.connect() as connection:
+                await connection.execute(text("SELECT 1"))
+            durations.append(time.perf_counter() - started)
+            await engine.dispose()
+        return {"calls": repeats, "latency_ms": summarize(durations)}
+
+    async def cleanup(self) -> None:
+        async with self.session_pool() as session:
+            await session.execute(delete(Receipt).where(Receipt.user_id >= FIRST_USER_ID))
+            await session.execute(delete(User).where(User.user_id >= FIRST_USER_ID))
+            await session.commit()
+
+    async def run(self) -> Dict:
+        # The distributors are created without the upsert cache and the write buffer, so every call
+        # reaches the database
+        await run_migrations(self.engine)
+        bulk_calls = max(1, self.calls // self.batch_size)
+
+        results = {"engine_setup": await self.engine_setup()}
+        try:
+            for name, call, calls in (
+                    ("create_user", self.create_user, self.calls),
+                    ("create_receipt", self.create_receipt, self.calls),
+                    ("upsert_many", self.upsert_users, bulk_calls),
+                    ("create_many", self.create_receipts, bulk_calls),
+            ):
+                results[f"{name}_single"] = await self.measure(calls, 1, call)
+                results[f"{name}_saturated"] = await self.measure(calls, self.saturation, call)
+                print(f"{name}: {results[f'{name}_single']['statements_per_s']} statements/s single, "
+                      f"{results[f'{name}_saturated']['statements_per_s']} statements/s saturated")
+
+            # Cost of one row by batch size, at least a few calls of the largest batches
+            for name, call in (("upsert_many", self.upsert_users), ("create_many", self.create_receipts)):
+                for batch_size in self.batch_sizes:
+                    calls = max(3, self.calls // batch_size)
+                    result = await self.measure(calls, 1, functools.partial(call, batch_size))
+                    results[f"{name}_batch_{batch_size}"] = result
+                    print(f"{name} batch {batch_size}: {result['us_per_row']} us/row, {result['rows_per_s']} rows/s")
+        finally:
+            await self.cleanup()
+            await self.engine.dispose()
+        return results
+
+
+def get_commit() -> Optional[str]:
+    try:
+        # Uncommitted changes are marked with "-dirty", so a result is never attributed to a commit it doesn't match
+        return subprocess.check_output(["git", "describe", "--always", "--dirty"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def main(args: argparse.Namespace) -> Dict:
+    options = dict(
+        pool_size=args.pool_size,
+        max_overflow=args.max_overflow,
+        query_cache_size=args.query_cache_size,
+    )
+
+    postgres = None
+    if args.temp_postgres:
+        postgres = TemporaryPostgres(max_connections=args.pool_size + args.max_overflow + 20).start()
+        os.environ.update(postgres.env())
+
+    try:
+        config = DatabaseConfig.from_env(Env())
+        benchmark = DatabaseBenchmark(
+            config, options, calls=args.calls, batch_size=args.batch_size, batch_sizes=args.batch_sizes
+        )
+        results = await benchmark.run()
+    finally:
+        if postgres is not None:
+            postgres.stop()
+
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+    report = {
+        "timestamp": stamp,
+        "commit": get_commit(),
+        "settings": {**options, "calls": args.calls, "batch_size": args.batch_size,
+                     "batch_sizes": args.batch_sizes, "temp_postgres": args.temp_postgres},
+        "results": results,
+    }
+
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    output = Path(args.output) if args.output else RESULTS_DIR / f"db-{stamp}.json"
+    output.write_text(json.dumps(report, indent=2))
+    print(f"Results: {output}")
+    return report
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Micro-benchmarks of the database layer.")
+    parser.add_argument("--temp-postgres", action="store_true",
+                        help="start a disposable Postgres with initdb/pg_ctl instead of using DB_* variables")
+    parser.add_argument("--calls", type=int, default=1000, help="number of calls of every single-row benchmark")
+    parser.add_argument("--batch-size", type=int, default=500, help="number of rows in every bulk call")
+    parser.add_argument("--batch-sizes", type=lambda value: [int(size) for size in value.split(",")],
+                        default=[1, 100, 10_000], help="comma-separated batch sizes of the per-row cost benchmark")
+    parser.add_argument("--pool-size", type=int, default=20)
+    parser.add_argument("--max-overflow", type=int, default=200)
+    parser.add_argument("--query-cache-size", type=int, default=1200)
+    parser.add_argument("--output", help="path of the JSON results, benchmarks/results/ by default")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
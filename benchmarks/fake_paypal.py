@@ -0,0 +1,102 @@
+import asyncio
+import copy
+import itertools
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from aiohttp import web
+
+
+class FakePaypal:
+    """
+    In-process fake of the PayPal v1 payments API, the bot is pointed at it with PAYPAL_API_URL.
+
+    It implements the endpoints used by PaypalClient: OAuth token, create, find and execute a payment.
+    Payments are kept in memory, a payment can be executed only once like on PayPal.
+
+    Attributes
+    ----------
+    latency [float] -> delay in seconds added to every response, to imitate the network.
+    calls [Counter] -> number of calls by endpoint.
+    payments [Dict] -> created payments by id.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self.payments: Dict[str, Dict] = {}
+
+        self._ids = itertools.count(1)
+
+    def add_payment(self, payment: Dict) -> Dict:
+        """
+        Stores a payment as if it was created through the API.
+
+        :param payment: payment resource (intent, payer, redirect_urls, transactions).
+        :return: created payment with its id and links.
+        """
+
+        number = next(self._ids)
+        payment = copy.deepcopy(payment)
+        payment.update(
+            id=f"PAYID-BENCH{number:012d}",
+            state="created",
+            create_time=datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            links=[
+                {"href": f"https://www.sandbox.paypal.com/checkoutnow?token=EC-{number}", "rel": "approval_url",
+                 "method": "REDIRECT"},
+            ],
+        )
+        self.payments[payment["id"]] = payment
+        return payment
+
+    async def _respond(self, endpoint: str, body: Dict, status: int = 200) -> web.Response:
+        self.calls[endpoint] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return web.json_response(body, status=status)
+
+    def _find(self, request: web.Request) -> Optional[Dict]:
+        return self.payments.get(request.match_info["payment_id"])
+
+    async def token(self, request: web.Request) -> web.Response:
+        return await self._respond("token", {"access_token": "benchmark", "token_type": "Bearer", "expires_in": 32400})
+
+    async def create(self, request: web.Request) -> web.Response:
+        return await self._respond("create", self.add_payment(await request.json()), status=201)
+
+    async def find(self, request: web.Request) -> web.Response:
+        payment = self._find(request)
+        if payment is None:
+            return await self._respond("find", {"name": "INVALID_RESOURCE_ID"}, status=404)
+        return await self._respond("find", payment)
+
+    async def execute(self, request: web.Request) -> web.Response:
+        payment = self._find(request)
+        if payment is None:
+            return await self._respond("execute", {"name": "INVALID_RESOURCE_ID"}, status=404)
+        if payment["state"] == "approved":
+            return await self._respond("execute", {"name": "PAYMENT_ALREADY_DONE"}, status=400)
+
+        payer_id = (await request.json())["payer_id"]
+        payment["state"] = "approved"
+        payment["payer"] = {
+            "payment_method": "paypal",
+            "status": "VERIFIED",
+            "payer_info": {
+                "email": f"{payer_id.lower()}@example.com",
+                "first_name": "Load",
+                "last_name": "Test",
+                "payer_id": payer_id,
+            },
+        }
+        return await self._respond("execute", payment)
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v1/oauth2/token", self.token)
+        app.router.add_post("/v1/payments/payment", self.create)
+        app.router.add_get("/v1/payments/payment/{payment_id}", self.find)
+        app.router.add_post("/v1/payments/payment/{payment_id}/execute", self.execute)
+        return app
@@ -0,0 +1,83 @@
+import asyncio
+import json
+import time
+from collections import Counter
+from typing import Dict, List
+
+from aiohttp import web
+
+BOT_ID = 123456789
+
+
+class FakeTelegram:
+    """
+    In-process fake of the Telegram Bot API, the bot is pointed at it with BOT_API_URL.
+
+    Every method answers successfully, messages sent by the bot resolve the futures of the load generator,
+    so the time from an incoming update to the reply of the bot can be measured.
+
+    Attributes
+    ----------
+    latency [float] -> delay in seconds added to every response, to imitate the network.
+    calls [Counter] -> number of calls by method.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = Counter()
+
+        self._message_id = 0
+        self._waiters: Dict[int, List[asyncio.Future]] = {}
+
+    def expect_message(self, chat_id: int) -> asyncio.Future:
+        """
+        Returns a future that's resolved with the time when the bot sends a message to the chat.
+
+        :param chat_id: id of the chat.
+        :return: future with the monotonic time of the message.
+        """
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(chat_id, []).append(future)
+        return future
+
+    def _message(self, chat_id: int, text: str) -> Dict:
+        self._message_id += 1
+        return {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": BOT_ID, "is_bot": True, "first_name": "Benchmark"},
+            "text": text,
+        }
+
+    def _resolve(self, chat_id: int) -> None:
+        waiters = self._waiters.pop(chat_id, [])
+        now = time.monotonic()
+        for future in waiters:
+            if not future.done():
+                future.set_result(now)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        data = await request.post()
+        self.calls[method] += 1
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if method == "getme":
+            result = {"id": BOT_ID, "is_bot": True, "first_name": "Benchmark", "username": "benchmark_bot"}
+        elif method in ("sendmessage", "senddocument"):
+            chat_id = int(data["chat_id"])
+            result = self._message(chat_id, data.get("text", ""))
+            self._resolve(chat_id)
+        else:
+            result = True
+
+        return web.json_response({"ok": True, "result": result}, dumps=json.dumps)
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
@@ -0,0 +1,384 @@
+"""
+End-to-end load test of the bot.
+
+The bot is started from bot/__main__.py in a separate process and pointed at the fake Bot API and the fake
+PayPal that run in this process. Virtual users send /test_payment updates to the webhook and return to
+/payment/success after a payment, every request is timed until it's acknowledged and until the bot sends
+its reply to the user. A Postgres database is required, it's taken from the DB_* environment variables
+or a disposable one is started with --temp-postgres.
+
+Usage::
+
+    python -m benchmarks.loadtest --scenario mixed --duration 30 --concurrency 50
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import aiohttp
+from aiohttp import web
+
+from benchmarks.fake_paypal import FakePaypal
+from benchmarks.postgres import TemporaryPostgres
+from benchmarks.fake_telegram import FakeTelegram, BOT_ID
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = ROOT / "benchmarks" / "results"
+SECRET = "benchmark-secret"
+FIRST_USER_ID = 10_000_000
+
+ITEMS = [
+    {"name": "Something precious", "description": "Benchmark item", "sku": "Yes", "price": "3.89",
+     "currency": "CAD", "quantity": 1},
+    {"name": "Vase", "description": "Benchmark item", "sku": "Vase", "price": "10.56", "currency": "CAD",
+     "quantity": 1},
+]
+
+
+def get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    """
+    Function to calculate the latency statistics in milliseconds.
+
+    :param values: latencies in seconds.
+    :return: dict with count, mean, p50, p95, p99 and max.
+    """
+
+    if not values:
+        return {"count": 0}
+
+    values = sorted(values)
+
+    def percentile(share: float) -> float:
+        return round(values[min(len(values) - 1, int(share * len(values)))] * 1000, 3)
+
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values) * 1000, 3),
+        "p50": percentile(0.50),
+        "p95": percentile(0.95),
+        "p99": percentile(0.99),
+        "max": round(values[-1] * 1000, 3),
+    }
+
+
+class Scenario:
+    """
+    Results of one kind of request.
+
+    Attributes
+    ----------
+    ack [List[float]] -> time until the bot answered the HTTP request.
+    e2e [List[float]] -> time until the bot sent the reply to the user.
+    statuses [Dict[int, int]] -> number of responses by HTTP status.
+    timeouts [int] -> number of requests whose reply didn't come in time.
+    errors [int] -> number of requests that failed on the client side.
+    """
+
+    def __init__(self):
+        self.ack: List[float] = []
+        self.e2e: List[float] = []
+        self.statuses: Dict[int, int] = {}
+        self.timeouts = 0
+        self.errors = 0
+
+    def report(self, duration: float) -> Dict:
+        return {
+            "requests": sum(self.statuses.values()) + self.errors,
+            "completed": len(self.e2e),
+            "throughput": round(len(self.e2e) / duration, 2),
+            "statuses": {str(status): count for status, count in sorted(self.statuses.items())},
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "ack_latency_ms": summarize(self.ack),
+            "e2e_latency_ms": summarize(self.e2e),
+        }
+
+
+class LoadGenerator:
+    """
+    Closed-loop load generator: every virtual user sends a request, waits for the reply of the bot and repeats.
+
+    Attributes
+    ----------
+    base_url [str] -> url of the bot's web server.
+    telegram [FakeTelegram] -> fake Bot API the bot sends its replies to.
+    paypal [FakePaypal] -> fake PayPal the payments are created in.
+    timeout [float] -> maximum time in seconds to wait for a reply.
+    """
+
+    def __init__(self, base_url: str, telegram: FakeTelegram, paypal: FakePaypal, timeout: float = 10.0):
+        self.base_url = base_url
+        self.telegram = telegram
+        self.paypal = paypal
+        self.timeout = timeout
+        self.scenarios = {"update": Scenario(), "payment": Scenario()}
+
+        self._ids = itertools.count(FIRST_USER_ID)
+
+    async def _measure(self, scenario: Scenario, user_id: int, request) -> None:
+        reply = self.telegram.expect_message(user_id)
+        started = time.monotonic()
+        try:
+            async with request() as response:
+                await response.read()
+                scenario.ack.append(time.monotonic() - started)
+                scenario.statuses[response.status] = scenario.statuses.get(response.status, 0) + 1
+                if response.status >= 300:
+                    reply.cancel()
+                    return
+        except aiohttp.ClientError:
+            scenario.errors += 1
+            reply.cancel()
+            return
+
+        try:
+            replied_at = await asyncio.wait_for(reply, timeout=self.timeout)
+        except asyncio.TimeoutError:
+            scenario.timeouts += 1
+            return
+        scenario.e2e.append(replied_at - started)
+
+    async def send_update(self, session: aiohttp.ClientSession) -> None:
+        user_id = next(self._ids)
+        update = {
+            "update_id": user_id,
+            "message": {
+                "message_id": 1,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private", "first_name": "Load"},
+                "from": {"id": user_id, "is_bot": False, "first_name": "Load", "last_name": str(user_id),
+                         "username": f"user{user_id}"},
+                "text": "/test_payment",
+                "entities": [{"type": "bot_command", "offset": 0, "length": 13}],
+            },
+        }
+        await self._measure(
+            self.scenarios["update"],
+            user_id,
+            lambda: session.post(
+                f"{self.base_url}/webhook", json=update, headers={"X-Telegram-Bot-Api-Secret-Token": SECRET}
+            )
+        )
+
+    async def send_payment(self, session: aiohttp.ClientSession) -> None:
+        user_id = next(self._ids)
+        payment = self.paypal.add_payment({
+            "intent": "sale",
+            "payer": {"payment_method": "paypal"},
+            "transactions": [{
+                "item_list": {"items": ITEMS},
+                "amount": {"total": "14.45", "currency": "CAD"},
+                "description": "Benchmark payment",
+                "custom": str(user_id),
+            }],
+        })
+        params = {"paymentId": payment["id"], "PayerID": f"PAYER{user_id}", "user_id": str(user_id)}
+        await self._measure(
+            self.scenarios["payment"],
+            user_id,
+            lambda: session.get(f"{self.base_url}/payment/success", params=params)
+        )
+
+    async def _virtual_user(self, session: aiohttp.ClientSession, scenario: str, deadline: float) -> None:
+        while time.monotonic() < deadline:
+            kind = scenario if scenario != "mixed" else random.choice(("update", "payment"))
+            if kind == "update":
+                await self.send_update(session)
+            else:
+                await self.send_payment(session)
+
+    async def run(self, scenario: str, duration: float, concurrency: int) -> float:
+        """
+        Runs the virtual users for the given time.
+
+        :param scenario: update, payment or mixed.
+        :param duration: duration of the test in seconds.
+        :param concurrency: number of virtual users.
+        :return: actual duration of the test in seconds.
+        """
+
+        connector = aiohttp.TCPConnector(limit=concurrency)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            started = time.monotonic()
+            deadline = started + duration
+            await asyncio.gather(*[self._virtual_user(session, scenario, deadline) for _ in range(concurrency)])
+            return time.monotonic() - started
+
+
+async def start_site(app: web.Application, port: int) -> web.AppRunner:
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+def start_bot(args: argparse.Namespace, port: int, telegram_url: str, paypal_url: str, log_path: Path):
+    """
+    Starts the bot from bot/__main__.py the same way it's started in production, but with the fake APIs.
+    """
+
+    env = {
+        **os.environ,
+        "PYTHONPATH": os.pathsep.join(filter(None, [str(ROOT), os.environ.get("PYTHONPATH")])),
+        "BOT_TOKEN": f"{BOT_ID}:benchmark",
+        "BOT_API_URL": telegram_url,
+        "BOT_RATE_LIMIT": str(args.rate_limit),
+        "ADMINS": "1",
+        "USE_REDIS": os.environ.get("USE_REDIS", "False"),
+        "PAYPAL_API_URL": paypal_url,
+        "PAYPAL_CLIENT_ID": "benchmark",
+        "PAYPAL_CLIENT_SECRET": "benchmark",
+        "PAYPAL_WEBHOOK_ID": "",
+        "WEB_SERVER_HOST": "127.0.0.1",
+        "WEB_SERVER_PORT": str(port),
+        "WEB_SECRET": SECRET,
+        "BASE_WEBHOOK_URL": f"http://127.0.0.1:{port}",
+        "WEB_WORKERS": str(args.workers),
+        "LOG_SAMPLE_RATE": "0",
+        "CONFIG_RELOAD_INTERVAL": "0",
+    }
+    # The child process gets its own copy of the file descriptor, so the file can be closed right away
+    with open(log_path, "w") as log:
+        return subprocess.Popen(
+            [sys.executable, "__main__.py"], cwd=ROOT / "bot", env=env, stdout=log, stderr=subprocess.STDOUT
+        )
+
+
+async def wait_ready(base_url: str, process: subprocess.Popen, timeout: float = 60.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"The bot exited with code {process.returncode}, see the log.")
+            try:
+                async with session.get(f"{base_url}/metrics") as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.5)
+    raise RuntimeError("The bot didn't start in time.")
+
+
+def get_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def main(args: argparse.Namespace) -> Dict:
+    postgres = None
+    if args.temp_postgres:
+        postgres = TemporaryPostgres().start()
+        os.environ.update(postgres.env())
+
+    try:
+        return await run(args)
+    finally:
+        if postgres is not None:
+            postgres.stop()
+
+
+async def run(args: argparse.Namespace) -> Dict:
+    for variable in ("DB_HOST", "POSTGRES_USER", "POSTGRES_PASSWORD", "POSTGRES_DB"):
+        if variable not in os.environ:
+            raise SystemExit(f"{variable} is not set, the load test needs a Postgres database (or --temp-postgres).")
+
+    telegram = FakeTelegram(latency=args.api_latency)
+    paypal = FakePaypal(latency=args.api_latency)
+    telegram_port, paypal_port, bot_port = get_free_port(), get_free_port(), get_free_port()
+    runners = [
+        await start_site(telegram.create_app(), telegram_port),
+        await start_site(paypal.create_app(), paypal_port),
+    ]
+
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+    log_path = RESULTS_DIR / f"loadtest-{stamp}.log"
+    base_url = f"http://127.0.0.1:{bot_port}"
+    process = start_bot(args, bot_port, f"http://127.0.0.1:{telegram_port}", f"http://127.0.0.1:{paypal_port}",
+                        log_path)
+
+    try:
+        await wait_ready(base_url, process)
+        generator = LoadGenerator(base_url, telegram, paypal, timeout=args.timeout)
+
+        if args.warmup:
+            await generator.run(args.scenario, args.warmup, args.concurrency)
+            generator.scenarios = {"update": Scenario(), "payment": Scenario()}
+
+        duration = await generator.run(args.scenario, args.duration, args.concurrency)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        for runner in runners:
+            await runner.cleanup()
+
+    results = {
+        "timestamp": stamp,
+        "commit": get_commit(),
+        "settings": {
+            "scenario": args.scenario,
+            "duration": args.duration,
+            "concurrency": args.concurrency,
+            "workers": args.workers,
+            "rate_limit": args.rate_limit,
+            "api_latency": args.api_latency,
+        },
+        "duration": round(duration, 3),
+        "scenarios": {
+            name: scenario.report(duration)
+            for name, scenario in generator.scenarios.items() if scenario.statuses or scenario.errors
+        },
+        "telegram_calls": dict(telegram.calls),
+        "paypal_calls": dict(paypal.calls),
+    }
+
+    output = Path(args.output) if args.output else RESULTS_DIR / f"loadtest-{stamp}.json"
+    output.write_text(json.dumps(results, indent=2))
+    print(json.dumps(results["scenarios"], indent=2))
+    print(f"Results: {output}, bot log: {log_path}")
+    return results
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="End-to-end load test of the bot with fake Telegram and PayPal.")
+    parser.add_argument("--scenario", choices=("update", "payment", "mixed"), default="mixed")
+    parser.add_argument("--duration", type=float, default=30.0, help="duration of the test in seconds")
+    parser.add_argument("--warmup", type=float, default=5.0, help="warm-up in seconds, it's not measured")
+    parser.add_argument("--concurrency", type=int, default=50, help="number of virtual users")
+    parser.add_argument("--workers", type=int, default=1, help="number of web worker processes of the bot")
+    parser.add_argument("--rate-limit", type=float, default=100_000,
+                        help="messages per second allowed by the bot (Telegram allows about 30)")
+    parser.add_argument("--api-latency", type=float, default=0.0,
+                        help="delay in seconds added by the fake Telegram and PayPal to every response")
+    parser.add_argument("--timeout", type=float, default=10.0, help="maximum time in seconds to wait for a reply")
+    parser.add_argument("--temp-postgres", action="store_true",
+                        help="start a disposable Postgres with initdb/pg_ctl instead of using DB_* variables")
+    parser.add_argument("--output", help="path of the JSON results, benchmarks/results/ by default")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,114 @@
+import shutil
+import socket
+import subprocess
+import tempfile
+from pathlib import Path
+from typing import Dict, Optional
+
+
+def find_postgres_bin() -> Optional[Path]:
+    """
+    Function to find the directory with the Postgres server binaries (initdb, pg_ctl).
+
+    :return: path of the directory or None if Postgres isn't installed.
+    """
+
+    initdb = shutil.which("initdb")
+    if initdb:
+        return Path(initdb).parent
+
+    candidates = []
+    try:
+        candidates.append(Path(subprocess.check_output(["pg_config", "--bindir"], text=True).strip()))
+    except (OSError, subprocess.CalledProcessError):
+        pass
+
+    # Debian and Ubuntu keep the server binaries out of PATH
+    candidates.extend(sorted(Path("/usr/lib/postgresql").glob("*/bin"), reverse=True))
+
+    # pg_config may come from the client libraries only, without the server
+    for candidate in candidates:
+        if (candidate / "initdb").exists():
+            return candidate
+    return None
+
+
+class TemporaryPostgres:
+    """
+    Disposable Postgres server in a temporary directory, started with initdb and pg_ctl without containers.
+    It listens only on localhost, trusts local connections and is removed when it's stopped.
+    Postgres refuses to run as root, so the benchmarks should be started by a regular user.
+
+    Attributes
+    ----------
+    port [int] -> port of the server.
+    max_connections [int] -> max_connections setting, it must be greater than the tested pool size with overflow.
+    """
+
+    user = "benchmark"
+    database = "postgres"
+
+    def __init__(self, port: int = 0, max_connections: int = 300):
+        self.port = port or self._get_free_port()
+        self.max_connections = max_connections
+
+        self._bin: Optional[Path] = None
+        self._directory: Optional[Path] = None
+
+    @staticmethod
+    def _get_free_port() -> int:
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            return sock.getsockname()[1]
+
+    def start(self) -> "TemporaryPostgres":
+        self._bin = find_postgres_bin()
+        if self._bin is None:
+            raise RuntimeError("Postgres server binaries (initdb, pg_ctl) were not found.")
+
+        self._directory = Path(tempfile.mkdtemp(prefix="bot-benchmark-pg-"))
+        data = self._directory / "data"
+        subprocess.run(
+            [self._bin / "initdb", "-D", data, "-U", self.user, "--auth=trust", "--no-sync"],
+            check=True, stdout=subprocess.DEVNULL
+        )
+
+        options = (
+            f"-p {self.port} -k {self._directory} -c listen_addresses=127.0.0.1 "
+            f"-c max_connections={self.max_connections}"
+        )
+        subprocess.run(
+            [self._bin / "pg_ctl", "-D", data, "-o", options, "-l", self._directory / "postgres.log", "-w", "start"],
+            check=True, stdout=subprocess.DEVNULL
+        )
+        return self
+
+    def stop(self) -> None:
+        if self._directory is None:
+            return
+
+        subprocess.run(
+            [self._bin / "pg_ctl", "-D", self._directory / "data", "-m", "fast", "-w", "stop"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        shutil.rmtree(self._directory, ignore_errors=True)
+        self._directory = None
+
+    def env(self) -> Dict[str, str]:
+        """
+        Returns the environment variables that point the bot's DatabaseConfig at this server.
+        """
+
+        return {
+            "DB_HOST": "127.0.0.1",
+            "DB_PORT": str(self.port),
+            "POSTGRES_USER": self.user,
+            "POSTGRES_PASSWORD": "",
+            "POSTGRES_DB": self.database,
+        }
+
+    def __enter__(self) -> "TemporaryPostgres":
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        self.stop()
@@ -1,59 +1,98 @@
+import asyncio
+import hashlib
 import logging
+import signal
+from logging.handlers import QueueListener
 
-import betterlogging
 from aiogram import Dispatcher, Bot
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer, PRODUCTION
 from aiogram.enums import ParseMode
 from aiogram.exceptions import TelegramNetworkError
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import BotCommand
-from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiogram.webhook.aiohttp_server import setup_application
 from aiohttp import web
-
-from bot.middlewares.middlewares import LoggingMiddleware, ConfigMiddleware, DatabaseMiddleware, PaypalMiddleware
+from redis.asyncio import Redis
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker
+
+from bot.data.config import ConfigStore
+from bot.middlewares.middlewares import (
+    LoggingMiddleware, ConfigMiddleware, DatabaseMiddleware, PaypalMiddleware, HandlerNameMiddleware,
+    MetricsMiddleware, ProfilerMiddleware
+)
 from bot.paypal.paypal import PaypalProcessor
 from bot.services.broadcast import broadcast
-from data.config import load_config
-from database.setup import create_engine, run_migrations, create_session_pool
+from bot.services.broadcast_worker import BroadcastWorker
+from bot.services.leader import LeaderElection
+from bot.services.logs import start_log_listener
+from bot.services.metrics import registry, Snapshot
+from bot.services.partitions import ReceiptPartitionMaintainer
+from bot.services.prefork import run_workers
+from bot.services.profiler import SlowUpdateProfiler
+from bot.services.rate_limiter import telegram_rate_limiter
+from bot.services.storage import create_redis, create_storage
+from bot.services.update_pool import BoundedRequestHandler
+from database.commands.cache import ReadCache, TTLCache
+from database.commands.requests import RequestsDistributor
+from database.commands.users import UserWriteBuffer
+from database.setup import (
+    create_engine, run_migrations, create_session_pool, get_pool_usage, is_schema_current
+)
 from handlers import routers_list
 
-config = load_config("../.env.dist")
+# Handlers read the current snapshot from the store, the settings used at startup are taken from the first one
+config_store = ConfigStore("../.env.dist")
+config = config_store.current
+
+# Keys of the shared objects stored in the web application
+bot_key = web.AppKey("bot", Bot)
+paypal_key = web.AppKey("paypal", PaypalProcessor)
+engine_key = web.AppKey("engine", AsyncEngine)
+redis_key = web.AppKey("redis", Redis)
+user_buffer_key = web.AppKey("user_buffer", UserWriteBuffer)
+config_watcher_key = web.AppKey("config_watcher", asyncio.Task)
 
 
-def setup_logging() -> None:
+def setup_logging() -> QueueListener:
     """
     Set up logging configuration for the application.
 
     This method initializes the logging configuration for the application.
-    It sets the log level to INFO and configures a basic colorized log for
-    output. The log format includes the filename, line number, log level,
-    timestamp, logger name, and log message.
-    """
+    Records are put in a bounded queue and a background thread formats and writes them,
+    so logging doesn't block the event loop. Level, format (JSON lines or colorized text)
+    and sampling of successful updates are taken from the configuration.
 
-    log_level = logging.INFO
-    betterlogging.basic_colorized_config(level=log_level)
+    :return: the listener that writes the records, it should be stopped before the process exits.
+    """
 
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(filename)s:%(lineno)d #%(levelname)-8s [%(asctime)s] - %(name)s - %(message)s",
+    listener = start_log_listener(
+        level=config.logs.level,
+        json_format=config.logs.json,
+        queue_size=config.logs.queue_size
     )
     logger = logging.getLogger(__name__)
     logger.info("[INFO] Starting bot")
+    return listener
 
 
-def register_global_middlewares(dp: Dispatcher, paypal: PaypalProcessor) -> None:
+def register_global_middlewares(
+        dp: Dispatcher,
+        paypal: PaypalProcessor,
+        profiler: SlowUpdateProfiler | None = None
+) -> None:
     """
     Register global middlewares for the given dispatcher.
     Global middlewares here are the ones that are applied to all the handlers (you specify the type of update)
 
     :param paypal: PayPal instance.
+    :param profiler: profiler of slow updates, it's None when profiling is disabled.
     :param dp: the dispatcher instance.
     :type dp: dispatcher.
     """
 
     middleware_types = [
-        ConfigMiddleware(config),
-        LoggingMiddleware(),
+        ConfigMiddleware(config_store),
         PaypalMiddleware(paypal=paypal)
     ]
 
@@ -61,59 +100,254 @@ def register_global_middlewares(dp: Dispatcher, paypal: PaypalProcessor) -> None
         dp.message.outer_middleware(middleware_type)
         dp.callback_query.outer_middleware(middleware_type)
 
+    # Every update is logged once with its context, the handler name is added when the handler is chosen
+    dp.update.outer_middleware(LoggingMiddleware(config_store))
+    dp.update.outer_middleware(MetricsMiddleware())
+    if profiler is not None:
+        dp.update.outer_middleware(ProfilerMiddleware(profiler))
+    dp.message.middleware(HandlerNameMiddleware())
+    dp.callback_query.middleware(HandlerNameMiddleware())
+
+
+# Commands of the bot menu, they are set once per deployment
+BOT_COMMANDS = [
+    BotCommand(
+        command="/test_payment",
+        description="Perform test payment."
+    ),
+    BotCommand(
+        command="/receipts",
+        description="Show your purchases."
+    )
+]
+
+# Marker of the deployment the bootstrap has been run for
+BOOTSTRAP_STATE_KEY = "bootstrap"
+
+
+def get_deployment_id() -> str:
+    """
+    Get the identifier of the current deployment, the bootstrap is run once for every identifier.
+    Without DEPLOYMENT_ID it's a fingerprint of everything the bootstrap sets up.
+
+    :return: identifier of the deployment.
+    """
+
+    if config.webhook.deployment_id:
+        return config.webhook.deployment_id
+
+    parts = [
+        config.webhook.base_webhook_url,
+        config.webhook.web_secret,
+        *(f"{command.command} {command.description}" for command in BOT_COMMANDS),
+        *map(str, config.telegram_bot.admin_ids),
+    ]
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+
+async def run_bootstrap(bot: Bot) -> bool:
+    """
+    Run the side effects that must happen once per deployment: the webhook, the commands and the greeting.
+
+    :param bot: the bot instance.
+    :return: whether the webhook has been set, otherwise the bootstrap is run again by the next leader.
+    """
 
-async def on_startup(bot: Bot) -> None:
     try:
         await bot.set_webhook(f"{config.webhook.base_webhook_url}/webhook", secret_token=config.webhook.web_secret,
                               allowed_updates=[])
     except TelegramNetworkError as e:
         logging.error(f"Failed to set webhook: {e}")
+        return False
+
+    await bot.set_my_commands(BOT_COMMANDS)
 
     await broadcast(
         bot=bot,
         users=config.telegram_bot.admin_ids,
         text="👋 Hello, admin! Your bot has been started successfully."
     )
+    return True
 
-    await bot.set_my_commands(
-        [
-            BotCommand(
-                command="/test_payment",
-                description="Perform test payment."
-            )
-        ]
-    )
 
-    # Set up the database
-    engine = create_engine(config.database, echo=True)
+async def run_startup_tasks(
+        bot: Bot,
+        engine: AsyncEngine,
+        session_pool: async_sessionmaker,
+        broadcast_worker: BroadcastWorker,
+        partition_maintainer: ReceiptPartitionMaintainer | None = None
+) -> None:
+    """
+    Run the tasks of the process that has been elected as the leader, they are run again after a failover.
+    Migrations and the bootstrap check whether they have been done already, so a new leader skips them.
+
+    :param bot: the bot instance.
+    :param engine: the engine of the application database.
+    :param session_pool: the session pool of the application database.
+    :param broadcast_worker: the worker for the broadcasts stored in the database.
+    :param partition_maintainer: the maintainer of the receipts partitions, it's None when partitioning is disabled.
+    """
+
+    # Bring the database schema to the latest version, followers start serving after that
     await run_migrations(engine)
 
+    deployment_id = get_deployment_id()
+    async with session_pool() as session:
+        bootstrapped = await RequestsDistributor(session).state.get_state(BOOTSTRAP_STATE_KEY) == deployment_id
+    if not bootstrapped and await run_bootstrap(bot):
+        async with session_pool() as session:
+            await RequestsDistributor(session).state.set_state(BOOTSTRAP_STATE_KEY, deployment_id)
 
-async def on_shutdown(bot: Bot) -> None:
-    try:
-        logging.info("Deleting webhook and dropping all pending updates...")
-        async with bot.session:
+    # Partition the receipts by month and keep the partitions of the upcoming months created
+    if partition_maintainer is not None:
+        await partition_maintainer.start()
+
+    # Continue broadcasts that were interrupted by the previous shutdown or by the previous leader
+    await broadcast_worker.resume()
+
+
+async def stop_leader_tasks(
+        broadcast_worker: BroadcastWorker,
+        partition_maintainer: ReceiptPartitionMaintainer | None = None
+) -> None:
+    """
+    Stop the background tasks of the leader when the process is no longer the leader.
+
+    :param broadcast_worker: the worker for the broadcasts stored in the database.
+    :param partition_maintainer: the maintainer of the receipts partitions, it's None when partitioning is disabled.
+    """
+
+    await broadcast_worker.close()
+    if partition_maintainer is not None:
+        await partition_maintainer.close()
+
+
+async def on_startup(leader: LeaderElection) -> None:
+    await leader.start()
+
+
+async def on_app_startup(app: web.Application) -> None:
+    app[paypal_key].start()
+    if user_buffer_key in app:
+        app[user_buffer_key].start()
+
+    # Reload the configuration on SIGHUP and, if it's enabled, when the file changes
+    asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, config_store.reload)
+    app[config_watcher_key] = asyncio.create_task(config_store.watch())
+
+
+async def on_cleanup(app: web.Application) -> None:
+    # Shared connection pools are closed only once the web application has stopped serving requests
+    # and the queued payment confirmations have been processed
+    app[config_watcher_key].cancel()
+    await app[paypal_key].close()
+    if user_buffer_key in app:
+        await app[user_buffer_key].close()
+    await app[bot_key].session.close()
+    await app[engine_key].dispose()
+    if redis_key in app:
+        await app[redis_key].aclose()
+
+
+async def on_shutdown(
+        bot: Bot,
+        broadcast_worker: BroadcastWorker,
+        leader: LeaderElection,
+        partition_maintainer: ReceiptPartitionMaintainer | None,
+        session_pool: async_sessionmaker
+) -> None:
+    await stop_leader_tasks(broadcast_worker, partition_maintainer)
+
+    # With several processes the others keep serving the webhook after this one stops
+    if leader.is_leader and config.webhook.web_workers == 1 and config.webhook.replicas == 1:
+        try:
+            logging.info("Deleting webhook and dropping all pending updates...")
             await bot.delete_webhook(drop_pending_updates=True)
-        logging.info("Webhook has been deleted and all pending updates have been dropped.")
-    except TelegramNetworkError as e:
-        logging.error(f"Failed to delete webhook: {e}")
+            logging.info("Webhook has been deleted and all pending updates have been dropped.")
+        except TelegramNetworkError as e:
+            logging.error(f"Failed to delete webhook: {e}")
+        else:
+            # The webhook is set again on the next start
+            async with session_pool() as session:
+                await RequestsDistributor(session).state.delete_state(BOOTSTRAP_STATE_KEY)
 
+    await leader.close()
 
-def main() -> None:
-    # Register logging settings
-    setup_logging()
 
-    # Initialize a local storage for aiogram
-    storage = MemoryStorage()
+def create_app() -> web.Application:
+    """
+    Create the web application with the bot, the dispatcher and all the shared dependencies.
+    Every worker process creates its own application, so connection pools are never shared between processes.
+
+    :return: the web application.
+    """
+
+    # Initialize a shared redis client if it's enabled and a storage for aiogram
+    redis = create_redis(config.redis) if config.telegram_bot.use_redis else None
+    storage = create_storage(config, redis)
+
+    # Initialize bot instance, it's shared by the whole process so the connection pool to the Bot API is reused
+    api = TelegramAPIServer.from_base(config.telegram_bot.api_url) if config.telegram_bot.api_url else PRODUCTION
+    bot = Bot(
+        token=config.telegram_bot.token,
+        session=AiohttpSession(api=api, limit=config.telegram_bot.connection_limit),
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML)
+    )
+    telegram_rate_limiter.set_rate(config.telegram_bot.rate_limit)
+
+    # Initialize database dependencies such as engine and session pool
+    engine = create_engine(config.database, workers=config.webhook.web_workers)
+    session_pool = create_session_pool(engine)
+
+    # Skip user upserts that don't change anything and optionally buffer the changed ones
+    upsert_cache = TTLCache(maxsize=config.database.users_cache_size, ttl=config.database.users_cache_ttl)
+
+    # Cache user and receipt reads in the process and, if redis is enabled, in redis shared by all the processes
+    read_cache = None
+    if config.database.read_cache_ttl > 0:
+        read_cache = ReadCache(
+            maxsize=config.database.read_cache_size,
+            ttl=config.database.read_cache_ttl,
+            redis=redis if config.database.read_cache_shared else None,
+            version_ttl=config.database.read_cache_version_ttl
+        )
+
+    user_buffer = None
+    if config.database.users_flush_interval > 0:
+        user_buffer = UserWriteBuffer(session_pool, interval=config.database.users_flush_interval, cache=read_cache)
 
     # Initialize PaypalProcessor
-    paypal = PaypalProcessor(config=config)
+    paypal = PaypalProcessor(config=config, bot=bot, session_pool=session_pool, cache=read_cache)
+    config_store.subscribe(paypal.apply_config)
+
+    # Initialize a worker for the broadcasts stored in the database
+    broadcast_worker = BroadcastWorker(bot=bot, session_pool=session_pool, redis=redis)
+    if redis is None and config.webhook.web_workers > 1:
+        logging.warning("[WARNING] Without redis a broadcast unpaused in several worker processes may run twice.")
+
+    # Initialize a maintainer of the monthly receipts partitions if partitioning is enabled
+    partition_maintainer = None
+    if config.database.receipts_partitioning:
+        partition_maintainer = ReceiptPartitionMaintainer.from_config(engine, config.database)
+
+    # Elect a leader among the worker processes to run the startup tasks once, the lock key is the bot id.
+    # Other processes start serving once the schema is migrated
+    leader = LeaderElection(
+        engine=engine,
+        key=int(config.telegram_bot.token.split(":")[0]),
+        on_elected=lambda: run_startup_tasks(bot, engine, session_pool, broadcast_worker, partition_maintainer),
+        on_demoted=lambda: stop_leader_tasks(broadcast_worker, partition_maintainer),
+        is_ready=lambda: is_schema_current(engine)
+    )
 
-    # Initialize bot instance
-    bot = Bot(token=config.telegram_bot.token, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    # Initialize a profiler of slow updates if it's enabled
+    profiler = SlowUpdateProfiler.from_config(config.profiler) if config.profiler.enabled else None
 
     # Initialize a dispatcher
-    dp = Dispatcher(storage=storage)
+    dp = Dispatcher(
+        storage=storage, broadcast_worker=broadcast_worker, redis=redis, leader=leader, profiler=profiler,
+        partition_maintainer=partition_maintainer, session_pool=session_pool
+    )
 
     # Register on startup and on shutdown functions
     dp.startup.register(on_startup)
@@ -124,31 +358,111 @@ def main() -> None:
 
     # Initialize a web application
     app = web.Application()
+    app[bot_key] = bot
+    app[paypal_key] = paypal
+    app[engine_key] = engine
+    if redis is not None:
+        app[redis_key] = redis
+    if user_buffer is not None:
+        app[user_buffer_key] = user_buffer
     app.router.add_get("/payment/success", paypal.check_payment)
+    if config.paypal.paypal_webhook_id:
+        app.router.add_post("/paypal/webhook", paypal.handle_webhook)
+    app.on_startup.append(on_app_startup)
+    app.on_cleanup.append(on_cleanup)
 
     # Register global middlewares
-    register_global_middlewares(dp=dp, paypal=paypal)
+    register_global_middlewares(dp=dp, paypal=paypal, profiler=profiler)
 
-    # Initialize database dependencies such as engine and session pool and register a pool in the middleware
-    engine = create_engine(config.database)
-    session_pool = create_session_pool(engine)
-    dp.update.outer_middleware(DatabaseMiddleware(session_pool))
+    # Register a session pool in the middleware
+    database_middleware = DatabaseMiddleware(
+        session_pool, cache=read_cache, upsert_cache=upsert_cache, write_buffer=user_buffer
+    )
+    dp.update.outer_middleware(database_middleware)
 
-    # Initialize a simple request handler for the webhook
-    webhook_requests_handler = SimpleRequestHandler(
+    # Initialize a request handler for the webhook, updates are acknowledged right away and processed in the background
+    webhook_requests_handler = BoundedRequestHandler(
         dispatcher=dp,
         bot=bot,
-        secret_token=config.webhook.web_secret
+        secret_token=config.webhook.web_secret,
+        concurrency=config.webhook.update_concurrency,
+        max_pending=config.webhook.update_queue_size
     )
 
     # Register webhook command for the webhook
     webhook_requests_handler.register(app, path=f"/webhook")
 
+    # Expose the metrics of this process, queues and pools are read on every scrape
+    registry.register(Snapshot("bot_db_pool", "State of the database connection pool.", lambda: get_pool_usage(engine)))
+    registry.register(Snapshot("bot_db_usage", "Updates that opened a database session.",
+                               lambda: database_middleware.usage.__dict__))
+    registry.register(Snapshot("bot_update_pool", "State of the webhook update pool.",
+                               webhook_requests_handler.pool.snapshot))
+    registry.register(Snapshot("bot_paypal_pipeline", "State of the payment confirmation pipeline.",
+                               paypal.pipeline.snapshot))
+    if read_cache is not None:
+        registry.register(Snapshot("bot_db_cache", "Hits and misses of the read cache of users and receipts.",
+                                   read_cache.snapshot))
+    app.router.add_get("/metrics", registry.handle)
+
+    # Profiles of slow updates can be downloaded over HTTP only if a token is set
+    if profiler is not None and profiler.token:
+        app.router.add_get("/profiles", profiler.handle_list)
+        app.router.add_get("/profiles/{name}", profiler.handle_download)
+
     # Set up an application
     setup_application(app, dp, bot=bot)
 
-    # Run a web app
-    web.run_app(app, host=config.webhook.web_server_host, port=config.webhook.web_server_port)
+    return app
+
+
+def log_database_pool() -> None:
+    """
+    Log the effective limits of the database connection pools of all the worker processes together.
+    """
+
+    workers = config.webhook.web_workers
+    options = config.database.pool_options(workers)
+    connections = workers * (options["pool_size"] + options["max_overflow"])
+    logging.info(
+        f"[INFO] Database pool: {workers} worker(s) x (pool_size {options['pool_size']} + "
+        f"max_overflow {options['max_overflow']}), up to {connections} connections. "
+        f"Timeout {options['pool_timeout']}s, recycle {options['pool_recycle']}s, "
+        f"pre-ping {options['pool_pre_ping']}, "
+        f"statement cache {options['connect_args']['statement_cache_size']}, "
+        f"prepared statement cache {options['connect_args']['prepared_statement_cache_size']}."
+    )
+
+
+def run_worker() -> None:
+    # Register logging settings, the thread that writes the logs doesn't survive a fork,
+    # so every worker starts its own
+    listener = setup_logging()
+    if config.webhook.web_workers == 1:
+        log_database_pool()
+
+    try:
+        # Run a web app, several workers share the same port with SO_REUSEPORT
+        web.run_app(
+            create_app(),
+            host=config.webhook.web_server_host,
+            port=config.webhook.web_server_port,
+            reuse_port=config.webhook.web_workers > 1
+        )
+    finally:
+        listener.stop()
+
+
+def main() -> None:
+    if config.webhook.web_workers > 1:
+        listener = setup_logging()
+        log_database_pool()
+        try:
+            run_workers(run_worker, workers=config.webhook.web_workers)
+        finally:
+            listener.stop()
+    else:
+        run_worker()
 
 
 if __name__ == "__main__":
@@ -1,11 +1,17 @@
+import asyncio
+import dataclasses
+import logging
+import math
+import os
 from dataclasses import dataclass
-from typing import Optional
+from typing import Callable, Dict, List, Mapping, Optional
 
+from dotenv import dotenv_values
 from environs import Env
 from sqlalchemy.engine.url import URL
 
 
-@dataclass
+@dataclass(frozen=True)
 class DatabaseConfig:
     """
     Database configuration class.
@@ -18,6 +24,27 @@ class DatabaseConfig:
     user [str] -> username of the database.
     database [str] -> name of the database.
     port [str] -> port of the database.
+    pool_size [int] -> number of connections kept open by all the worker processes together.
+    max_overflow [int] -> number of extra connections all the worker processes together may open under load.
+    pool_timeout [float] -> time in seconds to wait for a free connection before an error is raised.
+    pool_recycle [int] -> connections older than N seconds are replaced, -1 keeps them forever.
+    pool_pre_ping [bool] -> whether a connection is checked with a ping every time it's taken from the pool.
+    query_cache_size [int] -> number of compiled SQL statements cached by SQLAlchemy.
+    statement_cache_size [int] -> number of prepared statements asyncpg caches per connection, 0 disables it
+        (e.g. behind pgbouncer in transaction mode).
+    prepared_statement_cache_size [int] -> number of prepared statements SQLAlchemy's asyncpg adapter caches
+        per connection, 0 disables it.
+    users_cache_size [int] -> number of users whose last written data is cached to skip unchanged upserts.
+    users_cache_ttl [int] -> time in seconds after which a cached user is written again.
+    users_flush_interval [float] -> if it's greater than 0, changed users are buffered and written every N seconds.
+    receipts_partitioning [bool] -> whether the receipts table is partitioned by month of created_at.
+    receipts_partitions_ahead [int] -> number of upcoming monthly partitions that are created in advance.
+    receipts_retention_months [int] -> if it's greater than 0, monthly partitions older than N months are detached.
+    read_cache_size [int] -> number of entries in the in-process tier of the read cache of users and receipts.
+    read_cache_ttl [float] -> time in seconds after which a cached read expires, 0 disables the read cache.
+    read_cache_shared [bool] -> whether redis is used as the shared tier of the read cache if redis is enabled.
+    read_cache_version_ttl [float] -> time in seconds a process reuses the versions of the shared read cache,
+        writes of other processes are seen by the process after that time.
     """
 
     host: str
@@ -25,6 +52,24 @@ class DatabaseConfig:
     user: str
     database: str
     port: int = 5432
+    pool_size: int = 20
+    max_overflow: int = 10
+    pool_timeout: float = 30.0
+    pool_recycle: int = 1800
+    pool_pre_ping: bool = False
+    query_cache_size: int = 1200
+    statement_cache_size: int = 100
+    prepared_statement_cache_size: int = 100
+    users_cache_size: int = 100_000
+    users_cache_ttl: int = 3600
+    users_flush_interval: float = 0.0
+    receipts_partitioning: bool = False
+    receipts_partitions_ahead: int = 3
+    receipts_retention_months: int = 0
+    read_cache_size: int = 10_000
+    read_cache_ttl: float = 60.0
+    read_cache_shared: bool = True
+    read_cache_version_ttl: float = 1.0
 
     def construct_sqlalchemy_url(self, driver="asyncpg", host=None, port=None) -> str:
         """
@@ -50,6 +95,28 @@ class DatabaseConfig:
         )
         return uri.render_as_string(hide_password=False)
 
+    def pool_options(self, workers: int = 1) -> Dict:
+        """
+        Function to get the engine options of one worker process.
+        Pool size and overflow are limits of the whole instance, so they are split between the worker processes.
+
+        :param workers: number of worker processes.
+        :return: keyword arguments of create_async_engine.
+        """
+
+        return dict(
+            pool_size=max(1, math.ceil(self.pool_size / workers)),
+            max_overflow=math.ceil(self.max_overflow / workers),
+            pool_timeout=self.pool_timeout,
+            pool_recycle=self.pool_recycle,
+            pool_pre_ping=self.pool_pre_ping,
+            query_cache_size=self.query_cache_size,
+            connect_args=dict(
+                statement_cache_size=self.statement_cache_size,
+                prepared_statement_cache_size=self.prepared_statement_cache_size,
+            ),
+        )
+
     @staticmethod
     def from_env(env: Env):
         """
@@ -63,20 +130,58 @@ class DatabaseConfig:
         user = env.str("POSTGRES_USER")
         database = env.str("POSTGRES_DB")
         port = env.int("DB_PORT", 5432)
+        pool_size = env.int("DB_POOL_SIZE", 20)
+        max_overflow = env.int("DB_MAX_OVERFLOW", 10)
+        pool_timeout = env.float("DB_POOL_TIMEOUT", 30.0)
+        pool_recycle = env.int("DB_POOL_RECYCLE", 1800)
+        pool_pre_ping = env.bool("DB_POOL_PRE_PING", False)
+        query_cache_size = env.int("DB_QUERY_CACHE_SIZE", 1200)
+        statement_cache_size = env.int("DB_STATEMENT_CACHE_SIZE", 100)
+        prepared_statement_cache_size = env.int("DB_PREPARED_STATEMENT_CACHE_SIZE", 100)
+        users_cache_size = env.int("USERS_CACHE_SIZE", 100_000)
+        users_cache_ttl = env.int("USERS_CACHE_TTL", 3600)
+        users_flush_interval = env.float("USERS_FLUSH_INTERVAL", 0.0)
+        receipts_partitioning = env.bool("RECEIPTS_PARTITIONING", False)
+        receipts_partitions_ahead = env.int("RECEIPTS_PARTITIONS_AHEAD", 3)
+        receipts_retention_months = env.int("RECEIPTS_RETENTION_MONTHS", 0)
+        read_cache_size = env.int("READ_CACHE_SIZE", 10_000)
+        read_cache_ttl = env.float("READ_CACHE_TTL", 60.0)
+        read_cache_shared = env.bool("READ_CACHE_SHARED", True)
+        read_cache_version_ttl = env.float("READ_CACHE_VERSION_TTL", 1.0)
         return DatabaseConfig(
-            host=host, password=password, user=user, database=database, port=port
+            host=host, password=password, user=user, database=database, port=port,
+            pool_size=pool_size, max_overflow=max_overflow, pool_timeout=pool_timeout, pool_recycle=pool_recycle,
+            pool_pre_ping=pool_pre_ping, query_cache_size=query_cache_size, statement_cache_size=statement_cache_size,
+            prepared_statement_cache_size=prepared_statement_cache_size,
+            users_cache_size=users_cache_size, users_cache_ttl=users_cache_ttl,
+            users_flush_interval=users_flush_interval, receipts_partitioning=receipts_partitioning,
+            receipts_partitions_ahead=receipts_partitions_ahead, receipts_retention_months=receipts_retention_months,
+            read_cache_size=read_cache_size, read_cache_ttl=read_cache_ttl, read_cache_shared=read_cache_shared,
+            read_cache_version_ttl=read_cache_version_ttl
         )
 
 
-@dataclass
+@dataclass(frozen=True)
 class TelegramBotConfig:
     """
     Creates the TelegramBotConfig object from environment variables.
+
+    Attributes
+    ----------
+    token [str] -> token of the bot.
+    admin_ids [list[int]] -> ids of the bot administrators.
+    use_redis [bool] -> whether to use redis as a storage.
+    connection_limit [int] -> maximum number of simultaneous connections to the Bot API shared by the whole process.
+    api_url [str] -> url of a custom Bot API server (e.g. a local fake one for benchmarks), empty for Telegram.
+    rate_limit [float] -> maximum number of messages per second sent by the process.
     """
 
     token: str
     admin_ids: list[int]
     use_redis: bool
+    connection_limit: int = 100
+    api_url: str = ""
+    rate_limit: float = 30.0
 
     @staticmethod
     def from_env(env: Env):
@@ -89,10 +194,16 @@ class TelegramBotConfig:
         token = env.str("BOT_TOKEN")
         admin_ids = list(map(int, env.list("ADMINS")))
         use_redis = env.bool("USE_REDIS")
-        return TelegramBotConfig(token=token, admin_ids=admin_ids, use_redis=use_redis)
+        connection_limit = env.int("BOT_CONNECTION_LIMIT", 100)
+        api_url = env.str("BOT_API_URL", "")
+        rate_limit = env.float("BOT_RATE_LIMIT", 30.0)
+        return TelegramBotConfig(
+            token=token, admin_ids=admin_ids, use_redis=use_redis, connection_limit=connection_limit,
+            api_url=api_url, rate_limit=rate_limit
+        )
 
 
-@dataclass
+@dataclass(frozen=True)
 class WebhookConfig:
     """
     Webhook configuration class.
@@ -104,12 +215,23 @@ class WebhookConfig:
     web_server_port [int] -> port of the webhook.
     web_secret [str] -> secret key of the webhook for authorization and to prevent hacker attacks.
     base_webhook_url [str] -> url of the webhook, e.g. https://your_webhook_url
+    web_workers [int] -> number of worker processes sharing the webhook port.
+    replicas [int] -> number of instances of the bot behind the webhook url (e.g. containers or hosts).
+    update_concurrency [int] -> maximum number of updates processed at the same time by one process.
+    update_queue_size [int] -> maximum number of updates waiting for processing, after that 429 is returned.
+    deployment_id [str] -> optional identifier of the deployment, the webhook, the commands and the greeting
+        are set up once per identifier, by default it's a fingerprint of the settings they use.
     """
 
     web_server_host: str
     web_server_port: int
     web_secret: str
     base_webhook_url: str
+    web_workers: int = 1
+    replicas: int = 1
+    update_concurrency: int = 50
+    update_queue_size: int = 1000
+    deployment_id: str = ""
 
     @staticmethod
     def from_env(env: Env):
@@ -124,16 +246,26 @@ class WebhookConfig:
         web_server_port = env.int("WEB_SERVER_PORT")
         web_secret = env.str("WEB_SECRET")
         base_webhook_url = env.str("BASE_WEBHOOK_URL")
+        web_workers = env.int("WEB_WORKERS", 1)
+        replicas = env.int("REPLICAS", 1)
+        update_concurrency = env.int("WEB_UPDATE_CONCURRENCY", 50)
+        update_queue_size = env.int("WEB_UPDATE_QUEUE_SIZE", 1000)
+        deployment_id = env.str("DEPLOYMENT_ID", "")
 
         return WebhookConfig(
             web_server_host=web_server_host,
             web_server_port=web_server_port,
             web_secret=web_secret,
-            base_webhook_url=base_webhook_url
+            base_webhook_url=base_webhook_url,
+            web_workers=web_workers,
+            replicas=replicas,
+            update_concurrency=update_concurrency,
+            update_queue_size=update_queue_size,
+            deployment_id=deployment_id
         )
 
 
-@dataclass
+@dataclass(frozen=True)
 class PaypalConfig:
     """
     PayPal configuration class.
@@ -144,11 +276,21 @@ class PaypalConfig:
     paypal_mode [str] -> mode of the PayPal payments ("sandbox" or "live").
     paypal_client_id [str] -> id of the user for authentication.
     paypal_client_secret [str] -> secret key of the user for authentication.
+    paypal_api_url [Optional[str]] -> custom PayPal API url (e.g. a local fake server), derived from the mode if empty.
+    paypal_timeout [float] -> timeout in seconds for every request to PayPal.
+    confirmation_workers [int] -> number of workers that confirm payments in the background.
+    confirmation_queue_size [int] -> maximum number of payments waiting for confirmation.
+    paypal_webhook_id [Optional[str]] -> id of the webhook from the PayPal dashboard, events are accepted only if set.
     """
 
     paypal_mode: str
     paypal_client_id: str
     paypal_client_secret: str
+    paypal_api_url: Optional[str] = None
+    paypal_timeout: float = 10.0
+    confirmation_workers: int = 4
+    confirmation_queue_size: int = 1000
+    paypal_webhook_id: Optional[str] = None
 
     @staticmethod
     def from_env(env: Env):
@@ -162,12 +304,165 @@ class PaypalConfig:
         paypal_mode = env.str("PAYPAL_MODE")
         paypal_client_id = env.str("PAYPAL_CLIENT_ID")
         paypal_client_secret = env.str("PAYPAL_CLIENT_SECRET")
+        paypal_api_url = env.str("PAYPAL_API_URL", None)
+        paypal_timeout = env.float("PAYPAL_TIMEOUT", 10.0)
+        confirmation_workers = env.int("PAYPAL_CONFIRMATION_WORKERS", 4)
+        confirmation_queue_size = env.int("PAYPAL_CONFIRMATION_QUEUE_SIZE", 1000)
+        paypal_webhook_id = env.str("PAYPAL_WEBHOOK_ID", None)
 
         return PaypalConfig(paypal_mode=paypal_mode, paypal_client_id=paypal_client_id,
-                            paypal_client_secret=paypal_client_secret)
+                            paypal_client_secret=paypal_client_secret, paypal_api_url=paypal_api_url,
+                            paypal_timeout=paypal_timeout, confirmation_workers=confirmation_workers,
+                            confirmation_queue_size=confirmation_queue_size, paypal_webhook_id=paypal_webhook_id)
+
+
+@dataclass(frozen=True)
+class RedisConfig:
+    """
+    Redis configuration class.
+    This class holds various settings for the Redis connection that's used for FSM storage and shared caches.
+
+    Attributes
+    ----------
+    redis_host [str] -> host of the redis server.
+    redis_port [int] -> port of the redis server.
+    redis_password [Optional[str]] -> password of the redis server.
+    redis_db [int] -> number of the redis database.
+    redis_prefix [str] -> prefix of all the keys created by the bot.
+    redis_max_connections [int] -> maximum number of connections in the pool.
+    state_ttl [Optional[int]] -> TTL in seconds of the FSM states, they never expire if it's empty.
+    data_ttl [Optional[int]] -> TTL in seconds of the FSM data, it never expires if it's empty.
+    """
+
+    redis_host: str
+    redis_port: int = 6379
+    redis_password: Optional[str] = None
+    redis_db: int = 0
+    redis_prefix: str = "aiopbt"
+    redis_max_connections: int = 50
+    state_ttl: Optional[int] = None
+    data_ttl: Optional[int] = None
+
+    def dsn(self) -> str:
+        """
+        Function to construct a Redis DSN.
+
+        :return: Redis DSN as a string.
+        """
+
+        if self.redis_password:
+            return f"redis://:{self.redis_password}@{self.redis_host}:{self.redis_port}/{self.redis_db}"
+        return f"redis://{self.redis_host}:{self.redis_port}/{self.redis_db}"
+
+    @staticmethod
+    def from_env(env: Env):
+        """
+        This function takes arguments from environmental variables and creates a RedisConfig configuration config.
+
+        :param env: environmental tool to take arguments.
+        :return: RedisConfig configuration config.
+        """
+
+        redis_host = env.str("REDIS_HOST")
+        redis_port = env.int("REDIS_PORT", 6379)
+        redis_password = env.str("REDIS_PASSWORD", None)
+        redis_db = env.int("REDIS_DB", 0)
+        redis_prefix = env.str("REDIS_PREFIX", "aiopbt")
+        redis_max_connections = env.int("REDIS_MAX_CONNECTIONS", 50)
+        # An empty value (e.g. "REDIS_STATE_TTL=") means the keys never expire
+        state_ttl = env.int("REDIS_STATE_TTL") if env.str("REDIS_STATE_TTL", "") else None
+        data_ttl = env.int("REDIS_DATA_TTL") if env.str("REDIS_DATA_TTL", "") else None
+
+        return RedisConfig(
+            redis_host=redis_host,
+            redis_port=redis_port,
+            redis_password=redis_password,
+            redis_db=redis_db,
+            redis_prefix=redis_prefix,
+            redis_max_connections=redis_max_connections,
+            state_ttl=state_ttl,
+            data_ttl=data_ttl
+        )
+
+
+@dataclass(frozen=True)
+class LoggingConfig:
+    """
+    Logging configuration class.
+    This class holds various settings for the logging like level, format and sampling of successful updates.
+
+    Attributes
+    ----------
+    level [str] -> minimum level of the records.
+    json [bool] -> whether records are written as JSON lines or as colorized text.
+    sample_rate [float] -> share of successful updates that are logged (from 0 to 1), errors are always logged.
+    queue_size [int] -> maximum number of records waiting to be written, extra records are dropped.
+    """
+
+    level: str = "INFO"
+    json: bool = True
+    sample_rate: float = 1.0
+    queue_size: int = 10_000
+
+    @staticmethod
+    def from_env(env: Env):
+        """
+        This function takes arguments from environmental variables and creates a LoggingConfig configuration config.
+
+        :param env: environmental tool to take arguments.
+        :return: LoggingConfig configuration config.
+        """
+        level = env.str("LOG_LEVEL", "INFO").upper()
+        json = env.bool("LOG_JSON", True)
+        sample_rate = env.float("LOG_SAMPLE_RATE", 1.0)
+        queue_size = env.int("LOG_QUEUE_SIZE", 10_000)
+        return LoggingConfig(level=level, json=json, sample_rate=sample_rate, queue_size=queue_size)
 
 
-@dataclass
+@dataclass(frozen=True)
+class ProfilerConfig:
+    """
+    Profiler configuration class.
+    This class holds various settings for the profiler of slow updates, it's disabled by default.
+
+    Attributes
+    ----------
+    enabled [bool] -> whether updates are profiled.
+    threshold [float] -> minimum processing time in seconds of an update whose profile is kept.
+    sample_rate [float] -> share of updates that are profiled, from 0 to 1.
+    directory [str] -> directory where the profiles are stored.
+    max_profiles [int] -> number of the latest profiles that are kept.
+    token [str] -> token to download the profiles over HTTP, if it's empty the HTTP routes are disabled.
+    """
+
+    enabled: bool = False
+    threshold: float = 1.0
+    sample_rate: float = 1.0
+    directory: str = "profiles"
+    max_profiles: int = 20
+    token: str = ""
+
+    @staticmethod
+    def from_env(env: Env):
+        """
+        This function takes arguments from environmental variables and creates a ProfilerConfig configuration config.
+
+        :param env: environmental tool to take arguments.
+        :return: ProfilerConfig configuration config.
+        """
+        enabled = env.bool("PROFILER_ENABLED", False)
+        threshold = env.float("PROFILER_THRESHOLD", 1.0)
+        sample_rate = env.float("PROFILER_SAMPLE_RATE", 1.0)
+        directory = env.str("PROFILER_DIR", "profiles")
+        max_profiles = env.int("PROFILER_MAX_PROFILES", 20)
+        token = env.str("PROFILER_TOKEN", "")
+        return ProfilerConfig(
+            enabled=enabled, threshold=threshold, sample_rate=sample_rate, directory=directory,
+            max_profiles=max_profiles, token=token
+        )
+
+
+@dataclass(frozen=True)
 class Config:
     """
     The main configuration class that integrates all the other configuration classes.
@@ -179,28 +474,141 @@ class Config:
     paypal [PaypalConfig] -> holds various settings related to the PayPal configuration.
     webhook [WebhookConfig] -> holds various settings related to the Webhook configuration.
     database [Optional[DatabaseConfig]] -> holds various settings related to the database configuration.
+    redis [Optional[RedisConfig]] -> holds various settings related to the redis configuration.
+    logs [LoggingConfig] -> holds various settings related to the logging.
+    profiler [ProfilerConfig] -> holds various settings related to the profiler of slow updates.
+    reload_interval [float] -> how often (in seconds) the configuration file is checked for changes, 0 disables it.
+    version [int] -> version of the configuration, it's increased on every reload.
     """
 
     telegram_bot: TelegramBotConfig
     paypal: PaypalConfig
     webhook: WebhookConfig
     database: Optional[DatabaseConfig] = None
+    redis: Optional[RedisConfig] = None
+    logs: LoggingConfig = LoggingConfig()
+    profiler: ProfilerConfig = ProfilerConfig()
+    reload_interval: float = 0.0
+    version: int = 0
+
+
+class MappingEnv(Env):
+    """
+    Env that reads the variables from a mapping instead of os.environ, so loading a configuration
+    never changes the environment of the process.
+
+    environs has no public way to read from a mapping, so its lookup (_get_from_environ) is overridden.
+    environs is pinned in requirements.txt and tests/test_config.py covers the override, upgrade both together.
+    """
+
+    def __init__(self, values: Mapping[str, Optional[str]], **kwargs):
+        super().__init__(**kwargs)
+        self.values = values
+
+    def _get_from_environ(self, key, default, *, proxied=False):
+        env_key = self._get_key(key, omit_prefix=proxied)
+        value = self.values.get(env_key)
+        return env_key, default if value is None else value, None
 
 
 def load_config(path: str = None) -> Config:
     """
     This function takes an optional file path as input and returns a Config object.
+    Variables that are set in the environment take precedence over the values from the file,
+    on every load, so a reload picks up the changes of the file without touching the environment.
 
     :param path: the path of .env.dist file from where to load the configuration variables.
     :return: config object with attributes set as per environment variables.
     """
 
-    env = Env()
-    env.read_env(path)
+    env = MappingEnv({**dotenv_values(path), **os.environ})
+
+    telegram_bot = TelegramBotConfig.from_env(env)
 
     return Config(
-        telegram_bot=TelegramBotConfig.from_env(env),
+        telegram_bot=telegram_bot,
         paypal=PaypalConfig.from_env(env),
         database=DatabaseConfig.from_env(env),
-        webhook=WebhookConfig.from_env(env)
+        webhook=WebhookConfig.from_env(env),
+        redis=RedisConfig.from_env(env) if telegram_bot.use_redis else None,
+        logs=LoggingConfig.from_env(env),
+        profiler=ProfilerConfig.from_env(env),
+        reload_interval=env.float("CONFIG_RELOAD_INTERVAL", 0.0)
     )
+
+
+class ConfigStore:
+    """
+    Holds the current immutable Config snapshot and replaces it on reload.
+
+    Readers take `current` once (e.g. once per update) and work with that snapshot, so they never see
+    a half-applied reload. Reloads happen on SIGHUP or when the configuration file changes, subscribers
+    are notified with the new snapshot (e.g. to rotate PayPal credentials).
+    Settings that are used to build long-lived objects (ports, pool sizes, tokens) still require a restart.
+
+    Attributes
+    ----------
+    path [str] -> the path of the configuration file.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self._config = load_config(path)
+        self._subscribers: List[Callable[[Config], None]] = []
+        self._mtime = self._get_mtime()
+
+    @property
+    def current(self) -> Config:
+        return self._config
+
+    def _get_mtime(self) -> Optional[float]:
+        try:
+            return os.stat(self.path).st_mtime if self.path else None
+        except OSError:
+            return None
+
+    def subscribe(self, callback: Callable[[Config], None]) -> None:
+        """
+        Registers a callback that's called with the new snapshot after every reload.
+
+        :param callback: function that takes the new Config.
+        """
+
+        self._subscribers.append(callback)
+
+    def reload(self) -> Config:
+        """
+        Loads the configuration again and publishes it as a new version.
+        If the configuration is invalid, the current version is kept.
+
+        :return: current Config after the reload.
+        """
+
+        try:
+            config = load_config(self.path)
+        except Exception as error:
+            logging.error(f"[ERROR] Couldn't reload the configuration, keeping version {self._config.version}: {error}")
+            return self._config
+
+        # The snapshot is replaced with a single assignment, so readers get either the old or the new version
+        self._config = dataclasses.replace(config, version=self._config.version + 1)
+        self._mtime = self._get_mtime()
+
+        logging.info(f"[INFO] Configuration has been reloaded, version {self._config.version}.")
+        for callback in self._subscribers:
+            try:
+                callback(self._config)
+            except Exception as error:
+                logging.error(f"[ERROR] Configuration subscriber failed: {error}")
+        return self._config
+
+    async def watch(self) -> None:
+        """
+        Reloads the configuration whenever the file changes, it's checked every `reload_interval` seconds.
+        """
+
+        while self._config.reload_interval > 0:
+            await asyncio.sleep(self._config.reload_interval)
+            mtime = self._get_mtime()
+            if mtime is not None and mtime != self._mtime:
+                self.reload()
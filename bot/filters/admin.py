@@ -0,0 +1,13 @@
+from aiogram.filters import BaseFilter
+from aiogram.types import Message
+
+from bot.data.config import Config
+
+
+class AdminFilter(BaseFilter):
+    """
+    Filter that passes only the messages from the administrators listed in the configuration.
+    """
+
+    async def __call__(self, message: Message, config: Config) -> bool:
+        return message.from_user is not None and message.from_user.id in config.telegram_bot.admin_ids
@@ -1,6 +1,12 @@
+from .admins.broadcast import broadcast_router
+from .admins.profiler import profiler_router
+from .users.receipts import receipts_router
 from .users.start import start_router
 
 routers_list = [
+    broadcast_router,
+    profiler_router,
+    receipts_router,
     start_router,
 ]
 
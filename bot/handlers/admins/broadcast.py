@@ -0,0 +1,72 @@
+from aiogram import Router
+from aiogram.filters import Command, CommandObject
+from aiogram.types import Message
+
+from bot.filters.admin import AdminFilter
+from bot.services.broadcast_worker import BroadcastWorker
+from database.models.broadcasts import Broadcast
+
+# Initialize a router, all of its handlers are available only to the admins
+broadcast_router = Router()
+broadcast_router.message.filter(AdminFilter())
+
+
+def broadcast_details(broadcast: Broadcast) -> str:
+    return f"""📣 <b>Broadcast #{broadcast.id}</b>
+
+<b>Status:</b> {broadcast.status}
+<b>Last user:</b> {broadcast.cursor}
+✅ <b>Delivered:</b> {broadcast.delivered}
+🚫 <b>Blocked:</b> {broadcast.blocked}
+❌ <b>Failed:</b> {broadcast.failed}"""
+
+
+def parse_broadcast_id(command: CommandObject) -> int | None:
+    if not command.args or not command.args.strip().isdigit():
+        return None
+    return int(command.args.strip())
+
+
+@broadcast_router.message(Command("broadcast"))
+async def start_broadcast(message: Message, command: CommandObject, broadcast_worker: BroadcastWorker):
+    if not command.args:
+        return await message.answer("Usage: /broadcast <i>text of the message</i>")
+
+    broadcast = await broadcast_worker.start(text=command.args, created_by=message.from_user.id)
+    await message.answer(broadcast_details(broadcast))
+
+
+@broadcast_router.message(Command("broadcast_pause"))
+async def pause_broadcast(message: Message, command: CommandObject, broadcast_worker: BroadcastWorker):
+    broadcast_id = parse_broadcast_id(command)
+    if broadcast_id is None:
+        return await message.answer("Usage: /broadcast_pause <i>id</i>")
+
+    broadcast = await broadcast_worker.pause(broadcast_id)
+    if broadcast is None:
+        return await message.answer(f"Broadcast #{broadcast_id} doesn't exist.")
+    await message.answer(broadcast_details(broadcast))
+
+
+@broadcast_router.message(Command("broadcast_resume"))
+async def resume_broadcast(message: Message, command: CommandObject, broadcast_worker: BroadcastWorker):
+    broadcast_id = parse_broadcast_id(command)
+    if broadcast_id is None:
+        return await message.answer("Usage: /broadcast_resume <i>id</i>")
+
+    broadcast = await broadcast_worker.unpause(broadcast_id)
+    if broadcast is None:
+        return await message.answer(f"Broadcast #{broadcast_id} doesn't exist.")
+    await message.answer(broadcast_details(broadcast))
+
+
+@broadcast_router.message(Command("broadcast_status"))
+async def broadcast_status(message: Message, command: CommandObject, broadcast_worker: BroadcastWorker):
+    broadcast_id = parse_broadcast_id(command)
+    if broadcast_id is None:
+        return await message.answer("Usage: /broadcast_status <i>id</i>")
+
+    broadcast = await broadcast_worker.status(broadcast_id)
+    if broadcast is None:
+        return await message.answer(f"Broadcast #{broadcast_id} doesn't exist.")
+    await message.answer(broadcast_details(broadcast))
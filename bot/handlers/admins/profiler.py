@@ -0,0 +1,36 @@
+from aiogram import Router
+from aiogram.filters import Command, CommandObject
+from aiogram.types import Message, FSInputFile
+
+from bot.filters.admin import AdminFilter
+from bot.services.profiler import SlowUpdateProfiler
+
+# Initialize a router, all of its handlers are available only to the admins
+profiler_router = Router()
+profiler_router.message.filter(AdminFilter())
+
+
+@profiler_router.message(Command("profiles"))
+async def list_profiles(message: Message, profiler: SlowUpdateProfiler | None = None):
+    if profiler is None:
+        return await message.answer("Profiler is disabled, set PROFILER_ENABLED=True to enable it.")
+
+    profiles = profiler.list_profiles()
+    if not profiles:
+        return await message.answer("There are no slow updates yet.")
+
+    lines = [f"{number}. <code>{path.name}</code>" for number, path in enumerate(profiles, start=1)]
+    await message.answer("🐢 <b>Slow updates</b>\n\n" + "\n".join(lines) + "\n\nUsage: /profile <i>number</i>")
+
+
+@profiler_router.message(Command("profile"))
+async def send_profile(message: Message, command: CommandObject, profiler: SlowUpdateProfiler | None = None):
+    if profiler is None:
+        return await message.answer("Profiler is disabled, set PROFILER_ENABLED=True to enable it.")
+
+    profiles = profiler.list_profiles()
+    if not command.args or not command.args.strip().isdigit() or not 0 < int(command.args) <= len(profiles):
+        return await message.answer("Usage: /profile <i>number</i>, see /profiles for the list.")
+
+    path = profiles[int(command.args) - 1]
+    await message.answer_document(FSInputFile(path, filename=path.name))
@@ -0,0 +1,76 @@
+from typing import Optional, Tuple
+
+from aiogram import Router, F, html
+from aiogram.filters import Command
+from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup
+
+from bot.keyboards.inline_keyboard.inline_keyboard import ReceiptsPage, receipts_page_keyboard
+from database.commands.requests import RequestsDistributor
+
+# Number of receipts on one page of the history
+PAGE_SIZE = 10
+
+# Initialize a router
+receipts_router = Router()
+
+
+async def get_page(
+        distributor: RequestsDistributor,
+        user_id: int,
+        page: Optional[ReceiptsPage] = None
+) -> Optional[Tuple[str, Optional[InlineKeyboardMarkup]]]:
+    """
+    Function to read a page of the user's receipt history with one indexed range query.
+    One receipt more than the page size is read to know whether there is another page in that direction.
+
+    :param distributor: requests distributor of the update.
+    :param user_id: user's telegram ID.
+    :param page: callback data with the cursor, the newest receipts are read if it's empty.
+    :return: text and keyboard of the page or None if there are no receipts in that direction.
+    """
+
+    receipts = distributor.receipts
+    has_newer = has_older = False
+
+    if page is not None and page.direction == "newer":
+        rows = await receipts.get_user_receipts(user_id, limit=PAGE_SIZE + 1, after=page.cursor)
+        has_newer, has_older = len(rows) > PAGE_SIZE, True
+        rows = rows[-PAGE_SIZE:]
+    else:
+        before = page.cursor if page is not None else None
+        rows = await receipts.get_user_receipts(user_id, limit=PAGE_SIZE + 1, before=before)
+        has_newer, has_older = page is not None, len(rows) > PAGE_SIZE
+        rows = rows[:PAGE_SIZE]
+
+    if not rows:
+        return None
+
+    lines = [
+        f"🧾 {receipt.created_at:%Y-%m-%d %H:%M} — <b>{html.quote(receipt.product_name)}</b> "
+        f"× {receipt.quantity}, {receipt.price} {html.quote(receipt.currency)}"
+        for receipt in rows
+    ]
+    text = "📜 <b>Your purchases</b>\n\n" + "\n".join(lines)
+    return text, receipts_page_keyboard(rows[0], rows[-1], has_newer=has_newer, has_older=has_older)
+
+
+@receipts_router.message(Command("receipts"))
+async def show_receipts(message: Message, distributor: RequestsDistributor):
+    page = await get_page(distributor, message.from_user.id)
+    if page is None:
+        return await message.answer("You don't have any purchases yet.")
+
+    text, keyboard = page
+    await message.answer(text, reply_markup=keyboard)
+
+
+@receipts_router.callback_query(ReceiptsPage.filter(F.direction.in_({"newer", "older"})))
+async def turn_receipts_page(call: CallbackQuery, callback_data: ReceiptsPage, distributor: RequestsDistributor):
+    # The cursor only moves through the receipts of the user who pressed the button
+    page = await get_page(distributor, call.from_user.id, callback_data)
+    if page is None:
+        return await call.answer("There are no more purchases.")
+
+    text, keyboard = page
+    await call.message.edit_text(text, reply_markup=keyboard)
+    await call.answer()
@@ -0,0 +1,66 @@
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from database.models.receipts import Receipt
+
+EPOCH = datetime(1970, 1, 1)
+
+
+class ReceiptsPage(CallbackData, prefix="receipts"):
+    """
+    Callback data of the receipt history buttons, it carries the keyset cursor of the page to open.
+    created_at is packed as microseconds since the epoch to fit into the 64 bytes of callback data.
+
+    Attributes
+    ----------
+    direction [str] -> "older" to open the receipts before the cursor, "newer" to open the receipts after it.
+    created_at [int] -> created_at of the receipt at the cursor in microseconds since the epoch.
+    id [int] -> id of the receipt at the cursor.
+    """
+
+    direction: str
+    created_at: int
+    id: int
+
+    @classmethod
+    def from_receipt(cls, direction: str, receipt: Receipt) -> "ReceiptsPage":
+        return cls(direction=direction, created_at=(receipt.created_at - EPOCH) // timedelta(microseconds=1),
+                   id=receipt.id)
+
+    @property
+    def cursor(self) -> Tuple[datetime, int]:
+        return EPOCH + timedelta(microseconds=self.created_at), self.id
+
+
+def receipts_page_keyboard(
+        newest: Receipt,
+        oldest: Receipt,
+        has_newer: bool,
+        has_older: bool
+) -> Optional[InlineKeyboardMarkup]:
+    """
+    Function to create the navigation keyboard of a page of the receipt history.
+
+    :param newest: the first receipt of the page.
+    :param oldest: the last receipt of the page.
+    :param has_newer: whether there are newer receipts than the page.
+    :param has_older: whether there are older receipts than the page.
+    :return: keyboard or None if the whole history fits into the page.
+    """
+
+    buttons = []
+    if has_newer:
+        buttons.append(InlineKeyboardButton(
+            text="⬅️ Newer", callback_data=ReceiptsPage.from_receipt("newer", newest).pack()
+        ))
+    if has_older:
+        buttons.append(InlineKeyboardButton(
+            text="Older ➡️", callback_data=ReceiptsPage.from_receipt("older", oldest).pack()
+        ))
+
+    if not buttons:
+        return None
+    return InlineKeyboardMarkup(inline_keyboard=[buttons])
@@ -1,27 +1,141 @@
+import cProfile
 import logging
-from typing import Any, Awaitable, Callable, Dict
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional
 
 from aiogram import BaseMiddleware
-from aiogram.types import Message, TelegramObject
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.types import Message, TelegramObject, Update
 
+from bot.data.config import ConfigStore
 from bot.paypal.paypal import PaypalProcessor
-from database.commands.requests import RequestsDistributor
+from bot.services.logs import should_sample, update_context
+from bot.services.metrics import update_duration, update_errors
+from bot.services.profiler import SlowUpdateProfiler, profile_coroutine
+from database.commands.cache import ReadCache, TTLCache
+from database.commands.requests import LazyRequestsDistributor
+from database.commands.users import UserWriteBuffer
 
 
 class LoggingMiddleware(BaseMiddleware):
+    """
+    Outer update middleware that sets the logging context of the update and logs its outcome.
+    Whether a successful update is logged is decided once per update with the configured sample rate,
+    failed updates are always logged with the traceback.
+    """
+
+    def __init__(self, config_store: ConfigStore) -> None:
+        self.config_store = config_store
+
+    async def __call__(
+            self,
+            handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+            event: Update,
+            data: Dict[str, Any]
+    ) -> Any:
+        chat = data.get("event_chat")
+        context = {
+            "update_id": event.update_id,
+            "chat_id": chat.id if chat else None,
+            "handler": None,
+            "sampled": should_sample(self.config_store.current.logs.sample_rate),
+        }
+        token = update_context.set(context)
+        started = time.perf_counter()
+        try:
+            result = await handler(event, data)
+        except Exception:
+            duration = round((time.perf_counter() - started) * 1000, 2)
+            logging.exception("[UPDATE] Update failed", extra={"duration_ms": duration})
+            raise
+        else:
+            duration = round((time.perf_counter() - started) * 1000, 2)
+            status = "handled" if result is not UNHANDLED else "not handled"
+            logging.info(f"[UPDATE] Update is {status}", extra={"duration_ms": duration})
+            return result
+        finally:
+            update_context.reset(token)
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """
+    Outer update middleware that records the processing time of every update by the handler that processed it.
+    It must be registered after LoggingMiddleware, since the handler name is taken from the logging context.
+    """
+
+    async def __call__(
+            self,
+            handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+            event: Update,
+            data: Dict[str, Any]
+    ) -> Any:
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            update_errors.labels(self._get_handler_name(), type(e).__name__).inc()
+            raise
+        finally:
+            update_duration.labels(self._get_handler_name()).observe(time.perf_counter() - started)
+
+    @staticmethod
+    def _get_handler_name() -> str:
+        context = update_context.get()
+        return (context or {}).get("handler") or "unhandled"
+
+
+class ProfilerMiddleware(BaseMiddleware):
+    """
+    Outer update middleware that profiles a sample of the updates and keeps the profiles of the slow ones.
+    It's registered only when the profiler is enabled, so it costs nothing otherwise.
+    It must be registered after LoggingMiddleware, since the handler name is taken from the logging context.
+    """
+
+    def __init__(self, profiler: SlowUpdateProfiler) -> None:
+        self.profiler = profiler
+
+    async def __call__(
+            self,
+            handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+            event: Update,
+            data: Dict[str, Any]
+    ) -> Any:
+        if not should_sample(self.profiler.sample_rate):
+            return await handler(event, data)
+
+        profile = cProfile.Profile()
+        started = time.perf_counter()
+        try:
+            return await profile_coroutine(handler(event, data), profile)
+        finally:
+            duration = time.perf_counter() - started
+            if duration >= self.profiler.threshold:
+                context = update_context.get() or {}
+                await self.profiler.save(profile, event.update_id, context.get("handler"), duration)
+
+
+class HandlerNameMiddleware(BaseMiddleware):
+    """
+    Inner middleware that adds the name of the handler that's been chosen for the event to the logging context.
+    """
+
     async def __call__(
             self,
             handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
             event: TelegramObject,
             data: Dict[str, Any]
     ) -> Any:
-        logging.info(f"[UPDATE] Incoming update: {event}")
+        context = update_context.get()
+        handler_object = data.get("handler")
+        if context is not None and handler_object is not None:
+            context["handler"] = getattr(handler_object.callback, "__qualname__", repr(handler_object.callback))
         return await handler(event, data)
 
 
 class ConfigMiddleware(BaseMiddleware):
-    def __init__(self, config) -> None:
-        self.config = config
+    def __init__(self, config_store: ConfigStore) -> None:
+        self.config_store = config_store
 
     async def __call__(
             self,
@@ -29,7 +143,8 @@ class ConfigMiddleware(BaseMiddleware):
             event: Message,
             data: Dict[str, Any],
     ) -> Any:
-        data["config"] = self.config
+        # The snapshot is taken once, so the whole update is handled with the same version of the configuration
+        data["config"] = self.config_store.current
         return await handler(event, data)
 
 
@@ -43,14 +158,38 @@ class PaypalMiddleware(BaseMiddleware):
             event: Message,
             data: Dict[str, Any],
     ) -> Any:
-        self.paypal.configuration()
         data["paypal"] = self.paypal
         return await handler(event, data)
 
 
+@dataclass
+class DatabaseUsage:
+    """
+    Shows how many updates actually needed a database session.
+
+    Attributes
+    ----------
+    updates [int] -> number of updates that passed through the middleware.
+    sessions [int] -> number of updates that opened a database session.
+    """
+
+    updates: int = 0
+    sessions: int = 0
+
+
 class DatabaseMiddleware(BaseMiddleware):
-    def __init__(self, session_pool) -> None:
+    def __init__(
+            self,
+            session_pool,
+            cache: Optional[ReadCache] = None,
+            upsert_cache: Optional[TTLCache] = None,
+            write_buffer: Optional[UserWriteBuffer] = None
+    ) -> None:
         self.session_pool = session_pool
+        self.cache = cache
+        self.upsert_cache = upsert_cache
+        self.write_buffer = write_buffer
+        self.usage = DatabaseUsage()
 
     async def __call__(
             self,
@@ -58,10 +197,14 @@ class DatabaseMiddleware(BaseMiddleware):
             event: Message,
             data: Dict[str, Any],
     ) -> Any:
-        async with self.session_pool() as session:
-            distributor = RequestsDistributor(session)
-            data["session"] = session
-            data["distributor"] = distributor
+        # The session is opened only when the handler uses the distributor and is closed right after the handler
+        distributor = LazyRequestsDistributor(self.session_pool, self.cache, self.upsert_cache, self.write_buffer)
+        data["distributor"] = distributor
+        self.usage.updates += 1
 
-            result = await handler(event, data)
-        return result
+        try:
+            return await handler(event, data)
+        finally:
+            if distributor.opened:
+                self.usage.sessions += 1
+                await distributor.close()
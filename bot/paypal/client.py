@@ -0,0 +1,261 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Optional
+
+import aiohttp
+
+from bot.data.config import PaypalConfig
+from bot.services.metrics import paypal_duration, paypal_errors
+
+PAYPAL_API_URLS = {
+    "sandbox": "https://api-m.sandbox.paypal.com",
+    "live": "https://api-m.paypal.com",
+}
+
+
+class PaypalError(Exception):
+    """
+    Raised when PayPal answers with an unsuccessful status code.
+
+    Attributes
+    ----------
+    status [int] -> HTTP status of the response.
+    details [Any] -> decoded body of the response (usually a dict with "name" and "message").
+    """
+
+    def __init__(self, status: int, details: Any):
+        super().__init__(f"PayPal responded with {status}: {details}")
+        self.status = status
+        self.details = details
+
+
+class ResourceNotFound(PaypalError):
+    """
+    Raised when the requested PayPal resource (for example a payment) doesn't exist.
+    """
+
+
+class PaypalConnectionError(PaypalError):
+    """
+    Raised when PayPal can't be reached or doesn't answer in time, the request may be retried later.
+    The status is 0, because there is no response.
+    """
+
+    def __init__(self, error: Exception):
+        super().__init__(0, f"{type(error).__name__}: {error}")
+
+
+class PaypalClient:
+    """
+    Asynchronous client for the PayPal REST API (v1 payments).
+
+    All the requests go through a single keep-alive aiohttp session, so connections to PayPal are pooled
+    and reused. The OAuth access token is cached in memory and refreshed shortly before it expires.
+
+    Attributes
+    ----------
+    base_url [str] -> PayPal API url, it can be pointed at a local fake server for testing.
+    timeout [aiohttp.ClientTimeout] -> timeout applied to every request.
+    """
+
+    def __init__(
+            self,
+            client_id: str,
+            client_secret: str,
+            mode: str = "sandbox",
+            base_url: Optional[str] = None,
+            timeout: float = 10.0,
+            connection_limit: int = 100,
+            token_refresh_margin: float = 60.0
+    ):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.base_url = (base_url or PAYPAL_API_URLS[mode]).rstrip("/")
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.connection_limit = connection_limit
+        self.token_refresh_margin = token_refresh_margin
+
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._access_token: Optional[str] = None
+        self._token_expires_at: float = 0.0
+        self._token_lock = asyncio.Lock()
+
+    @classmethod
+    def from_config(cls, config: PaypalConfig) -> "PaypalClient":
+        """
+        Creates a PaypalClient from the PayPal configuration.
+
+        :param config: PaypalConfig configuration object.
+        :return: PaypalClient object.
+        """
+
+        return cls(
+            client_id=config.paypal_client_id,
+            client_secret=config.paypal_client_secret,
+            mode=config.paypal_mode,
+            base_url=config.paypal_api_url,
+            timeout=config.paypal_timeout
+        )
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.connection_limit, keepalive_timeout=30),
+                timeout=self.timeout,
+            )
+        return self._session
+
+    async def _get_access_token(self) -> str:
+        """
+        Returns a cached access token or requests a new one if the cached token is about to expire.
+        Concurrent callers wait for the same refresh instead of requesting a token each.
+
+        :return: OAuth access token.
+        """
+
+        if self._access_token and time.monotonic() < self._token_expires_at:
+            return self._access_token
+
+        async with self._token_lock:
+            if self._access_token and time.monotonic() < self._token_expires_at:
+                return self._access_token
+
+            async with self._get_session().post(
+                    f"{self.base_url}/v1/oauth2/token",
+                    data={"grant_type": "client_credentials"},
+                    auth=aiohttp.BasicAuth(self.client_id, self.client_secret),
+                    headers={"Accept": "application/json"},
+            ) as response:
+                body = await response.json(content_type=None)
+                if response.status != 200:
+                    raise PaypalError(response.status, body)
+
+            self._access_token = body["access_token"]
+            self._token_expires_at = time.monotonic() + float(body["expires_in"]) - self.token_refresh_margin
+            return self._access_token
+
+    def invalidate_token(self) -> None:
+        """
+        Drops the cached access token, so the next request fetches a new one.
+        """
+
+        self._access_token = None
+        self._token_expires_at = 0.0
+
+    async def _request(self, operation: str, method: str, path: str, payload: Optional[Dict] = None) -> Dict:
+        """
+        Sends an authorized request to PayPal and records its latency and errors.
+        Network errors and timeouts are raised as PaypalConnectionError.
+
+        :param operation: name of the operation in the metrics, e.g. create.
+        :param method: HTTP method.
+        :param path: path of the endpoint, e.g. /v1/payments/payment.
+        :param payload: JSON body of the request.
+        :return: decoded JSON response.
+        """
+
+        started = time.perf_counter()
+        try:
+            return await self._send(method, path, payload)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            paypal_errors.labels(operation, type(e).__name__).inc()
+            raise PaypalConnectionError(e) from e
+        except PaypalError as e:
+            paypal_errors.labels(operation, str(e.status)).inc()
+            raise
+        except Exception as e:
+            paypal_errors.labels(operation, type(e).__name__).inc()
+            raise
+        finally:
+            paypal_duration.labels(operation).observe(time.perf_counter() - started)
+
+    async def _send(self, method: str, path: str, payload: Optional[Dict] = None) -> Dict:
+        """
+        Sends an authorized request to PayPal. If the token was revoked before its expiry,
+        it's refreshed and the request is retried once.
+
+        :param method: HTTP method.
+        :param path: path of the endpoint, e.g. /v1/payments/payment.
+        :param payload: JSON body of the request.
+        :return: decoded JSON response.
+        """
+
+        for attempt in range(2):
+            token = await self._get_access_token()
+            async with self._get_session().request(
+                    method,
+                    f"{self.base_url}{path}",
+                    json=payload,
+                    headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
+            ) as response:
+                body = await response.json(content_type=None)
+
+                if response.status == 401 and attempt == 0:
+                    logging.info("[INFO] PayPal access token was rejected, requesting a new one.")
+                    self.invalidate_token()
+                    continue
+                if response.status == 404:
+                    raise ResourceNotFound(response.status, body)
+                if response.status >= 400:
+                    raise PaypalError(response.status, body)
+                return body
+
+    async def create_payment(self, payment: Dict) -> Dict:
+        """
+        Creates a payment.
+
+        :param payment: payment resource (intent, payer, redirect_urls, transactions).
+        :return: created payment with its id and links.
+        """
+
+        return await self._request("create", "POST", "/v1/payments/payment", payment)
+
+    async def find_payment(self, payment_id: str) -> Dict:
+        """
+        Finds a payment by its ID.
+
+        :param payment_id: id of the payment.
+        :return: payment resource.
+        """
+
+        return await self._request("find", "GET", f"/v1/payments/payment/{payment_id}")
+
+    async def execute_payment(self, payment_id: str, payer_id: str) -> Dict:
+        """
+        Executes a payment that has been approved by the payer.
+
+        :param payment_id: id of the payment.
+        :param payer_id: id of the payer who approved the payment.
+        :return: executed payment resource with payer information and transactions.
+        """
+
+        return await self._request(
+            "execute", "POST", f"/v1/payments/payment/{payment_id}/execute", {"payer_id": payer_id}
+        )
+
+    async def download(self, url: str) -> bytes:
+        """
+        Downloads a public PayPal resource (e.g. a webhook signing certificate) without authorization.
+
+        :param url: url of the resource.
+        :return: body of the response.
+        :raises PaypalConnectionError: if the resource can't be downloaded.
+        """
+
+        try:
+            async with self._get_session().get(url) as response:
+                body = await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise PaypalConnectionError(e) from e
+        if response.status != 200:
+            raise PaypalError(response.status, body[:200])
+        return body
+
+    async def close(self) -> None:
+        """
+        Closes the underlying HTTP session.
+        """
+
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
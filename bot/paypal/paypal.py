@@ -1,45 +1,99 @@
+import asyncio
 import logging
-from typing import List, Dict
+import json
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import List, Dict, Optional, Tuple
 
-import paypalrestsdk
 from aiogram import Bot
-from aiogram.client.default import DefaultBotProperties
-from aiogram.enums import ParseMode
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, WebAppInfo
 from aiohttp import web
-from paypalrestsdk.exceptions import InvalidConfig
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.asyncio import async_sessionmaker
 
 from bot.data.config import Config
+from bot.paypal.client import PaypalClient, PaypalConnectionError, PaypalError, ResourceNotFound
+from bot.paypal.pipeline import ConfirmationPipeline, ConfirmationJob
+from bot.paypal.webhook import WebhookVerifier
 from bot.services.send_message import send_message
+from bot.services.single_flight import SingleFlight
+from database.commands.cache import ReadCache
 from database.commands.requests import RequestsDistributor
-from database.setup import create_engine
+
+
+def get_create_time(payment: Dict) -> Optional[datetime]:
+    """
+    Function to get the time when the payment was created, as a naive UTC datetime like created_at of the receipts.
+    The time doesn't change between retries, so it keeps the receipts of a payment unique in a partitioned table.
+
+    :param payment: payment resource.
+    :return: create time or None if the payment doesn't have it.
+    """
+
+    create_time = payment.get("create_time")
+    if not create_time:
+        return None
+    return datetime.fromisoformat(create_time.replace("Z", "+00:00")).astimezone(timezone.utc).replace(tzinfo=None)
 
 
 class PaypalProcessor:
-    def __init__(self, config: Config):
+    def __init__(
+            self,
+            config: Config,
+            bot: Bot,
+            session_pool: async_sessionmaker,
+            client: PaypalClient = None,
+            cache: Optional[ReadCache] = None
+    ):
         self.config = config
-        self.paypal = paypalrestsdk
+        self.bot = bot
+        self.session_pool = session_pool
+        # Read cache of the application, the stored receipts are invalidated in it
+        self.cache = cache
+        self.client = client or PaypalClient.from_config(config.paypal)
+        self.single_flight = SingleFlight()
+        self.webhook_verifier = WebhookVerifier(self.client, config.paypal.paypal_webhook_id)
+        self.pipeline = ConfirmationPipeline(
+            self.process_job,
+            workers=config.paypal.confirmation_workers,
+            queue_size=config.paypal.confirmation_queue_size
+        )
 
-    def configuration(self) -> bool:
+    def apply_config(self, config: Config) -> None:
         """
-        Function to configure PayPal.
+        Function to switch the processor to a new configuration snapshot.
+        If PayPal settings have changed (e.g. rotated credentials), a new client is created, the old one
+        is closed once the requests that are still using it have had time to finish.
 
-        :return: True if configuration was successful, False otherwise
+        :param config: new Config snapshot.
         """
 
-        paypal_config = {
-            "mode": self.config.paypal.paypal_mode,
-            "client_id": self.config.paypal.paypal_client_id,
-            "client_secret": self.config.paypal.paypal_client_secret
-        }
+        paypal_changed = config.paypal != self.config.paypal
+        self.config = config
+        if not paypal_changed:
+            return
+
+        old_client = self.client
+        self.client = PaypalClient.from_config(config.paypal)
+        self.webhook_verifier = WebhookVerifier(self.client, config.paypal.paypal_webhook_id)
+        asyncio.get_running_loop().call_later(
+            config.paypal.paypal_timeout * 2, lambda: asyncio.ensure_future(old_client.close())
+        )
+        logging.info("[INFO] PayPal client has been reconfigured.")
+
+    def start(self) -> None:
+        """
+        Function to start the workers that confirm payments in the background.
+        """
 
-        try:
-            self.paypal.configure(paypal_config)
-            return True
-        except InvalidConfig as error:
-            logging.error(f"Couldn't configure paypal: {error}")
-            return False
+        self.pipeline.start()
+
+    async def close(self) -> None:
+        """
+        Function to finish the queued confirmations and close the connections of the PayPal client.
+        """
+
+        await self.pipeline.close()
+        await self.client.close()
 
     async def send_payment(
             self,
@@ -81,95 +135,200 @@ class PaypalProcessor:
         :param text: message text.
         :return:
         """
-        bot = Bot(
-            token=self.config.telegram_bot.token,
-            default=DefaultBotProperties(parse_mode=ParseMode.HTML)
-        )
 
-        payment = paypalrestsdk.Payment(
-            {
-                "intent": intent,
-                "payer": {
-                    "payment_method": "paypal"
-                },
-                "redirect_urls": {
-                    "return_url": return_url,
-                    "cancel_url": cancel_url
-                },
-                "transactions": [{
-                    "item_list": {
-                        "items": items
+        try:
+            payment = await self.client.create_payment(
+                {
+                    "intent": intent,
+                    "payer": {
+                        "payment_method": "paypal"
                     },
-                    "amount": {
-                        "total": total,
-                        "currency": currency},
-                    "description": description}]
-            }
-        )
-
-        if payment.create():
-            approval_url = ""
-            for link in payment.links:
-                if link.rel == 'approval_url':
-                    approval_url = link.href
-                    break
+                    "redirect_urls": {
+                        "return_url": return_url,
+                        "cancel_url": cancel_url
+                    },
+                    "transactions": [{
+                        "item_list": {
+                            "items": items
+                        },
+                        "amount": {
+                            "total": total,
+                            "currency": currency},
+                        "description": description,
+                        # The user is stored in the payment, so webhook events can be matched with the user
+                        "custom": str(user_id)}]
+                }
+            )
+        except PaypalError as error:
+            logging.error(f"[ERROR] Payment creation failed: {error}")
+            return False
 
-            async with bot.session:
-                return await send_message(
-                    bot=bot,
-                    user_id=user_id,
-                    text=text,
-                    disable_notification=False,
-                    reply_markup=InlineKeyboardMarkup(
-                        inline_keyboard=[
-                            [
-                                InlineKeyboardButton(
-                                    text=f"Pay ${total} {currency}", web_app=WebAppInfo(url=f"{approval_url}")
-                                )
-                            ]
-                        ]
-                    ),
-                )
+        approval_url = ""
+        for link in payment.get("links", []):
+            if link["rel"] == 'approval_url':
+                approval_url = link["href"]
+                break
+
+        return await send_message(
+            bot=self.bot,
+            user_id=user_id,
+            text=text,
+            disable_notification=False,
+            reply_markup=InlineKeyboardMarkup(
+                inline_keyboard=[
+                    [
+                        InlineKeyboardButton(
+                            text=f"Pay ${total} {currency}", web_app=WebAppInfo(url=f"{approval_url}")
+                        )
+                    ]
+                ]
+            ),
+        )
 
     async def check_payment(self, request: web.Request):
         """
-        Function to check a status of the payment.
-        If successful, sends a successful web response and sends a message to the user about the transaction details.
+        Function to accept the payer's return from PayPal.
+        The payment is put in the confirmation queue and the response is sent right away, the payment is executed
+        and the transaction details are sent to the user in the background.
 
         :param request: web.Request type of object.
         :return: web.Request message.
         """
 
-        bot = Bot(
-            token=self.config.telegram_bot.token,
-            default=DefaultBotProperties(parse_mode=ParseMode.HTML)
-        )
-
         payment_id = request.query.get('paymentId')
         payer_id = request.query.get('PayerID')
         user_id = request.query.get("user_id")
 
         if not payment_id or not payer_id:
             return web.Response(text="Missing paymentId or PayerID.", status=400)
+        if user_id is not None and not user_id.isdigit():
+            return web.Response(text="Invalid user_id.", status=400)
+
+        if not self.pipeline.submit(ConfirmationJob(payment_id=payment_id, payer_id=payer_id, user_id=user_id)):
+            return web.Response(
+                text="Too many payments are being processed, please refresh the page in a few seconds.",
+                status=503,
+                headers={"Retry-After": "5"}
+            )
+
+        return web.Response(
+            text="Payment is being processed, you will receive the details in Telegram shortly.", status=202
+        )
+
+    async def handle_webhook(self, request: web.Request):
+        """
+        Function to accept PayPal webhook events.
+        The signature is verified locally, completed sales are put in the confirmation queue,
+        so payments are recorded even if the payer never returns to /payment/success.
+
+        :param request: web.Request type of object.
+        :return: web.Request message.
+        """
+
+        body = await request.read()
+        if not await self.webhook_verifier.verify(request.headers, body):
+            logging.error("[ERROR] PayPal webhook event with an invalid signature was rejected.")
+            return web.Response(text="Invalid signature.", status=400)
 
         try:
-            # Find the payment by its ID
-            payment = paypalrestsdk.Payment.find(payment_id)
+            event = json.loads(body)
+        except ValueError:
+            return web.Response(text="Invalid event.", status=400)
+
+        if event.get("event_type") != "PAYMENT.SALE.COMPLETED":
+            return web.Response(text="Event ignored.")
+
+        payment_id = event.get("resource", {}).get("parent_payment")
+        if not payment_id:
+            return web.Response(text="Event ignored.")
 
-            if not payment.execute({"payer_id": payer_id}):
-                logging.error(f"[ERROR] Payment execution failed: {payment.error}")
-                return web.Response(text="Payment failed or cancelled.", status=400)
+        # Respond with an error when the queue is full, PayPal will deliver the event again later
+        if not self.pipeline.submit(ConfirmationJob(payment_id=payment_id)):
+            self.webhook_verifier.forget(request.headers["PAYPAL-TRANSMISSION-ID"])
+            return web.Response(text="Too many payments are being processed.", status=503)
+        return web.Response(text="Event accepted.")
+
+    async def process_job(self, job: ConfirmationJob) -> Tuple[int, str]:
+        """
+        Function to confirm a queued payment. Concurrent jobs for the same payment share one execution.
+
+        :param job: ConfirmationJob object.
+        :return: HTTP status and text that describe the result.
+        """
+
+        return await self.single_flight.do(
+            job.payment_id, lambda: self.confirm_payment(job.payment_id, job.payer_id, job.user_id)
+        )
+
+    async def confirm_payment(
+            self,
+            payment_id: str,
+            payer_id: Optional[str] = None,
+            user_id: Optional[int | str] = None
+    ) -> Tuple[int, str]:
+        """
+        Function to execute the payment, store its receipts and send the transaction details to the user.
+        If the receipts of the payment have already been stored, the payment isn't executed again.
+
+        :param payment_id: id of the payment.
+        :param payer_id: id of the payer who approved the payment, if it's empty (e.g. the payment comes from
+            a webhook event) the payment is only loaded, because it has already been executed.
+        :param user_id: id of the user from the return url, it's only used if the payment doesn't hold
+            the user (the "custom" field of the transaction), because the url can be changed by the payer.
+        :return: HTTP status and text of the response.
+        """
+
+        if user_id is not None and not str(user_id).isdigit():
+            logging.error(f"[ERROR] Payment [ID: {payment_id}] has an invalid user id: {user_id!r}.")
+            return 400, "Invalid user information."
+
+        async with self.session_pool() as session:
+            if await RequestsDistributor(session, self.cache).receipts.get_payment_receipts(payment_id):
+                return 200, "Payment successful!"
+
+        try:
+            # Execute the payment, the response holds the payer information and transactions
+            try:
+                if payer_id:
+                    payment = await self.client.execute_payment(payment_id, payer_id)
+                else:
+                    payment = await self.client.find_payment(payment_id)
+            except (ResourceNotFound, PaypalConnectionError):
+                # Not found is answered with 404, if PayPal can't be reached the job is retried
+                raise
+            except PaypalError as error:
+                if not isinstance(error.details, dict) or error.details.get("name") != "PAYMENT_ALREADY_DONE":
+                    logging.error(f"[ERROR] Payment execution failed: {error.details}")
+                    return 400, "Payment failed or cancelled."
+                # A previous attempt executed the payment but didn't store it, so just load it
+                payment = await self.client.find_payment(payment_id)
 
             try:
                 payer = payment["payer"]
                 transactions = payment["transactions"][0]
                 if not payer or not transactions:
                     logging.error("[EXCEPTION] Missing payer information or transactions.")
-                    return web.Response(text="Missing payer information or transactions.", status=400)
+                    return 400, "Missing payer information or transactions."
+
+                custom = transactions.get("custom")
+                if custom:
+                    if user_id is not None and str(user_id) != custom:
+                        logging.warning(
+                            f"[WARNING] User id of the payment [ID: {payment_id}] doesn't match the return url, "
+                            f"the payment's user is used."
+                        )
+                    user_id = custom
+                if not user_id:
+                    logging.error(f"[EXCEPTION] Payment [ID: {payment_id}] doesn't belong to any user.")
+                    return 400, "Missing user information."
+                if not str(user_id).isdigit():
+                    logging.error(f"[EXCEPTION] Payment [ID: {payment_id}] has an invalid user id: {user_id!r}.")
+                    return 400, "Invalid user information."
+                user_id = int(user_id)
 
             except KeyError as error:
                 logging.error(f"An error occurred while processing the payment.\n{error}")
-                return web.Response(text="An error occurred while processing the payment.", status=500)
+                return 500, "An error occurred while processing the payment."
 
             payer_email = payer["payer_info"]["email"]
             payer_first_name = payer["payer_info"]["first_name"]
@@ -187,36 +346,32 @@ Here's your payment details:
 <i>PRODUCTS</i>"""
 
             transaction_payment_description = transactions["description"]
+            create_time = get_create_time(payment)
 
-            for item in transactions["item_list"]["items"]:
-                transformed_item = item.to_dict()
-
+            receipts = []
+            for item_index, transformed_item in enumerate(transactions["item_list"]["items"]):
                 item = transformed_item["name"]
-                item_description = transformed_item["description"]
+                item_description = transformed_item.get("description", "")
                 item_price = transformed_item["price"]
                 item_currency = transformed_item["currency"]
                 item_quantity = transformed_item["quantity"]
 
-                engine = create_engine(self.config.database, echo=True)
-                async with AsyncSession(bind=engine) as session:
-                    requests_distributor = RequestsDistributor(session)
-
-                    receipt_result = await requests_distributor.receipts.create_receipt(
-                        user_id=int(user_id),
-                        payer_email=payer_email,
-                        payer_first_name=payer_first_name,
-                        payer_last_name=payer_last_name,
-                        product_name=item,
-                        product_description=transaction_payment_description,
-                        price=float(item_price),
-                        currency=item_currency,
-                        quantity=int(item_quantity)
-                    )
-
-                    if receipt_result:
-                        logging.info(f"[INFO] Successfully added a receipt to the user with id -> [ID: {user_id}].")
-                    else:
-                        logging.info(f"[ERROR] Couldn't add a receipt to the user with id -> [ID: {user_id}].")
+                receipt = dict(
+                    payment_id=payment_id,
+                    item_index=item_index,
+                    user_id=user_id,
+                    payer_email=payer_email,
+                    payer_first_name=payer_first_name,
+                    payer_last_name=payer_last_name,
+                    product_name=item,
+                    product_description=transaction_payment_description,
+                    price=Decimal(str(item_price)),
+                    currency=item_currency,
+                    quantity=int(item_quantity)
+                )
+                if create_time is not None:
+                    receipt["created_at"] = create_time
+                receipts.append(receipt)
 
                 payment_details += f"""
                 
@@ -227,21 +382,37 @@ Here's your payment details:
 🔢 <b>Quantity:</b> {item_quantity}
 ✏️ <b>Description:</b> {item_description}"""
 
+            if not receipts:
+                logging.error(f"[EXCEPTION] Payment [ID: {payment_id}] has no items.")
+                return 400, "Missing items of the payment."
+
             payment_details += f"""
             
 <b>TOTAL:</b> ${transactions["amount"]["total"]} {transactions["amount"]["currency"]}"""
 
+            # All the items of the payment are stored in one transaction through the shared session pool
+            async with self.session_pool() as session:
+                created_receipts = await RequestsDistributor(session, self.cache).receipts.create_many(receipts)
+
+            if not created_receipts:
+                # Another process has already stored this payment and notified the user
+                logging.info(f"[INFO] Receipts of the payment [ID: {payment_id}] have already been stored.")
+                return 200, "Payment successful!"
+
+            logging.info(
+                f"[INFO] Successfully added {len(created_receipts)} receipts to the user with id -> [ID: {user_id}]."
+            )
+
             logging.info("[SUCCESS] Payment executed successfully.")
 
-            async with bot.session:
-                await send_message(
-                    bot=bot, user_id=user_id, text=payment_details
-                )
+            await send_message(
+                bot=self.bot, user_id=user_id, text=payment_details
+            )
 
-            return web.Response(text="Payment successful!")
-        except paypalrestsdk.ResourceNotFound as e:
+            return 200, "Payment successful!"
+        except ResourceNotFound as e:
             logging.error(f"[ERROR] Payment not found: \n{e}")
-            return web.Response(text="Payment not found.", status=404)
+            return 404, "Payment not found."
         except Exception as e:
             logging.error(f"[ERROR] Error executing payment: \n{e}")
-            return web.Response(text="An error occurred while processing the payment.", status=500)
+            return 500, "An error occurred while processing the payment."
@@ -0,0 +1,217 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+
+@dataclass
+class ConfirmationJob:
+    """
+    A payment that has to be confirmed.
+
+    Attributes
+    ----------
+    payment_id [str] -> PayPal id of the payment.
+    payer_id [Optional[str]] -> id of the payer, if it's empty the payment is expected to be executed already.
+    user_id [Optional[int | str]] -> telegram ID of the user who made the payment.
+    enqueued_at [float] -> monotonic time when the job was put in the queue.
+    """
+
+    payment_id: str
+    payer_id: Optional[str] = None
+    user_id: Optional[int | str] = None
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+@dataclass
+class PipelineMetrics:
+    """
+    Counters of the confirmation pipeline.
+
+    Attributes
+    ----------
+    submitted [int] -> number of jobs that have been accepted.
+    duplicates [int] -> number of jobs that were deferred because the same payment was already queued.
+    resubmitted [int] -> number of deferred jobs that were run because the job before them failed.
+    rejected [int] -> number of jobs that were rejected because the queue was full.
+    processed [int] -> number of jobs that have been processed successfully.
+    failed [int] -> number of jobs that failed after all the retries.
+    retries [int] -> number of retries.
+    wait_time_total [float] -> total time in seconds the jobs spent in the queue.
+    wait_time_max [float] -> maximum time in seconds a job spent in the queue.
+    """
+
+    submitted: int = 0
+    duplicates: int = 0
+    resubmitted: int = 0
+    rejected: int = 0
+    processed: int = 0
+    failed: int = 0
+    retries: int = 0
+    wait_time_total: float = 0.0
+    wait_time_max: float = 0.0
+
+
+class ConfirmationPipeline:
+    """
+    Bounded in-process queue with a pool of workers that confirm payments in the background.
+
+    The web handler only puts a job in the queue and answers right away, the workers execute the payment,
+    store the receipts and notify the user. Jobs that fail with a server-side error (status >= 500)
+    are retried with an exponential backoff. When the queue is full new jobs are rejected, so the
+    handler can ask the client to come back later instead of piling up work.
+
+    A job for a payment that is already queued isn't queued again, it's deferred and run by the same worker
+    only if the queued job fails, e.g. a webhook event isn't lost when the job of the return url fails.
+
+    Attributes
+    ----------
+    process [Callable] -> coroutine function that confirms a job and returns HTTP status and text.
+    workers [int] -> number of worker tasks.
+    max_retries [int] -> how many times a job is retried.
+    retry_delay [float] -> delay in seconds before the first retry, it's doubled for every next retry.
+    metrics [PipelineMetrics] -> counters of the pipeline.
+    """
+
+    def __init__(
+            self,
+            process: Callable[[ConfirmationJob], Awaitable[Tuple[int, str]]],
+            workers: int = 4,
+            queue_size: int = 1000,
+            max_retries: int = 3,
+            retry_delay: float = 1.0
+    ):
+        self.process = process
+        self.workers = workers
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.metrics = PipelineMetrics()
+
+        self._queue: asyncio.Queue[ConfirmationJob] = asyncio.Queue(maxsize=queue_size)
+        self._pending: Set[str] = set()
+        self._deferred: Dict[str, ConfirmationJob] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._accepting = False
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    @property
+    def in_progress(self) -> int:
+        return len(self._pending) - self._queue.qsize()
+
+    def snapshot(self) -> Dict[str, float]:
+        """
+        Returns the current state of the pipeline.
+
+        :return: dict with the queue depth and the counters.
+        """
+
+        return {
+            "depth": self.depth,
+            "capacity": self._queue.maxsize,
+            "in_progress": self.in_progress,
+            **self.metrics.__dict__,
+        }
+
+    def start(self) -> None:
+        """
+        Starts the workers.
+        """
+
+        self._accepting = True
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def submit(self, job: ConfirmationJob) -> bool:
+        """
+        Puts a job in the queue. A job for a payment that is already queued or being processed is deferred
+        until that job finishes.
+
+        :param job: ConfirmationJob object.
+        :return: False if the job was rejected because the queue is full or the pipeline is stopped.
+        """
+
+        if not self._accepting:
+            self.metrics.rejected += 1
+            return False
+
+        if job.payment_id in self._pending:
+            self._deferred.setdefault(job.payment_id, job)
+            self.metrics.duplicates += 1
+            return True
+
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.metrics.rejected += 1
+            logging.warning(f"[WARNING] Confirmation queue is full, payment [ID: {job.payment_id}] is rejected.")
+            return False
+
+        self._pending.add(job.payment_id)
+        self.metrics.submitted += 1
+        return True
+
+    async def _handle(self, job: ConfirmationJob) -> bool:
+        waited = time.monotonic() - job.enqueued_at
+        self.metrics.wait_time_total += waited
+        self.metrics.wait_time_max = max(self.metrics.wait_time_max, waited)
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.metrics.retries += 1
+                await asyncio.sleep(self.retry_delay * 2 ** (attempt - 1))
+
+            try:
+                status, text = await self.process(job)
+            except Exception as e:
+                logging.error(f"[ERROR] Confirmation of the payment [ID: {job.payment_id}] crashed: {e}")
+                continue
+
+            if status < 500:
+                if status < 400:
+                    self.metrics.processed += 1
+                    return True
+                self.metrics.failed += 1
+                logging.error(f"[ERROR] Payment [ID: {job.payment_id}] couldn't be confirmed: {text}")
+                return False
+
+        self.metrics.failed += 1
+        logging.error(f"[ERROR] Payment [ID: {job.payment_id}] failed after {self.max_retries} retries.")
+        return False
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            payment_id = job.payment_id
+            try:
+                while True:
+                    succeeded = await self._handle(job)
+                    deferred = self._deferred.pop(payment_id, None)
+                    if succeeded or deferred is None:
+                        break
+                    self.metrics.resubmitted += 1
+                    logging.info(f"[INFO] Running the deferred confirmation of the payment [ID: {payment_id}].")
+                    job = deferred
+            finally:
+                self._deferred.pop(payment_id, None)
+                self._pending.discard(payment_id)
+                self._queue.task_done()
+
+    async def close(self, timeout: float = 30.0) -> None:
+        """
+        Stops accepting new jobs, waits until the queued jobs are processed and stops the workers.
+
+        :param timeout: maximum time in seconds to wait for the queue to be drained.
+        """
+
+        self._accepting = False
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logging.error(f"[ERROR] {self.depth} payment confirmations were not processed before shutdown.")
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
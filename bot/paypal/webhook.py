@@ -0,0 +1,252 @@
+import base64
+import binascii
+import datetime
+import logging
+import warnings
+import zlib
+from functools import lru_cache
+from typing import Dict, List, Mapping, Optional, Tuple
+from urllib.parse import urlparse
+
+import certifi
+from cryptography import x509
+from cryptography.exceptions import InvalidSignature, UnsupportedAlgorithm
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives.asymmetric.rsa import RSAPublicKey
+
+from bot.paypal.client import PaypalClient, PaypalError
+from database.commands.cache import TTLCache
+
+# Events whose transmission time differs from the clock by more are rejected, their ids are remembered this long
+MAX_TRANSMISSION_AGE = 300
+# Maximum number of certificates between the signing certificate and a trusted root
+MAX_CHAIN_LENGTH = 5
+
+
+def _is_paypal_host(host: str) -> bool:
+    return host == "paypal.com" or host.endswith(".paypal.com")
+
+
+@lru_cache(maxsize=1)
+def get_trusted_roots() -> Dict[x509.Name, List[x509.Certificate]]:
+    """
+    Function to load the trusted root certificates of certifi once, by subject.
+
+    :return: root certificates by their subject.
+    """
+
+    with open(certifi.where(), "rb") as file:
+        bundle = file.read()
+
+    by_subject: Dict[x509.Name, List[x509.Certificate]] = {}
+    end = b"-----END CERTIFICATE-----"
+    # Certificates are loaded one by one, so a root that newer versions of cryptography refuse is only skipped
+    for block in bundle.split(end)[:-1]:
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                root = x509.load_pem_x509_certificate(block + end)
+        except ValueError:
+            continue
+        by_subject.setdefault(root.subject, []).append(root)
+    return by_subject
+
+
+def _has_key_usage(certificate: x509.Certificate, usage: str, required: bool = True) -> bool:
+    try:
+        key_usage = certificate.extensions.get_extension_for_class(x509.KeyUsage).value
+    except x509.ExtensionNotFound:
+        return not required
+    return getattr(key_usage, usage)
+
+
+def check_issuer(certificate: x509.Certificate, intermediates_below: int, trusted: bool = False) -> None:
+    """
+    Function to check that a certificate may issue the certificates below it in the chain.
+
+    :param certificate: intermediate or root certificate.
+    :param intermediates_below: number of intermediate certificates between it and the signing certificate.
+    :param trusted: whether it's a trusted root, old roots may have no key usage extension.
+    :raises ValueError: if it isn't a certificate authority or the chain below it is too long.
+    """
+
+    name = certificate.subject.rfc4514_string()
+    try:
+        constraints = certificate.extensions.get_extension_for_class(x509.BasicConstraints).value
+    except x509.ExtensionNotFound:
+        constraints = None
+    if constraints is None or not constraints.ca:
+        raise ValueError(f"Certificate {name} is not a certificate authority.")
+    if constraints.path_length is not None and intermediates_below > constraints.path_length:
+        raise ValueError(f"Certificate {name} can't issue a chain of {intermediates_below} intermediates.")
+    if not _has_key_usage(certificate, "key_cert_sign", required=not trusted):
+        raise ValueError(f"Certificate {name} is not allowed to sign certificates.")
+
+
+def verify_chain(certificates: List[x509.Certificate], now: datetime.datetime) -> x509.Certificate:
+    """
+    Function to verify that the signing certificate is issued to PayPal and chains up to a trusted root.
+    Every certificate of the chain must be valid now and signed by the next one, the signing certificate
+    must be allowed to sign and the issuers must be certificate authorities that respect their path length.
+
+    :param certificates: signing certificate followed by the intermediate certificates.
+    :param now: current time.
+    :return: the signing certificate.
+    :raises ValueError: if the chain isn't trusted.
+    """
+
+    leaf = certificates[0]
+    try:
+        names = leaf.extensions.get_extension_for_class(x509.SubjectAlternativeName).value.get_values_for_type(
+            x509.DNSName
+        )
+    except x509.ExtensionNotFound:
+        names = [attribute.value for attribute in leaf.subject.get_attributes_for_oid(x509.NameOID.COMMON_NAME)]
+    if not any(_is_paypal_host(str(name)) for name in names):
+        raise ValueError(f"Certificate is not issued to PayPal: {names}.")
+    if not _has_key_usage(leaf, "digital_signature"):
+        raise ValueError("Certificate is not allowed to sign.")
+
+    intermediates = {certificate.subject: certificate for certificate in certificates[1:]}
+    roots = get_trusted_roots()
+
+    certificate = leaf
+    for depth in range(MAX_CHAIN_LENGTH):
+        if not certificate.not_valid_before_utc <= now <= certificate.not_valid_after_utc:
+            raise ValueError(f"Certificate {certificate.subject.rfc4514_string()} is not valid at the moment.")
+
+        for root in roots.get(certificate.issuer, []):
+            try:
+                certificate.verify_directly_issued_by(root)
+                check_issuer(root, depth, trusted=True)
+            except (ValueError, TypeError, InvalidSignature):
+                continue
+            if root.not_valid_before_utc <= now <= root.not_valid_after_utc:
+                return leaf
+
+        issuer = intermediates.get(certificate.issuer)
+        if issuer is None or issuer is certificate:
+            raise ValueError(f"Issuer {certificate.issuer.rfc4514_string()} is not trusted.")
+        try:
+            certificate.verify_directly_issued_by(issuer)
+        except (ValueError, TypeError, InvalidSignature) as error:
+            raise ValueError(f"Certificate chain is broken: {error}") from error
+        check_issuer(issuer, depth)
+        certificate = issuer
+
+    raise ValueError("Certificate chain is too long.")
+
+
+def parse_transmission_time(value: str) -> Optional[datetime.datetime]:
+    try:
+        moment = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=datetime.timezone.utc)
+    return moment
+
+
+class WebhookVerifier:
+    """
+    Verifies PayPal webhook signatures locally.
+
+    PayPal signs "<transmission id>|<transmission time>|<webhook id>|<crc32 of the body>" with SHA256withRSA,
+    the certificate is referenced by the PAYPAL-CERT-URL header. The certificate must be issued to a PayPal host
+    and chain up to a root trusted by certifi. Certificates are downloaded once and kept in memory until they expire,
+    so an event is verified without calling the verify-webhook-signature API.
+
+    Events sent more than MAX_TRANSMISSION_AGE seconds ago (or in the future) are rejected and the ids
+    of the accepted transmissions are remembered for that time, so a captured event can't be replayed.
+    The ids are remembered per process, the confirmation of a payment is idempotent anyway.
+
+    Attributes
+    ----------
+    client [PaypalClient] -> PayPal client, its connection pool is used to download certificates.
+    webhook_id [str] -> id of the webhook from the PayPal dashboard.
+    """
+
+    def __init__(self, client: PaypalClient, webhook_id: str, max_certificates: int = 16):
+        self.client = client
+        self.webhook_id = webhook_id
+        self.max_certificates = max_certificates
+
+        self._certificates: Dict[str, Tuple[RSAPublicKey, datetime.datetime]] = {}
+        self._transmissions = TTLCache(maxsize=100_000, ttl=MAX_TRANSMISSION_AGE * 2)
+
+    @staticmethod
+    def _is_paypal_url(url: str) -> bool:
+        parsed = urlparse(url)
+        return parsed.scheme == "https" and _is_paypal_host(parsed.hostname or "")
+
+    async def _get_public_key(self, cert_url: str) -> RSAPublicKey:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        cached = self._certificates.get(cert_url)
+        if cached is not None and cached[1] > now:
+            return cached[0]
+
+        certificate = verify_chain(x509.load_pem_x509_certificates(await self.client.download(cert_url)), now)
+        public_key = certificate.public_key()
+        if not isinstance(public_key, RSAPublicKey):
+            raise ValueError(f"Certificate has a {type(public_key).__name__} key, SHA256withRSA needs an RSA key.")
+
+        if len(self._certificates) >= self.max_certificates:
+            self._certificates.pop(next(iter(self._certificates)))
+        self._certificates[cert_url] = (public_key, certificate.not_valid_after_utc)
+        return public_key
+
+    async def verify(self, headers: Mapping[str, str], body: bytes) -> bool:
+        """
+        Verifies the signature of a webhook event.
+
+        :param headers: headers of the request.
+        :param body: raw body of the request.
+        :return: True if the event is signed by PayPal for this webhook, False otherwise.
+        """
+
+        transmission_id = headers.get("PAYPAL-TRANSMISSION-ID")
+        transmission_time = headers.get("PAYPAL-TRANSMISSION-TIME")
+        transmission_sig = headers.get("PAYPAL-TRANSMISSION-SIG")
+        cert_url = headers.get("PAYPAL-CERT-URL")
+        auth_algo = headers.get("PAYPAL-AUTH-ALGO", "SHA256withRSA")
+
+        if not all((transmission_id, transmission_time, transmission_sig, cert_url)):
+            return False
+        if auth_algo != "SHA256withRSA" or not self._is_paypal_url(cert_url):
+            logging.error(f"[ERROR] Unexpected webhook signature algorithm or certificate url: {auth_algo} {cert_url}")
+            return False
+
+        sent_at = parse_transmission_time(transmission_time)
+        now = datetime.datetime.now(datetime.timezone.utc)
+        if sent_at is None or abs((now - sent_at).total_seconds()) > MAX_TRANSMISSION_AGE:
+            logging.error(f"[ERROR] Webhook transmission [ID: {transmission_id}] is stale: {transmission_time}")
+            return False
+        if self._transmissions.get(transmission_id) is not None:
+            logging.error(f"[ERROR] Webhook transmission [ID: {transmission_id}] has already been accepted.")
+            return False
+
+        try:
+            public_key = await self._get_public_key(cert_url)
+            signature = base64.b64decode(transmission_sig)
+        except (PaypalError, ValueError, binascii.Error, UnsupportedAlgorithm) as error:
+            logging.error(f"[ERROR] Couldn't prepare webhook signature verification: {error}")
+            return False
+
+        message = f"{transmission_id}|{transmission_time}|{self.webhook_id}|{zlib.crc32(body)}".encode()
+        try:
+            public_key.verify(signature, message, padding.PKCS1v15(), hashes.SHA256())
+        except InvalidSignature:
+            return False
+
+        self._transmissions.set(transmission_id, True)
+        return True
+
+    def forget(self, transmission_id: str) -> None:
+        """
+        Forgets an accepted transmission, so PayPal can deliver it again (e.g. the event couldn't be queued).
+
+        :param transmission_id: value of the PAYPAL-TRANSMISSION-ID header.
+        """
+
+        self._transmissions.pop(transmission_id)
@@ -1,43 +1,185 @@
-from typing import Union
-from aiogram import Bot
+from dataclasses import dataclass
+from typing import AsyncIterable, Iterable, Union
+from aiogram import Bot, exceptions
 from aiogram.types import InlineKeyboardMarkup
-from bot.services.send_message import send_message
+from bot.services.metrics import telegram_messages
+from bot.services.rate_limiter import TelegramRateLimiter, telegram_rate_limiter
 
 import asyncio
 import logging
 
 
+@dataclass
+class BroadcastReport:
+    """
+    Progress and result of a broadcast.
+
+    Attributes
+    ----------
+    delivered [int] -> number of messages that have been delivered.
+    blocked [int] -> number of users that blocked the bot or deleted their account.
+    failed [int] -> number of messages that failed for any other reason.
+    """
+
+    delivered: int = 0
+    blocked: int = 0
+    failed: int = 0
+
+    @property
+    def total(self) -> int:
+        return self.delivered + self.blocked + self.failed
+
+
+class Broadcaster:
+    """
+    Concurrent broadcaster.
+
+    A fixed number of workers take user ids from a bounded queue, so the users can come from an async
+    iterator without loading all of them into memory. Every message goes through the rate limiter,
+    when Telegram answers with RetryAfter the limiter is paused for all the workers at once.
+
+    Attributes
+    ----------
+    bot [Bot] -> bot instance.
+    limiter [TelegramRateLimiter] -> rate limiter, the process-wide one by default.
+    concurrency [int] -> number of messages that are sent at the same time.
+    max_retries [int] -> how many times a message is retried after a flood limit error.
+    progress_every [int] -> how often (in messages) the progress is logged.
+    """
+
+    def __init__(
+            self,
+            bot: Bot,
+            limiter: TelegramRateLimiter = telegram_rate_limiter,
+            concurrency: int = 10,
+            max_retries: int = 3,
+            progress_every: int = 1000
+    ):
+        self.bot = bot
+        self.limiter = limiter
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.progress_every = progress_every
+
+    async def _deliver(
+            self,
+            user_id: Union[str, int],
+            text: str,
+            disable_notification: bool,
+            reply_markup: InlineKeyboardMarkup,
+            report: BroadcastReport
+    ) -> None:
+        for _ in range(self.max_retries + 1):
+            await self.limiter.acquire(user_id)
+            try:
+                await self.bot.send_message(
+                    user_id, text, disable_notification=disable_notification, reply_markup=reply_markup
+                )
+            except exceptions.TelegramRetryAfter as e:
+                telegram_messages.labels(type(e).__name__).inc()
+                logging.warning(f"[WARNING] Flood limit is exceeded, pausing the broadcast for {e.retry_after} seconds.")
+                self.limiter.pause(e.retry_after)
+                continue
+            except exceptions.TelegramForbiddenError as e:
+                telegram_messages.labels(type(e).__name__).inc()
+                report.blocked += 1
+            except exceptions.TelegramAPIError as e:
+                telegram_messages.labels(type(e).__name__).inc()
+                logging.error(f"[ERROR] Target [ID:{user_id}]: failed - {e}")
+                report.failed += 1
+            except Exception as e:
+                # Any other error (e.g. a network one) fails only this user, otherwise the worker would die
+                # and nothing would consume the queue, so the broadcast would hang
+                telegram_messages.labels(type(e).__name__).inc()
+                logging.exception(f"[ERROR] Target [ID:{user_id}]: failed - {e}")
+                report.failed += 1
+            else:
+                telegram_messages.labels("success").inc()
+                report.delivered += 1
+            break
+        else:
+            report.failed += 1
+
+        if report.total % self.progress_every == 0:
+            logging.info(
+                f"[PROGRESS] Broadcast: {report.delivered} delivered, {report.blocked} blocked, {report.failed} failed."
+            )
+
+    async def run(
+            self,
+            users: Union[Iterable[Union[str, int]], AsyncIterable[Union[str, int]]],
+            text: str,
+            disable_notification: bool = False,
+            reply_markup: InlineKeyboardMarkup = None,
+            report: BroadcastReport = None
+    ) -> BroadcastReport:
+        """
+        Sends the message to all the users.
+
+        :param users: iterable or async iterable of user ids.
+        :param text: text of the message.
+        :param disable_notification: disable notification or not.
+        :param reply_markup: reply markup.
+        :param report: report to update, a new one is created if it's not passed.
+        :return: report of the broadcast.
+        """
+
+        report = report or BroadcastReport()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+
+        async def worker() -> None:
+            while (user_id := await queue.get()) is not None:
+                await self._deliver(user_id, text, disable_notification, reply_markup, report)
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        try:
+            if isinstance(users, AsyncIterable):
+                async for user_id in users:
+                    await queue.put(user_id)
+            else:
+                for user_id in users:
+                    await queue.put(user_id)
+
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+
+        return report
+
+
 async def broadcast(
     bot: Bot,
-    users: list[Union[str, int]],
+    users: Union[Iterable[Union[str, int]], AsyncIterable[Union[str, int]]],
     text: str,
     disable_notification: bool = False,
     reply_markup: InlineKeyboardMarkup = None,
-) -> int:
+    concurrency: int = 10,
+) -> BroadcastReport:
 
     """
     Simple broadcaster.
 
-    :param bot: bot instance.
-    :param users: list of users.
+    :param bot: shared bot instance, its session is reused for all the messages.
+    :param users: iterable or async iterable of users.
     :param text: text of the message.
     :param disable_notification: disable notification or not.
     :param reply_markup: reply markup.
-    :return: count of messages.
+    :param concurrency: number of messages that are sent at the same time.
+    :return: report of the broadcast.
     """
 
-    count = 0
+    report = BroadcastReport()
     try:
-        for user_id in users:
-            async with bot.session:
-                if await send_message(
-                    bot, user_id, text, disable_notification, reply_markup
-                ):
-                    count += 1
-                await asyncio.sleep(
-                    0.05
-                )  # 20 messages per second (Limit: 30 messages per second)
+        await Broadcaster(bot, concurrency=concurrency).run(
+            users, text, disable_notification, reply_markup, report=report
+        )
     finally:
-        logging.info(f"[SUCCESS] {count} messages successful sent.")
+        logging.info(
+            f"[SUCCESS] {report.delivered} messages successful sent, "
+            f"{report.blocked} users blocked the bot, {report.failed} messages failed."
+        )
 
-    return count
+    return report
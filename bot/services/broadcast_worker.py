@@ -0,0 +1,201 @@
+import asyncio
+import logging
+from typing import Dict, Optional
+
+from aiogram import Bot
+from redis.asyncio import Redis
+from redis.exceptions import LockError
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from bot.services.broadcast import Broadcaster, BroadcastReport
+from database.commands.requests import RequestsDistributor
+from database.models.broadcasts import Broadcast, BROADCAST_RUNNING, BROADCAST_PAUSED, BROADCAST_FINISHED
+
+
+class BroadcastWorker:
+    """
+    Background worker that runs broadcasts stored in the database.
+
+    Recipients are read from the users table page by page (keyset pagination on user_id). After every page
+    the cursor and the counters are saved, so after a restart the broadcast continues from the last saved page.
+    A database session is only held while a page is read or a checkpoint is written, not while messages are sent.
+    With redis a broadcast is run under a redis lock, so only one process runs it even if several processes
+    start or unpause it. Without redis a broadcast is run only once per process.
+
+    Attributes
+    ----------
+    bot [Bot] -> shared bot instance.
+    session_pool [async_sessionmaker] -> session pool of the application.
+    batch_size [int] -> number of users in one page.
+    broadcaster [Broadcaster] -> broadcaster that sends the messages of every page.
+    redis [Redis] -> optional redis client for the locks of the broadcasts.
+    lock_timeout [float] -> time in seconds after which the lock of a crashed process expires,
+        a running broadcast extends its lock every third of it.
+    """
+
+    def __init__(
+            self,
+            bot: Bot,
+            session_pool: async_sessionmaker,
+            batch_size: int = 500,
+            concurrency: int = 10,
+            redis: Optional[Redis] = None,
+            lock_timeout: float = 60.0
+    ):
+        self.bot = bot
+        self.session_pool = session_pool
+        self.batch_size = batch_size
+        self.broadcaster = Broadcaster(bot, concurrency=concurrency)
+        self.redis = redis
+        self.lock_timeout = lock_timeout
+
+        self._tasks: Dict[int, asyncio.Task] = {}
+
+    def _spawn(self, broadcast_id: int) -> None:
+        if broadcast_id in self._tasks:
+            return
+
+        task = asyncio.create_task(self._run(broadcast_id))
+        self._tasks[broadcast_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(broadcast_id, None))
+
+    async def resume(self) -> None:
+        """
+        Resumes all the broadcasts that were running when the process stopped.
+        """
+
+        async with self.session_pool() as session:
+            broadcasts = await RequestsDistributor(session).broadcasts.get_running_broadcasts()
+
+        for broadcast in broadcasts:
+            logging.info(f"[INFO] Resuming broadcast [ID: {broadcast.id}] after user [ID: {broadcast.cursor}].")
+            self._spawn(broadcast.id)
+
+    async def start(self, text: str, created_by: int) -> Broadcast:
+        """
+        Creates a new broadcast and starts it in the background.
+
+        :param text: text of the message.
+        :param created_by: telegram ID of the admin who started the broadcast.
+        :return: Broadcast object.
+        """
+
+        async with self.session_pool() as session:
+            broadcast = await RequestsDistributor(session).broadcasts.create_broadcast(text=text, created_by=created_by)
+
+        self._spawn(broadcast.id)
+        return broadcast
+
+    async def pause(self, broadcast_id: int) -> Optional[Broadcast]:
+        """
+        Pauses the broadcast, the worker stops after the page that is being sent.
+
+        :param broadcast_id: id of the broadcast.
+        :return: updated Broadcast object or None if it doesn't exist.
+        """
+
+        async with self.session_pool() as session:
+            distributor = RequestsDistributor(session)
+            broadcast = await distributor.broadcasts.get_broadcast(broadcast_id)
+            if broadcast is None or broadcast.status == BROADCAST_FINISHED:
+                return broadcast
+            return await distributor.broadcasts.set_status(broadcast_id, BROADCAST_PAUSED)
+
+    async def unpause(self, broadcast_id: int) -> Optional[Broadcast]:
+        """
+        Continues a paused broadcast from its cursor.
+
+        :param broadcast_id: id of the broadcast.
+        :return: updated Broadcast object or None if it doesn't exist.
+        """
+
+        async with self.session_pool() as session:
+            distributor = RequestsDistributor(session)
+            broadcast = await distributor.broadcasts.get_broadcast(broadcast_id)
+            if broadcast is None or broadcast.status != BROADCAST_PAUSED:
+                return broadcast
+            broadcast = await distributor.broadcasts.set_status(broadcast_id, BROADCAST_RUNNING)
+
+        self._spawn(broadcast_id)
+        return broadcast
+
+    async def status(self, broadcast_id: int) -> Optional[Broadcast]:
+        """
+        Returns the broadcast with its saved progress.
+
+        :param broadcast_id: id of the broadcast.
+        :return: Broadcast object or None if it doesn't exist.
+        """
+
+        async with self.session_pool() as session:
+            return await RequestsDistributor(session).broadcasts.get_broadcast(broadcast_id)
+
+    async def _run(self, broadcast_id: int) -> None:
+        if self.redis is None:
+            return await self._run_pages(broadcast_id)
+
+        lock = self.redis.lock(f"bot:broadcast:{broadcast_id}", timeout=self.lock_timeout)
+        if not await lock.acquire(blocking=False):
+            logging.info(f"[INFO] Broadcast [ID: {broadcast_id}] is already run by another process.")
+            return
+
+        pages = asyncio.create_task(self._run_pages(broadcast_id))
+        try:
+            while True:
+                done, _ = await asyncio.wait({pages}, timeout=self.lock_timeout / 3)
+                if done:
+                    return pages.result()
+                # If the lock has expired and been taken by another process, this one stops
+                await lock.reacquire()
+        finally:
+            pages.cancel()
+            await asyncio.gather(pages, return_exceptions=True)
+            try:
+                await lock.release()
+            except LockError:
+                pass
+
+    async def _run_pages(self, broadcast_id: int) -> None:
+        while True:
+            async with self.session_pool() as session:
+                distributor = RequestsDistributor(session)
+                broadcast = await distributor.broadcasts.get_broadcast(broadcast_id)
+                if broadcast is None or broadcast.status != BROADCAST_RUNNING:
+                    return
+
+                user_ids = await distributor.users.get_user_ids(broadcast.cursor, self.batch_size)
+                if not user_ids:
+                    await distributor.broadcasts.set_status(broadcast_id, BROADCAST_FINISHED)
+                    logging.info(
+                        f"[SUCCESS] Broadcast [ID: {broadcast_id}] finished: {broadcast.delivered} delivered, "
+                        f"{broadcast.blocked} blocked, {broadcast.failed} failed."
+                    )
+                    return
+
+            report = BroadcastReport(
+                delivered=broadcast.delivered, blocked=broadcast.blocked, failed=broadcast.failed
+            )
+            try:
+                await self.broadcaster.run(user_ids, broadcast.text, report=report)
+            except Exception as e:
+                logging.error(f"[ERROR] Broadcast [ID: {broadcast_id}] stopped: {e}")
+                return
+
+            async with self.session_pool() as session:
+                await RequestsDistributor(session).broadcasts.save_progress(
+                    broadcast_id,
+                    cursor=user_ids[-1],
+                    delivered=report.delivered,
+                    blocked=report.blocked,
+                    failed=report.failed
+                )
+
+    async def close(self) -> None:
+        """
+        Stops all the running broadcasts, they are resumed from the last checkpoint on the next start.
+        """
+
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
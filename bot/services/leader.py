@@ -0,0 +1,168 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncConnection
+
+
+class LeaderElection:
+    """
+    Elects a single leader among all the processes of a deployment with a Postgres advisory lock.
+
+    The leader keeps the lock (and the connection holding it) while it's alive and runs the leader-only tasks
+    as soon as it's elected. If they fail, the lock is released, so another process can take over.
+    The connection is checked in the background, if it's lost, the lock is lost with it: the process stops
+    the leader-only tasks and becomes a follower again. Followers keep trying to take the lock in the background.
+
+    Followers don't start serving until the schema is ready (e.g. the leader has migrated it),
+    while they wait, they try to take the lock in case the leader has stopped.
+
+    Attributes
+    ----------
+    engine [AsyncEngine] -> engine of the application database.
+    key [int] -> key of the advisory lock, it should be the same for all the processes of the bot.
+    on_elected [Callable] -> coroutine function that's called every time the process becomes the leader.
+    on_demoted [Callable] -> optional coroutine function that's called when the process loses the lock.
+    is_ready [Callable] -> optional coroutine function that tells whether a follower can start serving.
+    retry_interval [float] -> how often (in seconds) a follower tries to take the lock and the leader checks it.
+    ready_interval [float] -> how often (in seconds) a follower checks whether it can start serving.
+    """
+
+    def __init__(
+            self,
+            engine: AsyncEngine,
+            key: int,
+            on_elected: Callable[[], Awaitable[None]],
+            on_demoted: Optional[Callable[[], Awaitable[None]]] = None,
+            is_ready: Optional[Callable[[], Awaitable[bool]]] = None,
+            retry_interval: float = 10.0,
+            ready_interval: float = 1.0
+    ):
+        self.engine = engine
+        self.key = key
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        self.is_ready = is_ready
+        self.retry_interval = retry_interval
+        self.ready_interval = ready_interval
+
+        self._connection: Optional[AsyncConnection] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._connection is not None
+
+    async def _try_acquire(self) -> bool:
+        connection = await self.engine.connect()
+        try:
+            acquired = await connection.scalar(text("SELECT pg_try_advisory_lock(:key)"), {"key": self.key})
+            await connection.commit()
+        except Exception:
+            await connection.close()
+            raise
+
+        if not acquired:
+            await connection.close()
+            return False
+
+        self._connection = connection
+        return True
+
+    async def _release(self) -> None:
+        connection, self._connection = self._connection, None
+        if connection is None:
+            return
+
+        try:
+            await connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": self.key})
+            await connection.commit()
+        except Exception as e:
+            # The lock is released by the server together with a broken connection
+            logging.warning(f"[WARNING] Failed to release the leader lock: {e}")
+        finally:
+            try:
+                await connection.close()
+            except Exception as e:
+                logging.warning(f"[WARNING] Failed to close the leader connection: {e}")
+
+    async def _elect(self) -> bool:
+        if not await self._try_acquire():
+            return False
+
+        logging.info("[INFO] This process has been elected as the leader, running leader tasks.")
+        try:
+            await self.on_elected()
+        except Exception:
+            await self._release()
+            raise
+        return True
+
+    async def _is_alive(self) -> bool:
+        try:
+            await self._connection.execute(text("SELECT 1"))
+            await self._connection.commit()
+        except Exception as e:
+            logging.error(f"[ERROR] Leader connection has been lost: {e}")
+            return False
+        return True
+
+    async def _demote(self) -> None:
+        await self._release()
+        logging.info("[INFO] This process is no longer the leader.")
+        if self.on_demoted is not None:
+            await self.on_demoted()
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(self.retry_interval)
+            try:
+                if self.is_leader:
+                    if not await self._is_alive():
+                        await self._demote()
+                else:
+                    await self._elect()
+            except Exception as e:
+                logging.error(f"[ERROR] Leader election failed: {e}")
+
+    async def _wait_ready(self) -> None:
+        while True:
+            try:
+                if self.is_ready is None or await self.is_ready():
+                    return
+                # The leader may have stopped before it has finished its tasks
+                if await self._elect():
+                    return
+            except Exception as e:
+                logging.error(f"[ERROR] Leader election failed: {e}")
+            await asyncio.sleep(self.ready_interval)
+
+    async def start(self) -> None:
+        """
+        Tries to become the leader, if another process is the leader, waits until it's ready to serve
+        and keeps trying to take the lock in the background.
+        """
+
+        try:
+            elected = await self._elect()
+        except Exception as e:
+            logging.error(f"[ERROR] Leader tasks have failed: {e}")
+            elected = False
+
+        if not elected:
+            logging.info("[INFO] Another process is the leader, waiting until the schema is ready.")
+            await self._wait_ready()
+
+        self._task = asyncio.create_task(self._watch())
+
+    async def close(self) -> None:
+        """
+        Stops the election and releases the lock if this process is the leader.
+        """
+
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+        await self._release()
@@ -0,0 +1,135 @@
+import copy
+import json
+import logging
+import queue
+import random
+import sys
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Optional
+
+from betterlogging import ColorizedFormatter
+
+# Context of the update that's being processed by the current task: update_id, chat_id, handler and sampled
+update_context: ContextVar[Optional[Dict[str, Any]]] = ContextVar("update_context", default=None)
+
+CONTEXT_FIELDS = ("update_id", "chat_id", "handler")
+TEXT_FORMAT = "%(filename)s:%(lineno)d #%(levelname)-8s [%(asctime)s] - %(name)s - %(message)s"
+
+
+def should_sample(sample_rate: float) -> bool:
+    """
+    Function to decide whether the records of a successful update are logged.
+
+    :param sample_rate: share of successful updates that are logged, from 0 to 1.
+    :return: True if the update is sampled.
+    """
+
+    return sample_rate >= 1 or random.random() < sample_rate
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a record as a compact single-line JSON object with the context of the update.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key in CONTEXT_FIELDS:
+            value = getattr(record, key, None)
+            if value is not None:
+                entry[key] = value
+
+        duration = getattr(record, "duration_ms", None)
+        if duration is not None:
+            entry["duration_ms"] = duration
+
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str, separators=(",", ":"))
+
+
+class UpdateQueueHandler(QueueHandler):
+    """
+    Puts records in a bounded queue that's written by a background thread, so logging never blocks the event loop.
+
+    The context of the current update is attached to every record. Records below WARNING that belong to
+    an update which wasn't sampled are dropped, errors are always kept. If the queue is full, the record
+    is dropped and counted instead of waiting for the writer.
+
+    Attributes
+    ----------
+    dropped [int] -> number of records that were dropped because the queue was full.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The message is rendered here because the arguments may change after the record is queued,
+        # the rest of the formatting happens in the writer thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+
+        context = update_context.get()
+        if context is not None:
+            for key in CONTEXT_FIELDS:
+                setattr(record, key, context.get(key))
+        return record
+
+    def emit(self, record: logging.LogRecord) -> None:
+        context = update_context.get()
+        if record.levelno < logging.WARNING and context is not None and not context.get("sampled", True):
+            return
+        super().emit(record)
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def start_log_listener(
+        level: str = "INFO",
+        json_format: bool = True,
+        queue_size: int = 10_000
+) -> QueueListener:
+    """
+    Function to route all the logs through a bounded queue to a background thread that formats and writes them.
+
+    :param level: minimum level of the records.
+    :param json_format: whether records are written as JSON lines or as colorized text.
+    :param queue_size: maximum number of records waiting to be written.
+    :return: started QueueListener, it should be stopped on shutdown to flush the remaining records.
+    """
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(JsonFormatter() if json_format else ColorizedFormatter(TEXT_FORMAT))
+
+    log_queue = queue.Queue(maxsize=queue_size)
+    listener = QueueListener(log_queue, stream_handler)
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(UpdateQueueHandler(log_queue))
+    root.setLevel(level)
+
+    # Every update is already logged (with sampling) by LoggingMiddleware
+    logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+
+    listener.start()
+    return listener
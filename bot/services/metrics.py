@@ -0,0 +1,215 @@
+import bisect
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from aiohttp import web
+
+# Buckets in seconds for everything that is expected to take from a millisecond to several seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+INF_LABEL = 'le="+Inf"'
+
+
+def _escape(value: str) -> str:
+    # Label values are escaped as required by the Prometheus text format
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+
+class HistogramChild:
+    __slots__ = ("buckets", "counts", "sum")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        # Only the bucket the value falls into is increased, cumulative counts are calculated on scrape
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Metric(ABC):
+    """
+    Base class of a metric family with labels.
+    Children (one per combination of label values) are created once and reused, so recording a value
+    is a dict lookup and an addition.
+
+    Attributes
+    ----------
+    name [str] -> name of the metric.
+    description [str] -> help text of the metric.
+    labelnames [Tuple[str]] -> names of the labels.
+    """
+
+    type = "untyped"
+
+    def __init__(self, name: str, description: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    @abstractmethod
+    def _create_child(self):
+        ...
+
+    def labels(self, *values: str):
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._create_child()
+        return child
+
+    @abstractmethod
+    def collect(self) -> List[str]:
+        ...
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def _create_child(self) -> CounterChild:
+        return CounterChild()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def collect(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, values)} {child.value}"
+            for values, child in list(self._children.items())
+        ]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+            self,
+            name: str,
+            description: str,
+            labelnames: Sequence[str] = (),
+            buckets: Sequence[float] = LATENCY_BUCKETS
+    ):
+        super().__init__(name, description, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _create_child(self) -> HistogramChild:
+        return HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def collect(self) -> List[str]:
+        lines = []
+        for values, child in list(self._children.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, child.counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, values, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+
+            total = cumulative + child.counts[-1]
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, INF_LABEL)} {total}")
+
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {child.sum}")
+            lines.append(f"{self.name}_count{labels} {total}")
+        return lines
+
+
+class Snapshot(Metric):
+    """
+    Gauges that are read from a function on scrape, e.g. the counters of a queue or a connection pool.
+    Every key of the returned dict is exported as a separate gauge named `{name}_{key}`.
+    """
+
+    type = "gauge"
+
+    def __init__(self, name: str, description: str, read: Callable[[], Dict[str, float]]):
+        super().__init__(name, description)
+        self.read = read
+
+    def _create_child(self):
+        raise TypeError(f"{self.name} has no labels, its values are read on scrape")
+
+    def collect(self) -> List[str]:
+        return [f"{self.name}_{key} {float(value)}" for key, value in self.read().items()]
+
+
+class MetricsRegistry:
+    """
+    Holds the metrics of the process and renders them in the Prometheus text format.
+    Every worker process has its own registry, so in pre-fork mode every worker should be scraped separately.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            if isinstance(metric, Snapshot):
+                for line in metric.collect():
+                    name = line.split(" ", 1)[0]
+                    lines.append(f"# HELP {name} {metric.description}")
+                    lines.append(f"# TYPE {name} gauge")
+                    lines.append(line)
+                continue
+
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+    async def handle(self, request: web.Request) -> web.Response:
+        """
+        Handler of the /metrics route.
+        """
+
+        return web.Response(
+            body=self.render().encode(),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+        )
+
+
+registry = MetricsRegistry()
+
+update_duration = registry.register(Histogram(
+    "bot_update_duration_seconds", "Time spent processing an update by handler.", ["handler"]
+))
+update_errors = registry.register(Counter(
+    "bot_update_errors_total", "Updates whose processing raised an exception.", ["handler", "exception"]
+))
+paypal_duration = registry.register(Histogram(
+    "bot_paypal_request_duration_seconds", "Latency of the requests to PayPal by operation.", ["operation"]
+))
+paypal_errors = registry.register(Counter(
+    "bot_paypal_errors_total", "Failed requests to PayPal by operation and error.", ["operation", "error"]
+))
+telegram_messages = registry.register(Counter(
+    "bot_telegram_messages_total", "Messages sent to users by outcome.", ["outcome"]
+))
+db_checkout_duration = registry.register(Histogram(
+    "bot_db_pool_checkout_seconds", "Time spent waiting for a connection from the database pool."
+))
@@ -0,0 +1,66 @@
+import asyncio
+import logging
+from typing import Optional
+
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from bot.data.config import DatabaseConfig
+from database.migrations.partitions import detach_receipt_partitions, ensure_receipt_partitions, partition_receipts
+
+
+class ReceiptPartitionMaintainer:
+    """
+    Keeps the monthly partitions of the receipts table: converts the table once, creates the partitions
+    of the upcoming months in advance and detaches the partitions that are older than the retention.
+    It's run by the leader only.
+
+    Attributes
+    ----------
+    engine [AsyncEngine] -> engine of the application database.
+    months_ahead [int] -> number of upcoming monthly partitions that are created in advance.
+    retention_months [int] -> if it's greater than 0, partitions older than N months are detached.
+    interval [float] -> how often (in seconds) the partitions are checked.
+    """
+
+    def __init__(self, engine: AsyncEngine, months_ahead: int = 3, retention_months: int = 0, interval: float = 86400):
+        self.engine = engine
+        self.months_ahead = months_ahead
+        self.retention_months = retention_months
+        self.interval = interval
+
+        self._task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_config(cls, engine: AsyncEngine, config: DatabaseConfig) -> "ReceiptPartitionMaintainer":
+        return cls(engine, months_ahead=config.receipts_partitions_ahead,
+                   retention_months=config.receipts_retention_months)
+
+    async def maintain(self) -> None:
+        await ensure_receipt_partitions(self.engine, self.months_ahead)
+        if self.retention_months > 0:
+            await detach_receipt_partitions(self.engine, self.retention_months)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.maintain()
+            except Exception as e:
+                logging.error(f"[ERROR] Failed to maintain receipts partitions: {e}")
+
+    async def start(self) -> None:
+        """
+        Partitions the table if it's not partitioned yet, creates the missing partitions
+        and keeps checking them in the background.
+        """
+
+        await partition_receipts(self.engine)
+        await self.maintain()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
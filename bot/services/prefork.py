@@ -0,0 +1,43 @@
+import logging
+import multiprocessing
+import os
+import signal
+from typing import Callable
+
+
+def run_workers(target: Callable[[], None], workers: int) -> None:
+    """
+    Runs the target in several forked worker processes and waits for them.
+    Every worker binds the same port with SO_REUSEPORT, so the kernel spreads the connections between them.
+    SIGTERM and SIGINT received by the master are forwarded to the workers, which shut down gracefully,
+    SIGHUP is forwarded too, so every worker reloads its configuration.
+
+    :param target: function that runs a single worker (builds and runs the web application).
+    :param workers: number of worker processes.
+    """
+
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=target, name=f"worker-{number}") for number in range(workers)]
+
+    for process in processes:
+        process.start()
+        logging.info(f"[INFO] Started {process.name} [PID: {process.pid}].")
+
+    def stop(signum, frame) -> None:
+        for worker in processes:
+            if worker.is_alive():
+                worker.terminate()
+
+    def reload(signum, frame) -> None:
+        for worker in processes:
+            if worker.is_alive():
+                os.kill(worker.pid, signal.SIGHUP)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGHUP, reload)
+
+    for process in processes:
+        process.join()
+        if process.exitcode:
+            logging.error(f"[ERROR] {process.name} [PID: {process.pid}] exited with code {process.exitcode}.")
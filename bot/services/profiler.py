@@ -0,0 +1,158 @@
+import asyncio
+import cProfile
+import logging
+import os
+import re
+import time
+import types
+from pathlib import Path
+from typing import Any, Coroutine, List, Optional
+
+from aiohttp import web
+
+from bot.data.config import ProfilerConfig
+
+
+@types.coroutine
+def profile_coroutine(coroutine: Coroutine, profiler: cProfile.Profile) -> Any:
+    """
+    Runs a coroutine with the profiler enabled only while the coroutine itself is running.
+    Other tasks that run while the coroutine waits for I/O don't get in the profile.
+
+    :param coroutine: coroutine to run.
+    :param profiler: cProfile.Profile object that collects the statistics.
+    :return: result of the coroutine.
+    """
+
+    value, error = None, None
+    while True:
+        profiler.enable()
+        try:
+            future = coroutine.send(value) if error is None else coroutine.throw(error)
+        except StopIteration as stop:
+            return stop.value
+        finally:
+            profiler.disable()
+
+        try:
+            value, error = (yield future), None
+        except BaseException as e:
+            value, error = None, e
+
+
+class SlowUpdateProfiler:
+    """
+    Keeps the profiles of the updates that took longer than the threshold in a bounded on-disk ring buffer.
+
+    Every profile is a cProfile dump (it can be opened with pstats or snakeviz) named after the time,
+    the process, the update id, the handler and the duration. When there are more than `max_profiles` files,
+    the oldest ones are removed. The directory can be shared by several worker processes.
+
+    Attributes
+    ----------
+    threshold [float] -> minimum processing time in seconds of an update whose profile is kept.
+    sample_rate [float] -> share of updates that are profiled, from 0 to 1.
+    directory [Path] -> directory with the profiles.
+    max_profiles [int] -> number of profiles that are kept.
+    token [str] -> token that's required to download the profiles over HTTP.
+    """
+
+    def __init__(
+            self,
+            threshold: float = 1.0,
+            sample_rate: float = 1.0,
+            directory: str = "profiles",
+            max_profiles: int = 20,
+            token: str = ""
+    ):
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self.directory = Path(directory)
+        self.max_profiles = max_profiles
+        self.token = token
+
+    @classmethod
+    def from_config(cls, config: ProfilerConfig) -> "SlowUpdateProfiler":
+        return cls(
+            threshold=config.threshold,
+            sample_rate=config.sample_rate,
+            directory=config.directory,
+            max_profiles=config.max_profiles,
+            token=config.token
+        )
+
+    def list_profiles(self) -> List[Path]:
+        """
+        Returns the stored profiles, the newest first.
+
+        :return: list of paths of the profiles.
+        """
+
+        if not self.directory.is_dir():
+            return []
+        return sorted(self.directory.glob("*.prof"), reverse=True)
+
+    def get(self, name: str) -> Optional[Path]:
+        """
+        Finds a stored profile by its file name.
+
+        :param name: name of the file.
+        :return: path of the profile or None if there is no such profile.
+        """
+
+        for path in self.list_profiles():
+            if path.name == name:
+                return path
+        return None
+
+    def _write(self, profiler: cProfile.Profile, update_id: int, handler: Optional[str], duration: float) -> Path:
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        handler_name = re.sub(r"[^\w.]", "_", handler or "unhandled")
+        name = f"{time.time_ns()}-{os.getpid()}-{update_id}-{handler_name}-{int(duration * 1000)}ms.prof"
+        path = self.directory / name
+        profiler.dump_stats(path)
+
+        for outdated in self.list_profiles()[self.max_profiles:]:
+            outdated.unlink(missing_ok=True)
+        return path
+
+    async def save(self, profiler: cProfile.Profile, update_id: int, handler: Optional[str], duration: float) -> None:
+        """
+        Writes the profile of a slow update in a thread, so the event loop isn't blocked by the disk.
+
+        :param profiler: profiler with the statistics of the update.
+        :param update_id: id of the update.
+        :param handler: name of the handler that processed the update.
+        :param duration: processing time of the update in seconds.
+        """
+
+        try:
+            path = await asyncio.to_thread(self._write, profiler, update_id, handler, duration)
+        except OSError as e:
+            logging.error(f"[ERROR] Couldn't save the profile of the update [ID: {update_id}]: {e}")
+            return
+        logging.warning(f"[WARNING] Update [ID: {update_id}] took {duration:.2f} seconds, profile: {path.name}")
+
+    def _check_token(self, request: web.Request) -> None:
+        if not self.token or request.query.get("token") != self.token:
+            raise web.HTTPForbidden(text="Invalid token.")
+
+    async def handle_list(self, request: web.Request) -> web.Response:
+        """
+        Handler of the /profiles route, returns the names of the stored profiles, the newest first.
+        """
+
+        self._check_token(request)
+        return web.json_response([path.name for path in self.list_profiles()])
+
+    async def handle_download(self, request: web.Request) -> web.FileResponse:
+        """
+        Handler of the /profiles/{name} route, returns the profile as a file.
+        """
+
+        self._check_token(request)
+        path = self.get(request.match_info["name"])
+        if path is None:
+            raise web.HTTPNotFound(text="Profile doesn't exist.")
+        return web.FileResponse(path, headers={"Content-Disposition": f'attachment; filename="{path.name}"'})
@@ -0,0 +1,148 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Union
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter.
+
+    Every caller reserves a token and sleeps until the token is available, so the waiters are served
+    in the order they came in without holding a lock. The whole bucket can be paused, e.g. when Telegram
+    answers with RetryAfter, which makes every current and future waiter wait until the pause is over.
+
+    Attributes
+    ----------
+    rate [float] -> number of tokens added per second.
+    capacity [float] -> maximum number of tokens that can be spent at once (burst size).
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+
+    def _reserve(self) -> float:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+        self._tokens -= 1
+
+        if self._tokens >= 0:
+            return 0.0
+        return -self._tokens / self.rate
+
+    async def acquire(self) -> None:
+        """
+        Waits until a token is available.
+        """
+
+        delay = self._reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+        while (now := time.monotonic()) < self._paused_until:
+            await asyncio.sleep(self._paused_until - now)
+
+    def pause(self, seconds: float) -> None:
+        """
+        Pauses the bucket for a given number of seconds and drops the accumulated tokens.
+
+        :param seconds: duration of the pause.
+        """
+
+        now = time.monotonic()
+        self._paused_until = max(self._paused_until, now + seconds)
+        self._tokens = 0.0
+        self._updated_at = now
+
+    @property
+    def paused(self) -> bool:
+        return time.monotonic() < self._paused_until
+
+
+class ChatRateLimiter:
+    """
+    Per-chat rate limiter that keeps a minimum interval between two messages to the same chat.
+    Only the most recently used chats are tracked, so the memory usage is bounded.
+
+    Attributes
+    ----------
+    interval [float] -> minimum interval in seconds between two messages to the same chat.
+    max_chats [int] -> maximum number of chats that are tracked at once.
+    """
+
+    def __init__(self, interval: float = 1.0, max_chats: int = 10_000):
+        self.interval = interval
+        self.max_chats = max_chats
+
+        self._next_allowed: OrderedDict[Union[int, str], float] = OrderedDict()
+
+    async def acquire(self, chat_id: Union[int, str]) -> None:
+        """
+        Waits until a message can be sent to the chat.
+
+        :param chat_id: id of the chat.
+        """
+
+        now = time.monotonic()
+        allowed_at = max(now, self._next_allowed.pop(chat_id, now))
+        self._next_allowed[chat_id] = allowed_at + self.interval
+
+        if len(self._next_allowed) > self.max_chats:
+            self._next_allowed.popitem(last=False)
+
+        if allowed_at > now:
+            await asyncio.sleep(allowed_at - now)
+
+
+class TelegramRateLimiter:
+    """
+    Combines the global limit of the Bot API (about 30 messages per second) with the per-chat limit
+    (about 1 message per second).
+
+    Attributes
+    ----------
+    bucket [TokenBucket] -> global bucket shared by all the messages sent by the process.
+    chats [ChatRateLimiter] -> per-chat limiter.
+    """
+
+    def __init__(self, global_rate: float = 30, chat_interval: float = 1.0):
+        self.bucket = TokenBucket(rate=global_rate)
+        self.chats = ChatRateLimiter(interval=chat_interval)
+
+    async def acquire(self, chat_id: Union[int, str]) -> None:
+        """
+        Waits until a message can be sent to the chat without exceeding any of the limits.
+
+        :param chat_id: id of the chat.
+        """
+
+        await self.chats.acquire(chat_id)
+        await self.bucket.acquire()
+
+    def pause(self, seconds: float) -> None:
+        """
+        Pauses all the messages, it's used when Telegram asks to retry after some time.
+
+        :param seconds: duration of the pause.
+        """
+
+        self.bucket.pause(seconds)
+
+    def set_rate(self, global_rate: float) -> None:
+        """
+        Replaces the global bucket with a new one, it's used to apply the configured limit at startup.
+
+        :param global_rate: number of messages per second.
+        """
+
+        self.bucket = TokenBucket(rate=global_rate)
+
+
+# Limiter shared by every sender in the process, so broadcasts and regular messages stay under the same ceiling
+telegram_rate_limiter = TelegramRateLimiter()
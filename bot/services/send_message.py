@@ -2,8 +2,10 @@ from aiogram import Bot, exceptions
 from typing import Union
 from aiogram.types import InlineKeyboardMarkup
 
+from bot.services.metrics import telegram_messages
+from bot.services.rate_limiter import telegram_rate_limiter
+
 import logging
-import asyncio
 
 
 async def send_message(
@@ -12,42 +14,52 @@ async def send_message(
     text: str,
     disable_notification: bool = False,
     reply_markup: InlineKeyboardMarkup | tuple[InlineKeyboardMarkup] = None,
+    max_retries: int = 3,
 ) -> bool:
 
     """
     Safe messages' sender.
+    Messages go through the process-wide rate limiter, if Telegram still asks to wait,
+    the whole limiter is paused and the message is sent again.
 
     :param bot: bot instance.
     :param user_id: user id. If str - must contain only digits.
     :param text: text of the message.
     :param disable_notification: disable notification or not.
     :param reply_markup: reply markup.
+    :param max_retries: how many times to retry the message after a flood limit error.
     :return: success.
     """
 
-    try:
-        await bot.send_message(
-            user_id,
-            text,
-            disable_notification=disable_notification,
-            reply_markup=reply_markup[0] if isinstance(reply_markup, tuple) else reply_markup,
-        )
-
-    except exceptions.TelegramBadRequest as e:
-        logging.error(f"[ERROR] Telegram server says - Bad Request: {e}")
-    except exceptions.TelegramForbiddenError:
-        logging.error(f"[ERROR] Target [ID:{user_id}]: got TelegramForbiddenError")
-    except exceptions.TelegramRetryAfter as e:
-        logging.error(
-            f"[ERROR] Target [ID:{user_id}]: Flood limit is exceeded. Sleep {e.retry_after} seconds."
-        )
-        await asyncio.sleep(e.retry_after)
-        return await send_message(
-            bot, user_id, text, disable_notification, reply_markup
-        )  # Recursive call
-    except exceptions.TelegramAPIError:
-        logging.error(f"[ERROR] Target [ID:{user_id}]: failed")
-    else:
-        logging.info(f"[SUCCESS] Target [ID:{user_id}]: success")
-        return True
+    for _ in range(max_retries + 1):
+        await telegram_rate_limiter.acquire(user_id)
+        try:
+            await bot.send_message(
+                user_id,
+                text,
+                disable_notification=disable_notification,
+                reply_markup=reply_markup[0] if isinstance(reply_markup, tuple) else reply_markup,
+            )
+
+        except exceptions.TelegramBadRequest as e:
+            telegram_messages.labels(type(e).__name__).inc()
+            logging.error(f"[ERROR] Telegram server says - Bad Request: {e}")
+        except exceptions.TelegramForbiddenError as e:
+            telegram_messages.labels(type(e).__name__).inc()
+            logging.error(f"[ERROR] Target [ID:{user_id}]: got TelegramForbiddenError")
+        except exceptions.TelegramRetryAfter as e:
+            telegram_messages.labels(type(e).__name__).inc()
+            logging.error(
+                f"[ERROR] Target [ID:{user_id}]: Flood limit is exceeded. Sleep {e.retry_after} seconds."
+            )
+            telegram_rate_limiter.pause(e.retry_after)
+            continue
+        except exceptions.TelegramAPIError as e:
+            telegram_messages.labels(type(e).__name__).inc()
+            logging.error(f"[ERROR] Target [ID:{user_id}]: failed")
+        else:
+            telegram_messages.labels("success").inc()
+            logging.info(f"[SUCCESS] Target [ID:{user_id}]: success")
+            return True
+        return False
     return False
@@ -0,0 +1,37 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: while a call is in progress, other callers with the same key
+    wait for its result instead of starting their own call.
+
+    The call is shielded, so a caller that gets cancelled (e.g. the client closed the connection)
+    doesn't cancel the call for the other callers.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        """
+        Runs the function or joins a call that is already running for the key.
+
+        :param key: key of the call.
+        :param func: function that returns an awaitable with the result.
+        :return: result of the call.
+        """
+
+        future = self._calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(func())
+            self._calls[key] = future
+            future.add_done_callback(lambda _: self._calls.pop(key, None))
+
+        return await asyncio.shield(future)
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self._calls
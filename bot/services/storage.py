@@ -0,0 +1,43 @@
+from typing import Optional
+
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.fsm.storage.redis import RedisStorage, DefaultKeyBuilder
+from redis.asyncio import ConnectionPool, Redis
+
+from bot.data.config import Config, RedisConfig
+
+
+def create_redis(config: RedisConfig) -> Redis:
+    """
+    Function to create a Redis client backed by a bounded connection pool.
+    The same client is shared by the FSM storage and the rest of the application (e.g. caches).
+
+    :param config: RedisConfig configuration object.
+    :return: Redis client.
+    """
+
+    pool = ConnectionPool.from_url(config.dsn(), max_connections=config.redis_max_connections)
+    return Redis(connection_pool=pool)
+
+
+def create_storage(config: Config, redis: Optional[Redis] = None) -> BaseStorage:
+    """
+    Function to create FSM storage according to the TelegramBotConfig.use_redis flag.
+    Any redis.asyncio compatible client can be passed, e.g. a client of a local redis-server
+    or an in-process stand-in for tests.
+
+    :param config: Config configuration object.
+    :param redis: Redis client, it's required if redis is used.
+    :return: RedisStorage if redis is used, MemoryStorage otherwise.
+    """
+
+    if not config.telegram_bot.use_redis:
+        return MemoryStorage()
+
+    return RedisStorage(
+        redis=redis,
+        key_builder=DefaultKeyBuilder(prefix=f"{config.redis.redis_prefix}:fsm", with_destiny=True),
+        state_ttl=config.redis.state_ttl,
+        data_ttl=config.redis.data_ttl
+    )
@@ -0,0 +1,212 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, Optional, Tuple
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+from aiohttp import web
+
+
+def get_chat_key(update: Dict[str, Any]) -> Optional[Hashable]:
+    """
+    Function to find the chat (or the user if there is no chat) of a raw update.
+
+    :param update: raw update from Telegram.
+    :return: chat id, user id or None if the update doesn't belong to any chat.
+    """
+
+    for key, event in update.items():
+        if key == "update_id" or not isinstance(event, dict):
+            continue
+
+        chat = event.get("chat") or (event.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+
+        user = event.get("from") or event.get("user")
+        if user:
+            return user["id"]
+    return None
+
+
+@dataclass
+class UpdatePoolMetrics:
+    """
+    Counters of the update worker pool.
+
+    Attributes
+    ----------
+    accepted [int] -> number of updates that have been accepted.
+    rejected [int] -> number of updates that were rejected because the pool was saturated.
+    processed [int] -> number of updates that have been processed.
+    failed [int] -> number of updates whose processing raised an exception.
+    wait_time_total [float] -> total time in seconds the updates spent waiting.
+    wait_time_max [float] -> maximum time in seconds an update spent waiting.
+    """
+
+    accepted: int = 0
+    rejected: int = 0
+    processed: int = 0
+    failed: int = 0
+    wait_time_total: float = 0.0
+    wait_time_max: float = 0.0
+
+
+class UpdateWorkerPool:
+    """
+    Processes updates in the background with a global concurrency limit and per-chat ordering.
+
+    Updates of the same chat are processed one after another in the order they came in,
+    updates of different chats are processed concurrently, but no more than `concurrency` at once.
+    The number of waiting updates is bounded, when it's reached new updates are rejected.
+
+    Attributes
+    ----------
+    process [Callable] -> coroutine function that processes a raw update.
+    concurrency [int] -> maximum number of updates processed at the same time.
+    max_pending [int] -> maximum number of updates waiting or being processed.
+    metrics [UpdatePoolMetrics] -> counters of the pool.
+    """
+
+    def __init__(
+            self,
+            process: Callable[[Dict[str, Any]], Awaitable[Any]],
+            concurrency: int = 50,
+            max_pending: int = 1000
+    ):
+        self.process = process
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+        self.metrics = UpdatePoolMetrics()
+
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._chats: Dict[Hashable, Deque[Tuple[Dict[str, Any], float]]] = {}
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+        self._pending = 0
+        self._active = 0
+        self._drained = asyncio.Event()
+        self._drained.set()
+
+    @property
+    def depth(self) -> int:
+        return self._pending
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    def snapshot(self) -> Dict[str, float]:
+        """
+        Returns the current state of the pool.
+
+        :return: dict with the queue depth and the counters.
+        """
+
+        return {"depth": self.depth, "active": self.active, "capacity": self.max_pending, **self.metrics.__dict__}
+
+    def submit(self, update: Dict[str, Any]) -> bool:
+        """
+        Puts an update in the queue of its chat.
+
+        :param update: raw update from Telegram.
+        :return: False if the pool is saturated and the update was rejected.
+        """
+
+        if self._pending >= self.max_pending:
+            self.metrics.rejected += 1
+            return False
+
+        key = get_chat_key(update)
+        if key is None:
+            # Updates without a chat don't need ordering
+            key = ("update", update.get("update_id"))
+
+        self._pending += 1
+        self._drained.clear()
+        self.metrics.accepted += 1
+        self._chats.setdefault(key, deque()).append((update, time.monotonic()))
+
+        if key not in self._tasks:
+            self._tasks[key] = asyncio.create_task(self._run_chat(key))
+        return True
+
+    async def _run_chat(self, key: Hashable) -> None:
+        queue = self._chats[key]
+        try:
+            while queue:
+                update, enqueued_at = queue[0]
+                async with self._semaphore:
+                    self._active += 1
+                    waited = time.monotonic() - enqueued_at
+                    self.metrics.wait_time_total += waited
+                    self.metrics.wait_time_max = max(self.metrics.wait_time_max, waited)
+
+                    try:
+                        await self.process(update)
+                        self.metrics.processed += 1
+                    except Exception as e:
+                        self.metrics.failed += 1
+                        logging.error(f"[ERROR] Update [ID: {update.get('update_id')}] failed: {e}")
+                    finally:
+                        self._active -= 1
+
+                queue.popleft()
+                self._pending -= 1
+        finally:
+            self._chats.pop(key, None)
+            self._tasks.pop(key, None)
+            if not self._pending:
+                self._drained.set()
+
+    async def close(self, timeout: float = 30.0) -> None:
+        """
+        Waits until all the accepted updates are processed, then cancels whatever is left.
+
+        :param timeout: maximum time in seconds to wait.
+        """
+
+        try:
+            await asyncio.wait_for(self._drained.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logging.error(f"[ERROR] {self._pending} updates were not processed before shutdown.")
+
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class BoundedRequestHandler(SimpleRequestHandler):
+    """
+    Webhook request handler that acknowledges an update right away and processes it in the UpdateWorkerPool.
+    When the pool is saturated it answers 429, so Telegram delivers the update again later.
+    """
+
+    def __init__(
+            self,
+            dispatcher: Dispatcher,
+            bot: Bot,
+            secret_token: Optional[str] = None,
+            concurrency: int = 50,
+            max_pending: int = 1000,
+            **data: Any
+    ) -> None:
+        super().__init__(dispatcher=dispatcher, bot=bot, handle_in_background=True, secret_token=secret_token, **data)
+        self.pool = UpdateWorkerPool(
+            lambda update: self._background_feed_update(bot=self.bot, update=update),
+            concurrency=concurrency,
+            max_pending=max_pending
+        )
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        update = await request.json(loads=bot.session.json_loads)
+        if not self.pool.submit(update):
+            return web.Response(text="Too many updates are being processed.", status=429)
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    async def close(self) -> None:
+        await self.pool.close()
+        await super().close()
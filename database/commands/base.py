@@ -1,5 +1,9 @@
+from typing import Optional
+
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from database.commands.cache import ReadCache
+
 
 class BaseDistributor:
     """
@@ -8,7 +12,9 @@ class BaseDistributor:
     Attributes:
     -----------
     session [AsyncSession] -> the database session used by the distributor.
+    cache [ReadCache] -> optional read-through cache of the reads, it's invalidated by the writes.
     """
 
-    def __init__(self, session):
+    def __init__(self, session, cache: Optional[ReadCache] = None):
         self.session: AsyncSession = session
+        self.cache = cache
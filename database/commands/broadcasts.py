@@ -0,0 +1,94 @@
+from typing import Optional, Sequence
+
+from sqlalchemy import select, update
+from sqlalchemy.dialects.postgresql import insert
+
+from database.commands.base import BaseDistributor
+from database.models.broadcasts import Broadcast, BROADCAST_RUNNING
+
+
+class BroadcastSession(BaseDistributor):
+    async def create_broadcast(self, text: str, created_by: int) -> Broadcast:
+        """
+        Function to create a new running broadcast.
+
+        :param text: text of the message.
+        :param created_by: telegram ID of the admin who started the broadcast.
+        :return: Broadcast object.
+        """
+
+        insert_stmt = (
+            insert(Broadcast)
+            .values(
+                text=text,
+                status=BROADCAST_RUNNING,
+                cursor=0,
+                delivered=0,
+                blocked=0,
+                failed=0,
+                created_by=created_by
+            )
+            .returning(Broadcast)
+        )
+        result = await self.session.execute(insert_stmt)
+
+        await self.session.commit()
+        return result.scalar_one()
+
+    async def get_broadcast(self, broadcast_id: int) -> Optional[Broadcast]:
+        """
+        Function to get a broadcast by its ID.
+
+        :param broadcast_id: id of the broadcast.
+        :return: Broadcast object or None if it doesn't exist.
+        """
+
+        result = await self.session.execute(select(Broadcast).where(Broadcast.id == broadcast_id))
+        return result.scalar_one_or_none()
+
+    async def get_running_broadcasts(self) -> Sequence[Broadcast]:
+        """
+        Function to get all the broadcasts that haven't been finished or paused.
+
+        :return: list of Broadcast objects.
+        """
+
+        result = await self.session.execute(
+            select(Broadcast).where(Broadcast.status == BROADCAST_RUNNING).order_by(Broadcast.id)
+        )
+        return result.scalars().all()
+
+    async def set_status(self, broadcast_id: int, status: str) -> Optional[Broadcast]:
+        """
+        Function to change a status of the broadcast.
+
+        :param broadcast_id: id of the broadcast.
+        :param status: new status of the broadcast.
+        :return: updated Broadcast object or None if it doesn't exist.
+        """
+
+        result = await self.session.execute(
+            update(Broadcast).where(Broadcast.id == broadcast_id).values(status=status).returning(Broadcast)
+        )
+
+        await self.session.commit()
+        return result.scalar_one_or_none()
+
+    async def save_progress(self, broadcast_id: int, cursor: int, delivered: int, blocked: int, failed: int) -> None:
+        """
+        Function to checkpoint a progress of the broadcast.
+
+        :param broadcast_id: id of the broadcast.
+        :param cursor: user_id of the last processed user.
+        :param delivered: number of messages that have been delivered.
+        :param blocked: number of users that blocked the bot.
+        :param failed: number of messages that failed.
+        """
+
+        await self.session.execute(
+            update(Broadcast)
+            .where(Broadcast.id == broadcast_id)
+            .values(cursor=cursor, delivered=delivered, blocked=blocked, failed=failed)
+        )
+
+        await self.session.commit()
@@ -0,0 +1,300 @@
+import json
+import logging
+import math
+import time
+from collections import OrderedDict
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+from sqlalchemy import inspect
+
+
+class TTLCache:
+    """
+    In-process LRU cache with a TTL for every entry.
+
+    Attributes
+    ----------
+    maxsize [int] -> maximum number of entries, the least recently used entry is evicted first.
+    ttl [float] -> time in seconds after which an entry expires.
+    """
+
+    def __init__(self, maxsize: int = 10_000, ttl: float = 3600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Returns the value of the key or None if the key is missing or expired.
+
+        :param key: key of the entry.
+        :return: value of the entry.
+        """
+
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """
+        Stores the value of the key.
+
+        :param key: key of the entry.
+        :param value: value of the entry.
+        """
+
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        """
+        Removes the key from the cache.
+
+        :param key: key of the entry.
+        """
+
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class ReadCache:
+    """
+    Read-through cache of database reads with an in-process LRU tier and an optional shared redis tier.
+
+    Entries belong to a user and their keys contain the version of the user, so a write for the user
+    invalidates all of its entries at once by increasing the version, the old entries simply expire.
+    A read takes the version before the database is queried, so a value read concurrently with a write
+    is stored under the old version and is never served. With redis the versions are shared by all the processes
+    and every process keeps the versions it has read for `version_ttl` seconds, so a read that hits the local tier
+    doesn't go to redis, but a write of another process is seen only after that time.
+    Without redis the versions are kept in the process, so other worker processes can serve a stale entry
+    until it expires. They are kept in a bounded LRU, a user whose version has been evicted gets the floor version,
+    which is above all the versions given out before, so the entries stored under the evicted one are never served.
+    Values are stored as JSON-compatible rows, so they can be shared between processes.
+
+    Attributes
+    ----------
+    local [TTLCache] -> in-process tier.
+    redis [Redis] -> optional shared tier, any redis.asyncio compatible client.
+    ttl [float] -> time in seconds after which an entry expires in both tiers.
+    version_ttl [float] -> time in seconds a version read from redis is reused by the process.
+    prefix [str] -> prefix of the redis keys.
+    """
+
+    def __init__(
+            self,
+            maxsize: int = 10_000,
+            ttl: float = 60.0,
+            redis: Optional[Redis] = None,
+            version_ttl: float = 1.0,
+            prefix: str = "bot:cache"
+    ):
+        self.local = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.redis = redis
+        self.ttl = ttl
+        self.prefix = prefix
+
+        self.local_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.errors = 0
+        # Like in redis, a local version outlives the entries stored under the previous one
+        self._versions = TTLCache(maxsize=maxsize, ttl=version_ttl if redis is not None else ttl * 2)
+        self._clock = 0
+        self._floor = 0
+
+    def snapshot(self) -> Dict[str, int]:
+        return {
+            "local_hits": self.local_hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "errors": self.errors,
+            "local_size": len(self.local),
+        }
+
+    def _version_key(self, user_id: int) -> str:
+        return f"{self.prefix}:version:{user_id}"
+
+    async def _get_version(self, user_id: int) -> Optional[int]:
+        version = self._versions.get(user_id)
+        if version is not None:
+            return version
+        if self.redis is None:
+            return self._floor
+
+        try:
+            version = int(await self.redis.get(self._version_key(user_id)) or 0)
+        except RedisError as e:
+            # Without the version the entries can't be trusted, so the database is read directly
+            self.errors += 1
+            logging.warning(f"[WARNING] Couldn't read the cache version of the user [ID: {user_id}]: {e}")
+            return None
+        self._versions.set(user_id, version)
+        return version
+
+    def _bump_local_version(self, user_id: int) -> None:
+        if self._versions.get(user_id) is None and len(self._versions) >= self._versions.maxsize:
+            # Another user's version is about to be evicted, from now on it's the floor
+            self._floor = self._clock
+        self._clock += 1
+        self._versions.set(user_id, self._clock)
+
+    async def invalidate(self, *user_ids: int) -> None:
+        """
+        Invalidates all the entries of the users, it should be called after the write has been committed.
+
+        :param user_ids: telegram IDs of the users.
+        """
+
+        user_ids = set(user_ids)
+        self.invalidations += len(user_ids)
+        if self.redis is None:
+            for user_id in user_ids:
+                self._bump_local_version(user_id)
+            return
+        if not user_ids:
+            return
+
+        user_ids = list(user_ids)
+        try:
+            # A version outlives the entries stored under the previous one, so it never goes back to them
+            async with self.redis.pipeline(transaction=False) as pipeline:
+                for user_id in user_ids:
+                    pipeline.incr(self._version_key(user_id))
+                    pipeline.expire(self._version_key(user_id), math.ceil(self.ttl * 2))
+                results = await pipeline.execute()
+        except RedisError as e:
+            self.errors += 1
+            # The reused versions may be behind now, so they are read from redis again
+            for user_id in user_ids:
+                self._versions.pop(user_id)
+            logging.warning(f"[WARNING] Couldn't invalidate the cache of {len(user_ids)} users: {e}")
+            return
+
+        # The process sees its own writes right away, the writes of other processes after `version_ttl`
+        for user_id, version in zip(user_ids, results[::2]):
+            self._versions.set(user_id, int(version))
+
+    async def get_or_load(
+            self,
+            user_id: int,
+            key: str,
+            load: Callable[[], Awaitable[Any]],
+            encode: Callable[[Any], Any],
+            decode: Callable[[Any], Any]
+    ) -> Any:
+        """
+        Returns the cached value of the key or loads it from the database and stores it in both tiers.
+
+        :param user_id: telegram ID of the user the value belongs to.
+        :param key: key of the value, unique for the user.
+        :param load: coroutine function that reads the value from the database.
+        :param encode: function that turns the value into a JSON-compatible one.
+        :param decode: function that turns the stored value back.
+        :return: the value.
+        """
+
+        version = await self._get_version(user_id)
+        if version is None:
+            return await load()
+
+        full_key = f"{self.prefix}:{user_id}:{version}:{key}"
+        # Values are wrapped, so a cached None (e.g. a missing user) is told apart from a missing entry
+        entry = self.local.get(full_key)
+        if entry is not None:
+            self.local_hits += 1
+            return decode(entry[0])
+
+        if self.redis is not None:
+            try:
+                raw = await self.redis.get(full_key)
+            except RedisError as e:
+                self.errors += 1
+                logging.warning(f"[WARNING] Couldn't read the cache key {full_key}: {e}")
+                raw = None
+            if raw is not None:
+                self.shared_hits += 1
+                stored = json.loads(raw)
+                self.local.set(full_key, (stored,))
+                return decode(stored)
+
+        self.misses += 1
+        value = await load()
+        stored = encode(value)
+        self.local.set(full_key, (stored,))
+        if self.redis is not None:
+            try:
+                await self.redis.set(full_key, json.dumps(stored), ex=math.ceil(self.ttl))
+            except RedisError as e:
+                self.errors += 1
+                logging.warning(f"[WARNING] Couldn't write the cache key {full_key}: {e}")
+        return value
+
+
+def to_row(instance: Any) -> Optional[Dict[str, Any]]:
+    """
+    Function to turn a model instance into a JSON-compatible dict of its columns.
+
+    :param instance: model instance or None.
+    :return: dict of the columns or None.
+    """
+
+    if instance is None:
+        return None
+
+    row = {}
+    for attribute in inspect(type(instance)).column_attrs:
+        value = getattr(instance, attribute.key)
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        elif isinstance(value, Decimal):
+            value = str(value)
+        row[attribute.key] = value
+    return row
+
+
+def from_row(model: type, row: Optional[Dict[str, Any]]) -> Any:
+    """
+    Function to create a detached model instance from a dict made by to_row.
+
+    :param model: model class.
+    :param row: dict of the columns or None.
+    :return: model instance or None.
+    """
+
+    if row is None:
+        return None
+
+    values = {}
+    for attribute in inspect(model).column_attrs:
+        value = row.get(attribute.key)
+        if value is not None:
+            python_type = attribute.columns[0].type.python_type
+            if python_type is datetime:
+                value = datetime.fromisoformat(value)
+            elif python_type is Decimal:
+                value = Decimal(value)
+        values[attribute.key] = value
+    return model(**values)
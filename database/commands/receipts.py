@@ -1,8 +1,28 @@
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, Optional, Sequence, Tuple
+
+from sqlalchemy import select, tuple_
 from sqlalchemy.dialects.postgresql import insert
 
 from database.commands.base import BaseDistributor
+from database.commands.cache import to_row, from_row
 from database.models.receipts import Receipt
 
+# Statements are built once and take the values as bound parameters. The inserts have RETURNING,
+# so a list of rows sent as executemany is batched by SQLAlchemy into multi-row INSERTs of at most 1000 rows
+# and below the parameter limit of asyncpg (32767)
+RECEIPT_INSERT = insert(Receipt).returning(Receipt)
+# A single row is inserted as a plain statement, passing it as parameters of RECEIPT_INSERT
+# would take the slower path of ORM bulk inserts
+RECEIPT_INSERT_ONE = select(Receipt).from_statement(RECEIPT_INSERT)
+# Without a conflict target, so it works with the unique index of both a plain and a partitioned table
+RECEIPT_INSERT_NEW = insert(Receipt).on_conflict_do_nothing().returning(Receipt)
+
+
+def _cursor_key(cursor: Optional[Tuple[datetime, int]]) -> str:
+    return f"{cursor[0].isoformat()},{cursor[1]}" if cursor is not None else "-"
+
 
 class ReceiptSession(BaseDistributor):
     async def create_receipt(
@@ -13,7 +33,7 @@ class ReceiptSession(BaseDistributor):
             payer_last_name: str,
             product_name: str,
             product_description: str,
-            price: float,
+            price: Decimal,
             currency: str,
             quantity: int
     ):
@@ -32,9 +52,9 @@ class ReceiptSession(BaseDistributor):
         :return: Receipt object.
         """
 
-        insert_stmt = (
-            insert(Receipt)
-            .values(
+        receipt = await self.session.scalar(
+            RECEIPT_INSERT_ONE,
+            dict(
                 user_id=user_id,
                 payer_email=payer_email,
                 payer_first_name=payer_first_name,
@@ -45,23 +65,99 @@ class ReceiptSession(BaseDistributor):
                 currency=currency,
                 quantity=quantity
             )
-            .on_conflict_do_update(
-                index_elements=[Receipt.id],
-                set_=dict(
-                    user_id=user_id,
-                    payer_email=payer_email,
-                    payer_first_name=payer_first_name,
-                    payer_last_name=payer_last_name,
-                    product_name=product_name,
-                    product_description=product_description,
-                    price=price,
-                    currency=currency,
-                    quantity=quantity
-                ),
-            )
-            .returning(Receipt)
         )
-        result = await self.session.execute(insert_stmt)
 
         await self.session.commit()
-        return result.scalar_one()
+        if self.cache is not None:
+            await self.cache.invalidate(user_id)
+        return receipt
+
+    async def create_many(self, receipts: Sequence[Dict]):
+        """
+        Function to add several receipts (e.g. all the items of one transaction) with multi-row INSERTs
+        inside one transaction. Receipts of a payment that have already been stored are skipped.
+
+        :param receipts: list of receipts of any length, every receipt is a dict with the same keys
+            as create_receipt arguments plus payment_id, item_index and optionally created_at.
+            When the receipts table is partitioned, the unique index of payments includes created_at,
+            so a retried payment is skipped only if created_at is taken from the payment rather than from the clock.
+        :return: list of Receipt objects that have been inserted.
+        """
+
+        if not receipts:
+            return []
+
+        result = await self.session.scalars(RECEIPT_INSERT_NEW, list(receipts))
+        created = result.all()
+
+        await self.session.commit()
+        if self.cache is not None and created:
+            await self.cache.invalidate(*(receipt.user_id for receipt in created))
+        return created
+
+    async def get_payment_receipts(self, payment_id: str) -> Sequence[Receipt]:
+        """
+        Function to get the receipts of the payment.
+
+        :param payment_id: PayPal id of the payment.
+        :return: list of Receipt objects.
+        """
+
+        result = await self.session.scalars(
+            select(Receipt).where(Receipt.payment_id == payment_id).order_by(Receipt.item_index)
+        )
+        return result.all()
+
+    async def get_user_receipts(
+            self,
+            user_id: int,
+            limit: int = 10,
+            before: Optional[Tuple[datetime, int]] = None,
+            after: Optional[Tuple[datetime, int]] = None
+    ) -> Sequence[Receipt]:
+        """
+        Returns a page of the user's receipts, newest first. It uses keyset pagination on (created_at, id),
+        so every page is a single range scan of the (user_id, created_at, id) index regardless of how far it is.
+
+        :param user_id: user's telegram ID.
+        :param limit: maximum number of receipts in the page.
+        :param before: (created_at, id) of the oldest receipt of the current page to get the older receipts.
+        :param after: (created_at, id) of the newest receipt of the current page to get the newer receipts.
+        :return: list of Receipt objects ordered from the newest to the oldest.
+        """
+
+        if self.cache is None:
+            return await self._get_user_receipts(user_id, limit, before, after)
+
+        key = f"receipts:{limit}:{_cursor_key(before)}:{_cursor_key(after)}"
+        return await self.cache.get_or_load(
+            user_id,
+            key,
+            lambda: self._get_user_receipts(user_id, limit, before, after),
+            encode=lambda receipts: [to_row(receipt) for receipt in receipts],
+            decode=lambda rows: [from_row(Receipt, row) for row in rows],
+        )
+
+    async def _get_user_receipts(
+            self,
+            user_id: int,
+            limit: int,
+            before: Optional[Tuple[datetime, int]],
+            after: Optional[Tuple[datetime, int]]
+    ) -> Sequence[Receipt]:
+        key = tuple_(Receipt.created_at, Receipt.id)
+        query = select(Receipt).where(Receipt.user_id == user_id)
+
+        if after is not None:
+            # The newer receipts closest to the cursor are read in ascending order and then reversed
+            result = await self.session.scalars(
+                query.where(key > tuple_(*after)).order_by(Receipt.created_at, Receipt.id).limit(limit)
+            )
+            return list(reversed(result.all()))
+
+        if before is not None:
+            query = query.where(key < tuple_(*before))
+        result = await self.session.scalars(
+            query.order_by(Receipt.created_at.desc(), Receipt.id.desc()).limit(limit)
+        )
+        return result.all()
@@ -1,9 +1,13 @@
 from dataclasses import dataclass
+from typing import Optional
 
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
+from database.commands.broadcasts import BroadcastSession
+from database.commands.cache import ReadCache, TTLCache
 from database.commands.receipts import ReceiptSession
-from database.commands.users import UserSession
+from database.commands.state import StateSession
+from database.commands.users import UserSession, UserWriteBuffer
 
 
 @dataclass
@@ -11,14 +15,66 @@ class RequestsDistributor:
     """
     Repository for handling database operations. This class holds all the repositories for the database models.
     You can add more repositories as properties to this class, so they will be easily accessible.
+    User and receipt reads go through the read cache and user writes go through the upsert cache and
+    the write buffer if they're passed, they're created once per process and shared by all the distributors.
     """
 
     session: AsyncSession
+    cache: Optional[ReadCache] = None
+    upsert_cache: Optional[TTLCache] = None
+    write_buffer: Optional[UserWriteBuffer] = None
 
     @property
     def users(self) -> UserSession:
-        return UserSession(self.session)
+        return UserSession(self.session, self.cache, self.upsert_cache, self.write_buffer)
 
     @property
     def receipts(self) -> ReceiptSession:
-        return ReceiptSession(self.session)
+        return ReceiptSession(self.session, self.cache)
+
+    @property
+    def broadcasts(self) -> BroadcastSession:
+        return BroadcastSession(self.session)
+
+    @property
+    def state(self) -> StateSession:
+        return StateSession(self.session)
+
+
+class LazyRequestsDistributor(RequestsDistributor):
+    """
+    Repository that opens its database session on the first access to the session (or any of the repositories),
+    so handlers that never touch the database don't create a session at all.
+    """
+
+    def __init__(
+            self,
+            session_pool: async_sessionmaker,
+            cache: Optional[ReadCache] = None,
+            upsert_cache: Optional[TTLCache] = None,
+            write_buffer: Optional[UserWriteBuffer] = None
+    ):
+        self.session_pool = session_pool
+        self.cache = cache
+        self.upsert_cache = upsert_cache
+        self.write_buffer = write_buffer
+        self._session = None
+
+    @property
+    def session(self) -> AsyncSession:
+        if self._session is None:
+            self._session = self.session_pool()
+        return self._session
+
+    @property
+    def opened(self) -> bool:
+        return self._session is not None
+
+    async def close(self) -> None:
+        """
+        Closes the session if it has been opened and returns its connection to the pool.
+        """
+
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
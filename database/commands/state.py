@@ -0,0 +1,45 @@
+from typing import Optional
+
+from sqlalchemy import select, delete
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.sql.functions import func
+
+from database.commands.base import BaseDistributor
+from database.models.state import BotState
+
+
+class StateSession(BaseDistributor):
+    async def get_state(self, key: str) -> Optional[str]:
+        """
+        Function to get the value of a marker.
+
+        :param key: name of the marker.
+        :return: value of the marker or None if it isn't set.
+        """
+
+        return await self.session.scalar(select(BotState.value).where(BotState.key == key))
+
+    async def set_state(self, key: str, value: str) -> None:
+        """
+        Function to set the value of a marker.
+
+        :param key: name of the marker.
+        :param value: value of the marker.
+        """
+
+        insert_stmt = insert(BotState).values(key=key, value=value)
+        await self.session.execute(insert_stmt.on_conflict_do_update(
+            index_elements=[BotState.key],
+            set_=dict(value=insert_stmt.excluded.value, updated_at=func.now())
+        ))
+        await self.session.commit()
+
+    async def delete_state(self, key: str) -> None:
+        """
+        Function to remove a marker.
+
+        :param key: name of the marker.
+        """
+
+        await self.session.execute(delete(BotState).where(BotState.key == key))
+        await self.session.commit()
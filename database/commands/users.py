@@ -1,44 +1,237 @@
-from typing import Optional
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Dict, Optional, Sequence
 
+from sqlalchemy import select
 from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import async_sessionmaker
 
 from database.commands.base import BaseDistributor
+from database.commands.cache import ReadCache, TTLCache, to_row, from_row
 from database.models.users import User
 
+# Statements are built once and take the values as bound parameters, so they are never constructed
+# or compiled again. A list of rows is sent as executemany: the upsert has no RETURNING, so SQLAlchemy
+# doesn't batch it into multi-row INSERTs with asyncpg, asyncpg runs the prepared statement once per row
+# in a single pipeline instead. There's no limit on the parameters, so any number of rows can be passed.
+_user_insert = insert(User)
+USER_UPSERT = _user_insert.on_conflict_do_update(
+    index_elements=[User.user_id],
+    set_=dict(username=_user_insert.excluded.username, full_name=_user_insert.excluded.full_name),
+)
+
+
+@dataclass(frozen=True)
+class UserInfo:
+    """
+    Detached, read-only copy of a written user. It's shared by all the sessions through the upsert cache,
+    so it isn't an ORM object bound to any of them.
+
+    Attributes
+    ----------
+    user_id [int] -> user's telegram ID.
+    username [str] -> user's telegram username.
+    full_name [str] -> user's telegram full name.
+    """
+
+    user_id: int
+    username: Optional[str]
+    full_name: str
+
 
 class UserSession(BaseDistributor):
+    """
+    Repository of the users.
+
+    Attributes:
+    -----------
+    upsert_cache [TTLCache] -> optional process-wide cache of the last written (username, full_name) of every user,
+        upserts that don't change anything are skipped.
+    write_buffer [UserWriteBuffer] -> optional write-behind buffer, if it's set changed users are written
+        periodically in one batch.
+    """
+
+    def __init__(
+            self,
+            session,
+            cache: Optional[ReadCache] = None,
+            upsert_cache: Optional[TTLCache] = None,
+            write_buffer: Optional["UserWriteBuffer"] = None
+    ):
+        super().__init__(session, cache)
+        self.upsert_cache = upsert_cache
+        self.write_buffer = write_buffer
+
     async def create_user(
             self,
             user_id: int,
             full_name: str,
             username: Optional[str] = None,
-    ):
+    ) -> UserInfo:
         """
-        Creates a new user in the database and returns the user object.
+        Creates a new user in the database or updates the existing one.
+        If the user has already been written with the same username and full name, the database isn't touched.
+        With the write buffer the user is written later, use get_user to read the stored user.
 
         :param user_id: user's telegram ID.
         :param full_name: user's telegram full name.
         :param username: user's telegram username. It's an optional parameter.
-        :return: User object.
-        """
-
-        insert_stmt = (
-            insert(User)
-            .values(
-                user_id=user_id,
-                username=username,
-                full_name=full_name
-            )
-            .on_conflict_do_update(
-                index_elements=[User.user_id],
-                set_=dict(
-                    username=username,
-                    full_name=full_name
-                ),
-            )
-            .returning(User)
-        )
-        result = await self.session.execute(insert_stmt)
+        :return: UserInfo with the written values.
+        """
+
+        user = UserInfo(user_id=user_id, username=username, full_name=full_name)
+        if self.upsert_cache is not None and self.upsert_cache.get(user_id) == user:
+            return user
+
+        if self.write_buffer is not None:
+            self.write_buffer.add(user_id=user_id, username=username, full_name=full_name)
+            if self.upsert_cache is not None:
+                self.upsert_cache.set(user_id, user)
+            # The read cache is invalidated once the buffer has written the user
+            return user
+
+        await self.session.execute(USER_UPSERT, dict(user_id=user_id, username=username, full_name=full_name))
 
         await self.session.commit()
-        return result.scalar_one()
+        if self.upsert_cache is not None:
+            self.upsert_cache.set(user_id, user)
+        if self.cache is not None:
+            await self.cache.invalidate(user_id)
+        return user
+
+    async def upsert_many(self, users: Sequence[Dict]) -> None:
+        """
+        Creates or updates several users in one transaction, the rows are sent with executemany.
+
+        :param users: list of users of any length, every user is a dict with user_id, username and full_name keys.
+        """
+
+        # A row can be affected only once by one statement, so the last version of every user wins
+        rows = list({user["user_id"]: user for user in users}.values())
+        if not rows:
+            return
+
+        await self.session.execute(USER_UPSERT, rows)
+
+        await self.session.commit()
+        if self.cache is not None:
+            await self.cache.invalidate(*(row["user_id"] for row in rows))
+
+    async def get_user(self, user_id: int) -> Optional[User]:
+        """
+        Returns the user, through the read cache if it's set.
+
+        :param user_id: user's telegram ID.
+        :return: User object or None if the user doesn't exist.
+        """
+
+        async def load() -> Optional[User]:
+            return await self.session.scalar(select(User).where(User.user_id == user_id))
+
+        if self.cache is None:
+            return await load()
+        return await self.cache.get_or_load(
+            user_id, "user", load, encode=to_row, decode=lambda row: from_row(User, row)
+        )
+
+    async def get_user_ids(self, after_user_id: int = 0, limit: int = 500) -> Sequence[int]:
+        """
+        Returns a page of user IDs ordered by user_id, it uses keyset pagination, so every page
+        is a single range scan over the primary key regardless of how far the page is.
+
+        :param after_user_id: user_id of the last user from the previous page.
+        :param limit: maximum number of IDs in the page.
+        :return: list of user IDs.
+        """
+
+        result = await self.session.execute(
+            select(User.user_id).where(User.user_id > after_user_id).order_by(User.user_id).limit(limit)
+        )
+        return result.scalars().all()
+
+
+class UserWriteBuffer:
+    """
+    Write-behind buffer for users. Changed users are collected in memory and written every `interval` seconds
+    (or as soon as `max_size` users are collected) in one transaction with upsert_many.
+    If a flush fails, the users are put back in the buffer (unless they have changed since) and written with
+    the next flush, a failing buffer is flushed at most once per `interval`.
+
+    Attributes
+    ----------
+    session_pool [async_sessionmaker] -> session pool of the application.
+    interval [float] -> how often (in seconds) the buffer is flushed.
+    max_size [int] -> number of buffered users that triggers an early flush.
+    cache [ReadCache] -> optional read cache, the written users are invalidated in it after every flush.
+    """
+
+    def __init__(
+            self,
+            session_pool: async_sessionmaker,
+            interval: float = 5.0,
+            max_size: int = 1000,
+            cache: Optional[ReadCache] = None
+    ):
+        self.session_pool = session_pool
+        self.interval = interval
+        self.max_size = max_size
+        self.cache = cache
+
+        self._users: Dict[int, Dict] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._full = asyncio.Event()
+
+    def add(self, user_id: int, full_name: str, username: Optional[str] = None) -> None:
+        self._users[user_id] = dict(user_id=user_id, username=username, full_name=full_name)
+        if len(self._users) >= self.max_size:
+            self._full.set()
+
+    @property
+    def size(self) -> int:
+        return len(self._users)
+
+    async def flush(self) -> bool:
+        """
+        Writes all the buffered users.
+
+        :return: False if the users couldn't be written and have been put back in the buffer.
+        """
+
+        users, self._users = self._users, {}
+        self._full.clear()
+        if not users:
+            return True
+
+        try:
+            async with self.session_pool() as session:
+                await UserSession(session, self.cache).upsert_many(list(users.values()))
+        except Exception as e:
+            logging.error(f"[ERROR] Couldn't write {len(users)} buffered users, they are kept for the next flush: {e}")
+            # Users that have been added during the flush are newer than the ones that failed
+            self._users = {**users, **self._users}
+            return False
+        return True
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            # The flush is shielded, so stopping the buffer doesn't lose users that are being written
+            if not await asyncio.shield(self.flush()):
+                await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """
+        Stops the periodic flush and writes what's left in the buffer.
+        """
+
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        await self.flush()
@@ -0,0 +1,29 @@
+from .runner import Migration, create_index_concurrently, get_schema_version, migrate
+from .versions import (
+    v0001_initial,
+    v0002_receipts_payment_id,
+    v0003_receipts_payment_id_index,
+    v0004_receipts_history_indexes,
+    v0005_receipts_numeric_price,
+    v0006_bot_state,
+    v0007_receipts_utc_created_at,
+)
+
+# All the migrations in the order they are applied, a new migration is added to the end
+MIGRATIONS = [
+    v0001_initial.migration,
+    v0002_receipts_payment_id.migration,
+    v0003_receipts_payment_id_index.migration,
+    v0004_receipts_history_indexes.migration,
+    v0005_receipts_numeric_price.migration,
+    v0006_bot_state.migration,
+    v0007_receipts_utc_created_at.migration,
+]
+
+__all__ = [
+    "MIGRATIONS",
+    "Migration",
+    "create_index_concurrently",
+    "get_schema_version",
+    "migrate",
+]
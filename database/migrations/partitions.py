@@ -0,0 +1,232 @@
+import logging
+import re
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import AsyncIterator, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from database.migrations.runner import MIGRATION_LOCK_KEY
+
+# Upper bound of a range partition in the output of pg_get_expr, e.g. FOR VALUES FROM (...) TO ('2026-11-01 00:00:00')
+UPPER_BOUND = re.compile(r"TO \('([^']+)'\)")
+# Partition that takes the receipts no monthly partition has been created for yet
+DEFAULT_PARTITION = "receipts_default"
+
+
+def add_months(month: datetime, months: int) -> datetime:
+    """
+    Function to move the first day of a month by the given number of months.
+
+    :param month: first day of the month.
+    :param months: number of months, negative to move back.
+    :return: first day of the resulting month.
+    """
+
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition_name(month: datetime) -> str:
+    return f"receipts_y{month.year}m{month.month:02d}"
+
+
+@asynccontextmanager
+async def _locked(engine: AsyncEngine) -> AsyncIterator[AsyncConnection]:
+    # Partitions are changed under the same lock as the schema, so they never race with the migrations
+    async with engine.connect() as connection:
+        connection = await connection.execution_options(isolation_level="AUTOCOMMIT")
+        await connection.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        try:
+            yield connection
+        finally:
+            await connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY})
+
+
+async def _current_month(connection: AsyncConnection) -> datetime:
+    # The month is taken from the database in UTC, the same clock fills created_at by default
+    return await connection.scalar(text("SELECT date_trunc('month', timezone('UTC', now()))"))
+
+
+async def is_partitioned(connection: AsyncConnection) -> bool:
+    return await connection.scalar(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = 'receipts' AND c.relnamespace = current_schema()::regnamespace)"
+    ))
+
+
+async def get_partitions(connection: AsyncConnection) -> List[Tuple[str, Optional[datetime]]]:
+    """
+    Function to get the range partitions of the receipts table, the default partition isn't included.
+
+    :param connection: database connection.
+    :return: list of (name, upper bound) sorted by the upper bound, the bound is None for MAXVALUE.
+    """
+
+    result = await connection.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = 'receipts' AND p.relnamespace = current_schema()::regnamespace "
+        "AND pg_get_expr(c.relpartbound, c.oid) <> 'DEFAULT'"
+    ))
+
+    partitions = []
+    for name, bound in result.all():
+        match = UPPER_BOUND.search(bound)
+        partitions.append((name, datetime.fromisoformat(match.group(1)) if match else None))
+    return sorted(partitions, key=lambda partition: partition[1] or datetime.max)
+
+
+async def partition_receipts(engine: AsyncEngine) -> bool:
+    """
+    Function to turn the receipts table into a table partitioned by month of created_at, it's done only once.
+
+    The existing table becomes the first partition (receipts_legacy) with all the rows up to the end
+    of the current month, so no rows are copied. Its primary key and the unique index of payments are rebuilt
+    to include created_at, which holds an exclusive lock on the receipts for the time of the rebuild.
+
+    :param engine: engine of the application database.
+    :return: whether the table has been converted now.
+    """
+
+    async with _locked(engine) as lock:
+        if await is_partitioned(lock):
+            return False
+
+        logging.info("[INFO] Partitioning the receipts table by month.")
+        async with engine.begin() as connection:
+            boundary = add_months(await _current_month(connection), 1)
+
+            await connection.execute(text("LOCK TABLE receipts IN ACCESS EXCLUSIVE MODE"))
+            await connection.execute(text("ALTER TABLE receipts RENAME TO receipts_legacy"))
+            # The primary key and the unique index of a partitioned table must contain the partition key
+            await connection.execute(text("ALTER TABLE receipts_legacy DROP CONSTRAINT IF EXISTS receipts_pkey"))
+            await connection.execute(text("ALTER TABLE receipts_legacy DROP CONSTRAINT IF EXISTS receipts_id_key"))
+            await connection.execute(text("DROP INDEX IF EXISTS ix_receipts_payment_id_item_index"))
+            # Indexes that already match the new ones are kept and attached instead of being built again
+            await connection.execute(text(
+                "ALTER INDEX IF EXISTS ix_receipts_user_id_created_at RENAME TO receipts_legacy_user_id_created_at_idx"
+            ))
+            await connection.execute(text(
+                "ALTER INDEX IF EXISTS ix_receipts_created_at RENAME TO receipts_legacy_created_at_idx"
+            ))
+
+            await connection.execute(text(
+                "CREATE TABLE receipts (LIKE receipts_legacy INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)"
+            ))
+            sequence = await connection.scalar(text("SELECT pg_get_serial_sequence('receipts_legacy', 'id')"))
+            if sequence:
+                # Otherwise the sequence of ids would be dropped together with the legacy partition
+                await connection.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY receipts.id"))
+
+            await connection.execute(text(
+                "ALTER TABLE receipts ADD CONSTRAINT receipts_pkey PRIMARY KEY (id, created_at)"
+            ))
+            await connection.execute(text(
+                "CREATE UNIQUE INDEX ix_receipts_payment_id_item_index ON receipts (payment_id, item_index, created_at)"
+            ))
+            await connection.execute(text(
+                "CREATE INDEX ix_receipts_user_id_created_at ON receipts (user_id, created_at, id)"
+            ))
+            await connection.execute(text("CREATE INDEX ix_receipts_created_at ON receipts (created_at)"))
+            await connection.execute(
+                text(
+                    "ALTER TABLE receipts ATTACH PARTITION receipts_legacy "
+                    f"FOR VALUES FROM (MINVALUE) TO ('{boundary.isoformat()}')"
+                )
+            )
+        return True
+
+
+async def _create_partition(
+        engine: AsyncEngine,
+        connection: AsyncConnection,
+        name: str,
+        start: datetime,
+        end: datetime
+) -> None:
+    bounds = f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    misplaced = await connection.scalar(
+        text(f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} WHERE created_at >= :start AND created_at < :end)"),
+        {"start": start, "end": end}
+    )
+    if not misplaced:
+        await connection.execute(text(f"CREATE TABLE {name} PARTITION OF receipts {bounds}"))
+        return
+
+    # A partition can't be created while the default partition holds rows of its range,
+    # so they are moved to the new partition in one transaction
+    async with engine.begin() as transaction:
+        await transaction.execute(text(f"ALTER TABLE receipts DETACH PARTITION {DEFAULT_PARTITION}"))
+        await transaction.execute(text(f"CREATE TABLE {name} PARTITION OF receipts {bounds}"))
+        await transaction.execute(
+            text(
+                f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE created_at >= :start AND created_at < :end "
+                f"RETURNING *) INSERT INTO receipts SELECT * FROM moved"
+            ),
+            {"start": start, "end": end}
+        )
+        await transaction.execute(text(f"ALTER TABLE receipts ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT"))
+
+
+async def ensure_receipt_partitions(engine: AsyncEngine, months_ahead: int) -> List[str]:
+    """
+    Function to create the partitions of the current month and the upcoming months that don't exist yet.
+    The default partition is created as well, so a receipt is never rejected for the lack of a partition,
+    e.g. when it's dated after the created partitions or the maintainer hasn't run for a long time.
+
+    :param engine: engine of the application database.
+    :param months_ahead: number of upcoming months.
+    :return: names of the created partitions.
+    """
+
+    created = []
+    async with _locked(engine) as connection:
+        await connection.execute(text(f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF receipts DEFAULT"))
+
+        month = await _current_month(connection)
+        partitions = await get_partitions(connection)
+        bounds = [upper for _, upper in partitions]
+        covered_until = max(bounds, key=lambda upper: upper or datetime.max) if bounds else None
+
+        for offset in range(months_ahead + 1):
+            start, end = add_months(month, offset), add_months(month, offset + 1)
+            if bounds and (covered_until is None or end <= covered_until):
+                continue
+
+            name = partition_name(start)
+            await _create_partition(engine, connection, name, start, end)
+            created.append(name)
+            covered_until = end
+
+    if created:
+        logging.info(f"[INFO] Created receipts partitions: {', '.join(created)}.")
+    return created
+
+
+async def detach_receipt_partitions(engine: AsyncEngine, retention_months: int) -> List[str]:
+    """
+    Function to detach the partitions whose rows are all older than the given number of months.
+    Detached partitions stay in the database as regular tables, so they can be archived (e.g. with pg_dump)
+    and dropped. Partitions can't be detached concurrently while there is a default partition,
+    so every detach briefly locks the receipts table.
+
+    :param engine: engine of the application database.
+    :param retention_months: number of months whose receipts are kept in the table, the current one included.
+    :return: names of the detached partitions.
+    """
+
+    detached = []
+    async with _locked(engine) as connection:
+        cutoff = add_months(await _current_month(connection), 1 - retention_months)
+        for name, upper in await get_partitions(connection):
+            if upper is None or upper > cutoff:
+                continue
+
+            await connection.execute(text(f"ALTER TABLE receipts DETACH PARTITION {name}"))
+            detached.append(name)
+
+    if detached:
+        logging.info(f"[INFO] Detached receipts partitions: {', '.join(detached)}.")
+    return detached
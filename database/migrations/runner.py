@@ -0,0 +1,141 @@
+import logging
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Sequence
+
+from sqlalchemy import text
+from sqlalchemy.exc import ProgrammingError
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+# Key of the advisory lock that makes other processes wait while one of them migrates the schema
+MIGRATION_LOCK_KEY = 7_250_000_001
+
+
+@dataclass(frozen=True)
+class Migration:
+    """
+    A single step of the database schema.
+
+    Attributes
+    ----------
+    version [int] -> version of the schema after the migration, versions go one after another.
+    name [str] -> short description of the migration.
+    upgrade [Callable] -> coroutine function that takes a connection and changes the schema.
+    transactional [bool] -> whether the migration runs in a transaction together with the version update,
+        migrations that can't run in a transaction (e.g. CREATE INDEX CONCURRENTLY) run in autocommit mode
+        and must be safe to run again.
+    """
+
+    version: int
+    name: str
+    upgrade: Callable[[AsyncConnection], Awaitable[None]]
+    transactional: bool = True
+
+
+async def get_schema_version(connection: AsyncConnection) -> int:
+    """
+    Function to read the version of the schema with a single query.
+
+    :param connection: database connection.
+    :return: version of the schema, 0 if no migrations have been applied yet.
+    """
+
+    try:
+        version = await connection.scalar(text("SELECT max(version) FROM schema_version"))
+    except ProgrammingError:
+        # The table is created by the first run of the migrations
+        await connection.rollback()
+        return 0
+    await connection.commit()
+    return version or 0
+
+
+async def create_index_concurrently(
+        connection: AsyncConnection,
+        name: str,
+        table: str,
+        columns: str,
+        unique: bool = False
+) -> None:
+    """
+    Function to create an index without locking the table for writes, the connection must be in autocommit mode.
+    An invalid index left by an interrupted attempt is dropped and created again.
+
+    :param connection: database connection in autocommit mode.
+    :param name: name of the index.
+    :param table: name of the table.
+    :param columns: indexed columns, e.g. "user_id, created_at".
+    :param unique: whether the index is unique.
+    """
+
+    valid = await connection.scalar(
+        text(
+            "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE c.relname = :name AND c.relnamespace = current_schema()::regnamespace"
+        ),
+        {"name": name}
+    )
+    if valid:
+        return
+    if valid is not None:
+        await connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+    unique_clause = "UNIQUE " if unique else ""
+    await connection.execute(text(f"CREATE {unique_clause}INDEX CONCURRENTLY {name} ON {table} ({columns})"))
+
+
+async def _record(connection: AsyncConnection, migration: Migration) -> None:
+    await connection.execute(
+        text("INSERT INTO schema_version (version, name) VALUES (:version, :name)"),
+        {"version": migration.version, "name": migration.name}
+    )
+
+
+async def migrate(engine: AsyncEngine, migrations: Sequence[Migration]) -> int:
+    """
+    Function to bring the schema to the latest version.
+    If the schema is up to date, it costs a single query, otherwise the pending migrations are applied in order
+    under an advisory lock, so several processes never migrate at the same time.
+
+    :param engine: engine of the application database.
+    :param migrations: all the migrations sorted by version.
+    :return: version of the schema.
+    """
+
+    latest = migrations[-1].version if migrations else 0
+    async with engine.connect() as connection:
+        version = await get_schema_version(connection)
+    if version >= latest:
+        logging.info(f"[INFO] Database schema is up to date, version {version}.")
+        return version
+
+    async with engine.connect() as connection:
+        connection = await connection.execution_options(isolation_level="AUTOCOMMIT")
+        await connection.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        try:
+            await connection.execute(text(
+                "CREATE TABLE IF NOT EXISTS schema_version ("
+                "version INTEGER PRIMARY KEY, "
+                "name VARCHAR(128) NOT NULL, "
+                "applied_at TIMESTAMP WITHOUT TIME ZONE DEFAULT now() NOT NULL)"
+            ))
+            # Another process could have migrated the schema while this one was waiting for the lock
+            version = await connection.scalar(text("SELECT coalesce(max(version), 0) FROM schema_version"))
+
+            for migration in migrations:
+                if migration.version <= version:
+                    continue
+
+                logging.info(f"[INFO] Applying migration {migration.version}: {migration.name}.")
+                if migration.transactional:
+                    async with engine.begin() as transaction:
+                        await migration.upgrade(transaction)
+                        await _record(transaction, migration)
+                else:
+                    await migration.upgrade(connection)
+                    await _record(connection, migration)
+                version = migration.version
+        finally:
+            await connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY})
+
+    logging.info(f"[INFO] Database schema has been migrated to version {version}.")
+    return version
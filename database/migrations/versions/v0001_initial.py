@@ -0,0 +1,55 @@
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from database.migrations.runner import Migration
+
+
+async def upgrade(connection: AsyncConnection) -> None:
+    # The tables may already exist if they were created by create_all before the migrations were introduced
+    await connection.execute(text("""
+        CREATE TABLE IF NOT EXISTS users (
+            user_id BIGINT NOT NULL,
+            username VARCHAR(128),
+            full_name VARCHAR(128) NOT NULL,
+            created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT now() NOT NULL,
+            updated_at TIMESTAMP WITHOUT TIME ZONE DEFAULT now() NOT NULL,
+            PRIMARY KEY (user_id)
+        )
+    """))
+    await connection.execute(text("""
+        CREATE TABLE IF NOT EXISTS receipts (
+            id SERIAL NOT NULL,
+            user_id BIGINT NOT NULL,
+            payer_email VARCHAR(128) NOT NULL,
+            payer_first_name VARCHAR(128) NOT NULL,
+            payer_last_name VARCHAR(128) NOT NULL,
+            product_name VARCHAR(128) NOT NULL,
+            product_description VARCHAR(256) NOT NULL,
+            price FLOAT NOT NULL,
+            currency VARCHAR(3) NOT NULL,
+            quantity INTEGER NOT NULL,
+            created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT now() NOT NULL,
+            updated_at TIMESTAMP WITHOUT TIME ZONE DEFAULT now() NOT NULL,
+            PRIMARY KEY (id),
+            UNIQUE (id)
+        )
+    """))
+    await connection.execute(text("""
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id SERIAL NOT NULL,
+            text TEXT NOT NULL,
+            status VARCHAR(16) NOT NULL,
+            cursor BIGINT NOT NULL,
+            delivered INTEGER NOT NULL,
+            blocked INTEGER NOT NULL,
+            failed INTEGER NOT NULL,
+            created_by BIGINT NOT NULL,
+            created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT now() NOT NULL,
+            updated_at TIMESTAMP WITHOUT TIME ZONE DEFAULT now() NOT NULL,
+            PRIMARY KEY (id),
+            UNIQUE (id)
+        )
+    """))
+
+
+migration = Migration(version=1, name="Create users, receipts and broadcasts", upgrade=upgrade)
@@ -0,0 +1,13 @@
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from database.migrations.runner import Migration
+
+
+async def upgrade(connection: AsyncConnection) -> None:
+    # Nullable columns without a default are added without rewriting the table
+    await connection.execute(text("ALTER TABLE receipts ADD COLUMN IF NOT EXISTS payment_id VARCHAR(64)"))
+    await connection.execute(text("ALTER TABLE receipts ADD COLUMN IF NOT EXISTS item_index INTEGER"))
+
+
+migration = Migration(version=2, name="Add payment_id and item_index to receipts", upgrade=upgrade)
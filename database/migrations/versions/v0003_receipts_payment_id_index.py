@@ -0,0 +1,14 @@
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from database.migrations.runner import Migration, create_index_concurrently
+
+
+async def upgrade(connection: AsyncConnection) -> None:
+    await create_index_concurrently(
+        connection, "ix_receipts_payment_id_item_index", "receipts", "payment_id, item_index", unique=True
+    )
+
+
+migration = Migration(
+    version=3, name="Create a unique index on receipts payment_id and item_index", upgrade=upgrade, transactional=False
+)
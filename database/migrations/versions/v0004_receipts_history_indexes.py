@@ -0,0 +1,17 @@
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from database.migrations.runner import Migration, create_index_concurrently
+
+
+async def upgrade(connection: AsyncConnection) -> None:
+    # History of a user, newest first, is read with keyset pagination on (created_at, id)
+    await create_index_concurrently(
+        connection, "ix_receipts_user_id_created_at", "receipts", "user_id, created_at, id"
+    )
+    # Date range reports over all the users
+    await create_index_concurrently(connection, "ix_receipts_created_at", "receipts", "created_at")
+
+
+migration = Migration(
+    version=4, name="Create receipts indexes for history queries", upgrade=upgrade, transactional=False
+)
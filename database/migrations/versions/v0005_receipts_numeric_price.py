@@ -0,0 +1,15 @@
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from database.migrations.runner import Migration
+
+
+async def upgrade(connection: AsyncConnection) -> None:
+    # Money is stored exactly, PayPal amounts have at most 2 decimal places.
+    # The table is rewritten once under an exclusive lock.
+    await connection.execute(text(
+        "ALTER TABLE receipts ALTER COLUMN price TYPE NUMERIC(12, 2) USING round(price::numeric, 2)"
+    ))
+
+
+migration = Migration(version=5, name="Store receipts price as NUMERIC", upgrade=upgrade)
@@ -0,0 +1,19 @@
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from database.migrations.runner import Migration
+
+
+async def upgrade(connection: AsyncConnection) -> None:
+    # Small key-value markers shared by all the processes, e.g. the deployment the bootstrap has been run for
+    await connection.execute(text("""
+        CREATE TABLE IF NOT EXISTS bot_state (
+            key VARCHAR(64) NOT NULL,
+            value TEXT NOT NULL,
+            updated_at TIMESTAMP WITHOUT TIME ZONE DEFAULT now() NOT NULL,
+            PRIMARY KEY (key)
+        )
+    """))
+
+
+migration = Migration(version=6, name="Create bot state", upgrade=upgrade)
@@ -0,0 +1,15 @@
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from database.migrations.runner import Migration
+
+
+async def upgrade(connection: AsyncConnection) -> None:
+    # created_at has no time zone, it's filled in UTC whatever the time zone of the session is,
+    # like the payment times from PayPal and the bounds of the monthly partitions
+    await connection.execute(text(
+        "ALTER TABLE receipts ALTER COLUMN created_at SET DEFAULT timezone('UTC', now())"
+    ))
+
+
+migration = Migration(version=7, name="Fill receipts created_at in UTC", upgrade=upgrade)
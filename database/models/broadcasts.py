@@ -0,0 +1,53 @@
+from sqlalchemy import String, Text, Integer, BIGINT
+from sqlalchemy.orm import Mapped, mapped_column
+
+from .base import Base, TimestampMixin, TableNameMixin, int_pk
+
+BROADCAST_RUNNING = "running"
+BROADCAST_PAUSED = "paused"
+BROADCAST_FINISHED = "finished"
+
+
+class Broadcast(Base, TimestampMixin, TableNameMixin):
+    """
+    This class represents a Broadcast job in the application.
+    Recipients are processed in the order of their user_id, the cursor keeps the last user_id of the last
+    finished page, so a broadcast resumed after a restart skips the finished pages. Delivery is at-least-once
+    per page: the users of a page that was interrupted may receive the message twice.
+
+    Attributes:
+    -----------
+    id [Mapped[int_pk]] -> id of the object in the database.
+    text [Mapped[str]] -> text of the message.
+    status [Mapped[str]] -> status of the broadcast ("running", "paused" or "finished").
+    cursor [Mapped[int]] -> user_id of the last user that the message has been processed for.
+    delivered [Mapped[int]] -> number of messages that have been delivered.
+    blocked [Mapped[int]] -> number of users that blocked the bot.
+    failed [Mapped[int]] -> number of messages that failed for any other reason.
+    created_by [Mapped[int]] -> telegram ID of the admin who started the broadcast.
+
+    Methods:
+    --------
+    __repr__() -> returns a string representation of the Broadcast object.
+
+    Inherited Attributes:
+    ---------------------
+    Inherits from Base, TimestampMixin, and TableNameMixin classes, which provide additional attributes and functionality.
+
+    Inherited Methods:
+    ------------------
+    Inherits methods from Base, TimestampMixin, and TableNameMixin classes, which provide additional functionality.
+    """
+
+    id: Mapped[int_pk]
+    text: Mapped[str] = mapped_column(Text)
+    status: Mapped[str] = mapped_column(String(16), default=BROADCAST_RUNNING)
+    cursor: Mapped[int] = mapped_column(BIGINT, default=0)
+    delivered: Mapped[int] = mapped_column(Integer, default=0)
+    blocked: Mapped[int] = mapped_column(Integer, default=0)
+    failed: Mapped[int] = mapped_column(Integer, default=0)
+    created_by: Mapped[int] = mapped_column(BIGINT)
+
+    def __repr__(self):
+        return (f"<Broadcast {self.id} {self.status} {self.cursor} "
+                f"{self.delivered} {self.blocked} {self.failed}>")
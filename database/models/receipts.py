@@ -1,7 +1,13 @@
-from sqlalchemy import String, Integer, BIGINT, FLOAT
+from datetime import datetime
+from decimal import Decimal
+from typing import Optional
+
+from sqlalchemy import String, Integer, BIGINT, NUMERIC, Index
+from sqlalchemy.dialects.postgresql import TIMESTAMP
 from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy.sql.functions import func
 
-from .base import Base, TimestampMixin, TableNameMixin, int_pk
+from .base import Base, TimestampMixin, TableNameMixin
 
 
 class Receipt(Base, TimestampMixin, TableNameMixin):
@@ -12,14 +18,17 @@ class Receipt(Base, TimestampMixin, TableNameMixin):
 
     Attributes:
     -----------
-    id [Mapped[int_pk]] -> id of the object in the database.
+    id [Mapped[int]] -> id of the object in the database, it's the primary key together with created_at.
+    created_at [Mapped[datetime]] -> when the receipt has been created, in UTC.
+    payment_id [Mapped[Optional[str]]] -> PayPal id of the payment the receipt belongs to.
+    item_index [Mapped[Optional[int]]] -> position of the item in the payment, unique together with payment_id.
     user_id [Mapped[int]] -> user's telegram ID.
     payer_email [Mapped[str]] -> email that was used to pay for the transaction.
     payer_first_name [Mapped[str]] -> first name that was used to pay for the transaction.
     payer_last_name [Mapped[str]] -> last name that was used to pay for the transaction.
     product_name [Mapped[str]] -> product's name that's been paid for.
     product_description [Mapped[str]] -> product's description that's been paid for.
-    price [Mapped[float]] -> product's price that's been paid for.
+    price [Mapped[Decimal]] -> product's price that's been paid for, stored exactly.
     currency [Mapped[str]] -> product's currency that's been paid for.
     quantity [Mapped[int]] -> product's quantity that's been paid for.
 
@@ -36,14 +45,27 @@ class Receipt(Base, TimestampMixin, TableNameMixin):
     Inherits methods from Base, TimestampMixin, and TableNameMixin classes, which provide additional functionality.
     """
 
-    id: Mapped[int_pk]
+    # The table can be partitioned by month of created_at, so the partition key is a part of the primary key
+    # and of the unique index of payments like in the partitioned schema (see database/migrations/partitions.py)
+    __table_args__ = (
+        Index("ix_receipts_payment_id_item_index", "payment_id", "item_index", "created_at", unique=True),
+        Index("ix_receipts_user_id_created_at", "user_id", "created_at", "id"),
+        Index("ix_receipts_created_at", "created_at"),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    created_at: Mapped[datetime] = mapped_column(
+        TIMESTAMP, primary_key=True, server_default=func.timezone("UTC", func.now())
+    )
+    payment_id: Mapped[Optional[str]] = mapped_column(String(64))
+    item_index: Mapped[Optional[int]] = mapped_column(Integer)
     user_id: Mapped[int] = mapped_column(BIGINT)
     payer_email: Mapped[str] = mapped_column(String(128))
     payer_first_name: Mapped[str] = mapped_column(String(128))
     payer_last_name: Mapped[str] = mapped_column(String(128))
     product_name: Mapped[str] = mapped_column(String(128))
     product_description: Mapped[str] = mapped_column(String(256))
-    price: Mapped[float] = mapped_column(FLOAT)
+    price: Mapped[Decimal] = mapped_column(NUMERIC(12, 2))
     currency: Mapped[str] = mapped_column(String(3))
     quantity: Mapped[int] = mapped_column(Integer)
 
@@ -0,0 +1,27 @@
+from datetime import datetime
+
+from sqlalchemy import String, Text
+from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy.sql.functions import func
+
+from .base import Base
+
+
+class BotState(Base):
+    """
+    This class represents a marker shared by all the processes of the bot.
+
+    Attributes:
+    -----------
+    key [Mapped[str]] -> name of the marker.
+    value [Mapped[str]] -> value of the marker.
+    updated_at [Mapped[datetime]] -> when the marker has been set.
+    """
+    __tablename__ = "bot_state"
+
+    key: Mapped[str] = mapped_column(String(64), primary_key=True)
+    value: Mapped[str] = mapped_column(Text)
+    updated_at: Mapped[datetime] = mapped_column(server_default=func.now())
+
+    def __repr__(self):
+        return f"<BotState {self.key}={self.value}>"
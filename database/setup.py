@@ -1,19 +1,49 @@
+import time
+from typing import Dict
+
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 from bot.data.config import DatabaseConfig
-from database.models.base import Base
-from database.models.users import User
-from database.models.receipts import Receipt
+from bot.services.metrics import db_checkout_duration
+from database.migrations import MIGRATIONS, get_schema_version, migrate
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """
+    Connection pool that records how long it takes to check out a connection.
+    """
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            db_checkout_duration.observe(time.perf_counter() - started)
 
 
-def create_engine(database: DatabaseConfig, echo=False):
+def get_pool_usage(engine: AsyncEngine) -> Dict[str, int]:
+    pool = engine.pool
+    return {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+    }
+
+
+def create_engine(database: DatabaseConfig, echo=False, workers: int = 1, **options):
+    # The pool limits of the configuration are shared by the worker processes,
+    # options override them, e.g. to compare pool settings in the benchmarks
+    settings = database.pool_options(workers)
+    settings.update(options)
+
     engine = create_async_engine(
         database.construct_sqlalchemy_url(),
-        query_cache_size=1200,
-        pool_size=20,
-        max_overflow=200,
+        poolclass=TimedQueuePool,
         future=True,
         echo=echo,
+        **settings,
     )
     return engine
 
@@ -24,7 +54,11 @@ def create_session_pool(engine):
 
 
 async def run_migrations(engine: AsyncEngine):
-    async with engine.begin() as connection:
-        await connection.run_sync(Base.metadata.create_all)
+    # The schema version is checked with one query, pending migrations are applied on the shared engine
+    return await migrate(engine, MIGRATIONS)
+
 
-    await engine.dispose()
+async def is_schema_current(engine: AsyncEngine) -> bool:
+    # Processes that don't migrate the schema wait for this before they start serving
+    async with engine.connect() as connection:
+        return await get_schema_version(connection) >= MIGRATIONS[-1].version
@@ -0,0 +1,86 @@
+import asyncio
+
+from database.commands.cache import ReadCache, TTLCache
+
+
+class Loader:
+    """
+    Counts the loads of every key, the loaded value is the number of the load.
+    """
+
+    def __init__(self):
+        self.loads = {}
+
+    def __call__(self, cache: ReadCache, user_id: int, key: str = "user"):
+        async def load():
+            self.loads[user_id, key] = self.loads.get((user_id, key), 0) + 1
+            return self.loads[user_id, key]
+
+        return cache.get_or_load(user_id, key, load, encode=lambda value: value, decode=lambda value: value)
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set(1, "a")
+    cache.set(2, "b")
+    cache.get(1)
+    cache.set(3, "c")
+
+    assert cache.get(1) == "a"
+    assert cache.get(2) is None
+    assert cache.get(3) == "c"
+
+
+def test_invalidation_drops_only_the_users_entries():
+    cache = ReadCache(maxsize=100, ttl=60)
+    load = Loader()
+
+    async def main():
+        assert await load(cache, 1) == 1
+        assert await load(cache, 1) == 1
+        assert await load(cache, 2) == 1
+
+        await cache.invalidate(1)
+        assert await load(cache, 1) == 2
+        assert await load(cache, 2) == 1
+
+    asyncio.run(main())
+
+    assert cache.local_hits == 2
+    assert cache.misses == 3
+    assert cache.invalidations == 1
+
+
+def test_evicted_entries_are_loaded_again():
+    cache = ReadCache(maxsize=2, ttl=60)
+    load = Loader()
+
+    async def main():
+        await load(cache, 1)
+        await load(cache, 2)
+        await load(cache, 3)
+        assert await load(cache, 1) == 2
+
+    asyncio.run(main())
+
+
+def test_evicted_version_never_serves_old_entries():
+    cache = ReadCache(maxsize=100, ttl=60)
+    cache._versions = TTLCache(maxsize=2, ttl=120)
+    load = Loader()
+
+    async def main():
+        assert await load(cache, 1) == 1
+        await cache.invalidate(1)
+        assert await load(cache, 1) == 2
+
+        # The version of user 1 is evicted by the versions of the other users
+        await cache.invalidate(2)
+        await cache.invalidate(3)
+        assert cache._versions.get(1) is None
+
+        # User 1 gets the floor version, the entries stored under its old versions aren't served
+        assert await load(cache, 1) == 3
+        assert await load(cache, 1) == 3
+
+    asyncio.run(main())
@@ -0,0 +1,72 @@
+import os
+
+import pytest
+from environs import EnvError
+
+from bot.data.config import MappingEnv, RedisConfig, load_config
+
+REQUIRED = """
+BOT_TOKEN=123:abc
+ADMINS=1
+USE_REDIS=False
+DB_HOST=localhost
+POSTGRES_PASSWORD=password
+POSTGRES_USER=user
+POSTGRES_DB=database
+PAYPAL_MODE=sandbox
+PAYPAL_CLIENT_ID=id
+PAYPAL_CLIENT_SECRET=secret
+WEB_SERVER_HOST=0.0.0.0
+WEB_SERVER_PORT=8080
+WEB_SECRET=secret
+BASE_WEBHOOK_URL=https://example.com
+"""
+
+
+def test_mapping_env_reads_the_mapping():
+    env = MappingEnv({"NUMBER": "5", "NAMES": "a,b", "EMPTY": None})
+
+    assert env.int("NUMBER") == 5
+    assert env.list("NAMES") == ["a", "b"]
+    assert env.int("EMPTY", 7) == 7
+    assert env.str("MISSING", "default") == "default"
+    with pytest.raises(EnvError):
+        env.str("MISSING")
+
+
+def test_environment_takes_precedence_over_the_file(tmp_path, monkeypatch):
+    path = tmp_path / ".env"
+    path.write_text(REQUIRED + "BOT_RATE_LIMIT=10\nBOT_CONNECTION_LIMIT=20\n")
+    monkeypatch.setenv("BOT_RATE_LIMIT", "15")
+    monkeypatch.delenv("BOT_CONNECTION_LIMIT", raising=False)
+
+    config = load_config(str(path))
+
+    assert config.telegram_bot.rate_limit == 15.0
+    assert config.telegram_bot.connection_limit == 20
+    # The values of the file never leak into the environment
+    assert "BOT_CONNECTION_LIMIT" not in os.environ
+
+
+def test_reload_picks_up_changes_of_the_file(tmp_path, monkeypatch):
+    path = tmp_path / ".env"
+    monkeypatch.delenv("BOT_CONNECTION_LIMIT", raising=False)
+    path.write_text(REQUIRED + "BOT_CONNECTION_LIMIT=20\n")
+    assert load_config(str(path)).telegram_bot.connection_limit == 20
+
+    path.write_text(REQUIRED + "BOT_CONNECTION_LIMIT=30\n")
+    assert load_config(str(path)).telegram_bot.connection_limit == 30
+
+
+def test_empty_redis_ttl_means_no_expiry():
+    config = RedisConfig.from_env(MappingEnv({"REDIS_HOST": "localhost", "REDIS_STATE_TTL": "", "REDIS_DATA_TTL": ""}))
+
+    assert config.state_ttl is None
+    assert config.data_ttl is None
+
+
+def test_redis_ttl_is_parsed():
+    config = RedisConfig.from_env(MappingEnv({"REDIS_HOST": "localhost", "REDIS_STATE_TTL": "86400"}))
+
+    assert config.state_ttl == 86400
+    assert config.data_ttl is None
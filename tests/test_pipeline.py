@@ -0,0 +1,82 @@
+import asyncio
+from typing import List, Tuple
+
+from bot.paypal.pipeline import ConfirmationJob, ConfirmationPipeline
+
+
+def run_pipeline(results: List[Tuple[int, str]], *jobs: ConfirmationJob) -> Tuple[ConfirmationPipeline, List]:
+    """
+    Runs the jobs through a pipeline whose processor answers with the given results one by one.
+    """
+
+    processed = []
+
+    async def process(job: ConfirmationJob) -> Tuple[int, str]:
+        processed.append(job)
+        await asyncio.sleep(0)
+        return results.pop(0)
+
+    async def main() -> ConfirmationPipeline:
+        pipeline = ConfirmationPipeline(process, workers=2, max_retries=2, retry_delay=0)
+        pipeline.start()
+        for job in jobs:
+            assert pipeline.submit(job)
+        await pipeline.close(timeout=5)
+        return pipeline
+
+    return asyncio.run(main()), processed
+
+
+def test_duplicate_job_is_not_run_when_first_succeeds():
+    pipeline, processed = run_pipeline(
+        [(200, "ok")],
+        ConfirmationJob("PAY-1", payer_id="PAYER"),
+        ConfirmationJob("PAY-1"),
+    )
+
+    assert [job.payer_id for job in processed] == ["PAYER"]
+    assert pipeline.metrics.duplicates == 1
+    assert pipeline.metrics.processed == 1
+    assert pipeline.metrics.resubmitted == 0
+
+
+def test_server_errors_are_retried():
+    pipeline, processed = run_pipeline([(500, "error"), (500, "error"), (200, "ok")], ConfirmationJob("PAY-1"))
+
+    assert len(processed) == 3
+    assert pipeline.metrics.retries == 2
+    assert pipeline.metrics.processed == 1
+    assert pipeline.metrics.failed == 0
+
+
+def test_client_errors_are_not_retried():
+    pipeline, processed = run_pipeline([(400, "failed")], ConfirmationJob("PAY-1"))
+
+    assert len(processed) == 1
+    assert pipeline.metrics.retries == 0
+    assert pipeline.metrics.failed == 1
+
+
+def test_webhook_job_runs_when_return_url_job_fails():
+    pipeline, processed = run_pipeline(
+        [(500, "error"), (500, "error"), (500, "error"), (200, "ok")],
+        ConfirmationJob("PAY-1", payer_id="PAYER"),
+        ConfirmationJob("PAY-1"),
+    )
+
+    assert [job.payer_id for job in processed] == ["PAYER", "PAYER", "PAYER", None]
+    assert pipeline.metrics.failed == 1
+    assert pipeline.metrics.resubmitted == 1
+    assert pipeline.metrics.processed == 1
+
+
+def test_pending_payment_is_released_after_processing():
+    pipeline, processed = run_pipeline(
+        [(200, "ok"), (200, "ok")],
+        ConfirmationJob("PAY-1"),
+        ConfirmationJob("PAY-2"),
+    )
+
+    assert {job.payment_id for job in processed} == {"PAY-1", "PAY-2"}
+    assert pipeline.depth == 0
+    assert pipeline.in_progress == 0
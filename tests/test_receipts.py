@@ -0,0 +1,85 @@
+import asyncio
+from datetime import datetime, timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+
+from bot.handlers.users.receipts import PAGE_SIZE, get_page
+from bot.keyboards.inline_keyboard.inline_keyboard import ReceiptsPage
+
+
+class FakeReceipts:
+    """
+    Keyset pagination over a list of receipts, the same contract as ReceiptSession.get_user_receipts.
+    """
+
+    def __init__(self, receipts):
+        self.receipts = sorted(receipts, key=lambda receipt: (receipt.created_at, receipt.id), reverse=True)
+
+    async def get_user_receipts(self, user_id, limit=10, before=None, after=None):
+        rows = [receipt for receipt in self.receipts if receipt.user_id == user_id]
+        if after is not None:
+            newer = [receipt for receipt in rows if (receipt.created_at, receipt.id) > after]
+            return newer[-limit:]
+        if before is not None:
+            rows = [receipt for receipt in rows if (receipt.created_at, receipt.id) < before]
+        return rows[:limit]
+
+
+def make_distributor(count, user_id=1, product_name="Product", currency="USD"):
+    # created_at of the receipts is a naive UTC datetime
+    started = datetime(2026, 1, 1)
+    receipts = [
+        SimpleNamespace(
+            id=index, user_id=user_id, created_at=started + timedelta(minutes=index), product_name=product_name,
+            quantity=1, price=Decimal("1.00"), currency=currency
+        )
+        for index in range(1, count + 1)
+    ]
+    return SimpleNamespace(receipts=FakeReceipts(receipts))
+
+
+def open_page(distributor, page=None):
+    text, keyboard = asyncio.run(get_page(distributor, 1, page))
+    buttons = [] if keyboard is None else [ReceiptsPage.unpack(button.callback_data)
+                                           for row in keyboard.inline_keyboard for button in row]
+    return text, {button.direction: button for button in buttons}
+
+
+def test_pages_are_walked_both_ways():
+    distributor = make_distributor(2 * PAGE_SIZE + 5)
+
+    _, first = open_page(distributor)
+    assert set(first) == {"older"}
+
+    _, second = open_page(distributor, first["older"])
+    assert set(second) == {"newer", "older"}
+
+    last_text, last = open_page(distributor, second["older"])
+    assert set(last) == {"newer"}
+    assert last_text.count("🧾") == 5
+
+    _, back = open_page(distributor, last["newer"])
+    assert back == second
+
+    first_text, newest = open_page(distributor, back["newer"])
+    assert set(newest) == {"older"}
+    assert first_text.count("🧾") == PAGE_SIZE
+
+
+def test_history_that_fits_into_a_page_has_no_keyboard():
+    text, buttons = open_page(make_distributor(PAGE_SIZE))
+
+    assert text.count("🧾") == PAGE_SIZE
+    assert buttons == {}
+
+
+def test_no_receipts():
+    assert asyncio.run(get_page(make_distributor(0), 1)) is None
+
+
+def test_receipt_fields_are_escaped():
+    text, _ = open_page(make_distributor(1, product_name="<b>Bold</b> & co", currency="<i>"))
+
+    assert "&lt;b&gt;Bold&lt;/b&gt; &amp; co" in text
+    assert "&lt;i&gt;" in text
+    assert "<i>" not in text
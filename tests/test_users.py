@@ -0,0 +1,87 @@
+import asyncio
+
+from database.commands.cache import TTLCache
+from database.commands.users import UserInfo, UserSession, UserWriteBuffer
+
+
+class FakeSession:
+    def __init__(self, database):
+        self.database = database
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    async def execute(self, statement, rows):
+        if self.database.failures:
+            self.database.failures -= 1
+            raise ConnectionError("database is unavailable")
+        rows = rows if isinstance(rows, list) else [rows]
+        self.database.rows.extend(rows)
+
+    async def commit(self):
+        pass
+
+
+class FakeDatabase:
+    """
+    Session pool whose sessions fail the first `failures` writes and record the written rows.
+    """
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.rows = []
+
+    def __call__(self):
+        return FakeSession(self)
+
+
+def test_failed_flush_puts_users_back():
+    database = FakeDatabase(failures=1)
+    buffer = UserWriteBuffer(database)
+
+    async def main():
+        buffer.add(user_id=1, full_name="First")
+        buffer.add(user_id=2, full_name="Second")
+        assert await buffer.flush() is False
+        assert buffer.size == 2
+
+        # A user updated after the failure keeps its newest version
+        buffer.add(user_id=1, full_name="First updated")
+        assert await buffer.flush() is True
+
+    asyncio.run(main())
+
+    assert buffer.size == 0
+    assert sorted((row["user_id"], row["full_name"]) for row in database.rows) == [(1, "First updated"), (2, "Second")]
+
+
+def test_unchanged_user_is_not_written_again():
+    database = FakeDatabase()
+    upsert_cache = TTLCache(maxsize=10, ttl=60)
+
+    async def main():
+        for _ in range(3):
+            user = await UserSession(database(), upsert_cache=upsert_cache).create_user(1, "User", "user")
+            assert user == UserInfo(user_id=1, username="user", full_name="User")
+        await UserSession(database(), upsert_cache=upsert_cache).create_user(1, "Renamed", "user")
+
+    asyncio.run(main())
+
+    assert [row["full_name"] for row in database.rows] == ["User", "Renamed"]
+
+
+def test_user_is_buffered_when_write_buffer_is_passed():
+    database = FakeDatabase()
+    buffer = UserWriteBuffer(database)
+
+    async def main():
+        await UserSession(database(), write_buffer=buffer).create_user(1, "User")
+        assert database.rows == []
+        await buffer.flush()
+
+    asyncio.run(main())
+
+    assert [row["user_id"] for row in database.rows] == [1]
@@ -0,0 +1,113 @@
+import asyncio
+import datetime
+from typing import Optional
+
+import aiohttp
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
+
+from bot.paypal import webhook
+from bot.paypal.client import PaypalClient
+
+NOW = datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def make_certificate(
+        name: str,
+        issuer: Optional[x509.Certificate] = None,
+        issuer_key: Optional[ec.EllipticCurvePrivateKey] = None,
+        ca: bool = False,
+        path_length: Optional[int] = None,
+        dns_name: Optional[str] = None
+):
+    """
+    Creates a certificate signed by the issuer (self-signed if it's empty) and its private key.
+    """
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    subject = x509.Name([x509.NameAttribute(x509.NameOID.COMMON_NAME, name)])
+    builder = (
+        x509.CertificateBuilder()
+        .subject_name(subject)
+        .issuer_name(issuer.subject if issuer is not None else subject)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(NOW - datetime.timedelta(days=1))
+        .not_valid_after(NOW + datetime.timedelta(days=1))
+        .add_extension(x509.BasicConstraints(ca=ca, path_length=path_length if ca else None), critical=True)
+        .add_extension(
+            x509.KeyUsage(
+                digital_signature=not ca, content_commitment=False, key_encipherment=False, data_encipherment=False,
+                key_agreement=False, key_cert_sign=ca, crl_sign=ca, encipher_only=False, decipher_only=False
+            ),
+            critical=True
+        )
+    )
+    if dns_name is not None:
+        builder = builder.add_extension(x509.SubjectAlternativeName([x509.DNSName(dns_name)]), critical=False)
+    return builder.sign(issuer_key or key, hashes.SHA256()), key
+
+
+@pytest.fixture
+def root(monkeypatch):
+    certificate, key = make_certificate("Test Root", ca=True)
+    monkeypatch.setattr(webhook, "get_trusted_roots", lambda: {certificate.subject: [certificate]})
+    return certificate, key
+
+
+def test_chain_through_intermediate_is_trusted(root):
+    intermediate, intermediate_key = make_certificate("Test CA", *root, ca=True, path_length=0)
+    leaf, _ = make_certificate("api.paypal.com", intermediate, intermediate_key, dns_name="api.paypal.com")
+
+    assert webhook.verify_chain([leaf, intermediate], NOW) is leaf
+
+
+def test_non_ca_intermediate_is_rejected(root):
+    intermediate, intermediate_key = make_certificate("evil.example.com", *root, dns_name="evil.example.com")
+    leaf, _ = make_certificate("api.paypal.com", intermediate, intermediate_key, dns_name="api.paypal.com")
+
+    with pytest.raises(ValueError, match="not a certificate authority"):
+        webhook.verify_chain([leaf, intermediate], NOW)
+
+
+def test_path_length_is_respected(root):
+    first, first_key = make_certificate("Test CA 1", *root, ca=True, path_length=0)
+    second, second_key = make_certificate("Test CA 2", first, first_key, ca=True)
+    leaf, _ = make_certificate("api.paypal.com", second, second_key, dns_name="api.paypal.com")
+
+    with pytest.raises(ValueError, match="can't issue"):
+        webhook.verify_chain([leaf, second, first], NOW)
+
+
+def test_leaf_must_be_allowed_to_sign(root):
+    leaf, _ = make_certificate("api.paypal.com", *root, ca=True, dns_name="api.paypal.com")
+
+    with pytest.raises(ValueError, match="not allowed to sign"):
+        webhook.verify_chain([leaf], NOW)
+
+
+def test_leaf_must_be_issued_to_paypal(root):
+    leaf, _ = make_certificate("paypal.com.example.com", *root, dns_name="paypal.com.example.com")
+
+    with pytest.raises(ValueError, match="not issued to PayPal"):
+        webhook.verify_chain([leaf], NOW)
+
+
+def test_unreachable_certificate_fails_verification(monkeypatch):
+    class UnreachableSession:
+        def get(self, url):
+            raise aiohttp.ClientConnectionError("connection refused")
+
+    client = PaypalClient("client", "secret")
+    monkeypatch.setattr(client, "_get_session", UnreachableSession)
+    verifier = webhook.WebhookVerifier(client, "WEBHOOK")
+    headers = {
+        "PAYPAL-TRANSMISSION-ID": "TRANSMISSION",
+        "PAYPAL-TRANSMISSION-TIME": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "PAYPAL-TRANSMISSION-SIG": "c2lnbmF0dXJl",
+        "PAYPAL-CERT-URL": "https://api.paypal.com/v1/notifications/certs/CERT",
+    }
+
+    assert asyncio.run(verifier.verify(headers, b"{}")) is False